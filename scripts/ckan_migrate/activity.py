@@ -1,16 +1,20 @@
 import logging
+from ckan_migrate.upsert import StagedUpserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['activity']
 
-def import_activities(old_activities, new_db, valid_users_ids=None):
+
+def import_activities(old_activities, new_db):
     """ Get all old activities from CSV and import them
         Return a list of errors and warnings for the general log
     """
     log.info("Importing activities...")
     ret = {
-        'valid_activities_ids': [],
         'total_rows': 0,
         'migrated_rows': 0,
         'skipped_rows': 0,
@@ -18,57 +22,25 @@ def import_activities(old_activities, new_db, valid_users_ids=None):
         'errors': []
     }
 
-    for activity in old_activities:
+    upsert = StagedUpserter(new_db, "activity", ret, references=MAPPING.references)
+    rows_log = RowLog(log, new_db)
+    for activity in import_rows(old_activities, MAPPING, upsert, ret):
         ret['total_rows'] += 1
-        log.info(f"Importing activity: {activity['id']} (type: {activity['activity_type']})")
+        rows_log.info("Importing activity: %s (type: %s)", activity['id'], activity['activity_type'])
         new_activity = transform_activity(activity)
         if not new_activity:
-            log.warning(f" - Skipping activity {activity['id']}.")
-            ret['skipped_rows'] += 1
-            continue
-
-        if valid_users_ids and new_activity['user_id'] and new_activity['user_id'] not in valid_users_ids:
+            log.warning(" - Skipping activity %s.", activity['id'])
             ret['skipped_rows'] += 1
             continue
 
-        ret['valid_activities_ids'].append(new_activity['id'])
-        fields = new_activity.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the activity ID exists
-        sql = 'SELECT * FROM "activity" WHERE id = %s'
-        new_db.cursor.execute(sql, (activity["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Activity {activity['id']} already exists, updating the record")
-            sql = f'UPDATE "activity" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            try:
-                new_db.cursor.execute(sql, tuple(new_activity[field] for field in fields) + (activity["id"],))
-            except Exception as e:
-                log.error(f" - Error updating activity {activity['id']}: {e}")
-                ret['errors'].append(f"Error updating activity {activity['id']}: {e}")
-                ret['skipped_rows'] += 1
-                # rollback to keep the transaction clean
-                new_db.conn.rollback()
-                continue
-        else:
-            sql = f'INSERT INTO "activity" ({", ".join(fields)}) VALUES ({placeholders})'
-            try:
-                new_db.cursor.execute(sql, tuple(new_activity[field] for field in fields))
-            except Exception as e:
-                log.error(f" - Error inserting activity {activity['id']}: {e}")
-                ret['errors'].append(f"Error inserting activity {activity['id']}: {e}")
-                ret['skipped_rows'] += 1
-                # rollback to keep the transaction clean
-                new_db.conn.rollback()
-                continue
-        log.info(f" - Activity {activity['id']} imported successfully.")
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_activity)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_activity(activity):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old activities looks like:
           {
             "id":"activity-id",
@@ -82,15 +54,4 @@ def transform_activity(activity):
         New activities add:
           - "permission_labels": [] (new field in CKAN 2.11)
     """
-    new_activity = {
-        'id': activity['id'],
-        'timestamp': activity['timestamp'],
-        'user_id': activity['user_id'],
-        'object_id': activity['object_id'],
-        'revision_id': activity['revision_id'],
-        'activity_type': activity['activity_type'],
-        'data': activity['data'],
-        'permission_labels': ['public']  # New field - set to public for migrated activities
-    }
-
-    return new_activity
+    return MAPPING.values(activity)
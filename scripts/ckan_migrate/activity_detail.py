@@ -1,10 +1,15 @@
 import logging
+from ckan_migrate.upsert import StagedUpserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['activity_detail']
 
-def import_activity_details(old_activity_details, new_db, valid_activities_ids=None):
+
+def import_activity_details(old_activity_details, new_db):
     """ Get all old activity details from CSV and import them
         Return a list of errors and warnings for the general log
     """
@@ -17,40 +22,25 @@ def import_activity_details(old_activity_details, new_db, valid_activities_ids=N
         'errors': []
     }
 
-    for activity_detail in old_activity_details:
+    upsert = StagedUpserter(new_db, "activity_detail", ret, references=MAPPING.references)
+    rows_log = RowLog(log, new_db)
+    for activity_detail in import_rows(old_activity_details, MAPPING, upsert, ret):
         ret['total_rows'] += 1
-        log.info(f"Importing activity detail: {activity_detail['id']} (activity: {activity_detail['activity_id']})")
+        rows_log.info("Importing activity detail: %s (activity: %s)", activity_detail['id'], activity_detail['activity_id'])
         new_activity_detail = transform_activity_detail(activity_detail)
         if not new_activity_detail:
-            log.warning(f" - Skipping activity detail {activity_detail['id']}.")
-            ret['skipped_rows'] += 1
-            continue
-
-        if valid_activities_ids and new_activity_detail['activity_id'] not in valid_activities_ids:
+            log.warning(" - Skipping activity detail %s.", activity_detail['id'])
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_activity_detail.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the activity detail ID exists
-        sql = 'SELECT * FROM "activity_detail" WHERE id = %s'
-        new_db.cursor.execute(sql, (activity_detail["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Activity detail {activity_detail['id']} already exists, updating the record")
-            sql = f'UPDATE "activity_detail" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            new_db.cursor.execute(sql, tuple(new_activity_detail[field] for field in fields) + (activity_detail["id"],))
-        else:
-            sql = f'INSERT INTO "activity_detail" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_activity_detail[field] for field in fields))
-        log.info(f" - Activity detail {activity_detail['id']} imported successfully.")
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_activity_detail)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_activity_detail(activity_detail):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old activity details looks like:
           {
             "id":"activity-detail-id",
@@ -61,13 +51,4 @@ def transform_activity_detail(activity_detail):
             "data":"{\"package\": {...}}"
         },
     """
-    new_activity_detail = {
-        'id': activity_detail['id'],
-        'activity_id': activity_detail['activity_id'],
-        'object_id': activity_detail['object_id'],
-        'object_type': activity_detail['object_type'],
-        'activity_type': activity_detail['activity_type'],
-        'data': activity_detail['data']
-    }
-
-    return new_activity_detail
+    return MAPPING.values(activity_detail)
@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['dashboard']
+
 
 def import_dashboards(old_dashboards, new_db, valid_users_ids=None):
     """ Get all old dashboards from CSV and import them
@@ -17,40 +22,35 @@ def import_dashboards(old_dashboards, new_db, valid_users_ids=None):
         'errors': []
     }
 
-    for dashboard in old_dashboards:
+    # Dashboards of users that were not imported are left out
+    valid_ids = {'user_id': valid_users_ids} if valid_users_ids else None
+
+    def transform_batch(batch):
+        return MAPPING.transform_batch(batch, valid_ids=valid_ids)
+
+    upsert = Upserter(new_db, "dashboard", ret, key=('user_id',))
+    rows_log = RowLog(log, new_db)
+    for dashboard in import_rows(old_dashboards, MAPPING, upsert, ret, transform_batch):
         ret['total_rows'] += 1
-        log.info(f"Importing dashboard for user: {dashboard['user_id']}")
+        rows_log.info("Importing dashboard for user: %s", dashboard['user_id'])
         new_dashboard = transform_dashboard(dashboard)
         if not new_dashboard:
-            log.warning(f" - Skipping dashboard for user {dashboard['user_id']}.")
+            log.warning(" - Skipping dashboard for user %s.", dashboard['user_id'])
             ret['skipped_rows'] += 1
             continue
 
-        if valid_users_ids and new_dashboard['user_id'] not in valid_users_ids:
+        if valid_users_ids and dashboard['user_id'] not in valid_users_ids:
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_dashboard.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the dashboard for this user exists
-        sql = 'SELECT * FROM "dashboard" WHERE user_id = %s'
-        new_db.cursor.execute(sql, (dashboard["user_id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Dashboard for user {dashboard['user_id']} already exists, updating the record")
-            sql = f'UPDATE "dashboard" SET ({", ".join(fields)}) = ({placeholders}) WHERE user_id= %s'
-            new_db.cursor.execute(sql, tuple(new_dashboard[field] for field in fields) + (dashboard["user_id"],))
-        else:
-            sql = f'INSERT INTO "dashboard" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_dashboard[field] for field in fields))
-        log.info(f" - Dashboard for user {dashboard['user_id']} imported successfully.")
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_dashboard)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_dashboard(dashboard):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old dashboards looks like:
           {
             "user_id":"user-id",
@@ -58,10 +58,4 @@ def transform_dashboard(dashboard):
             "email_last_sent":"2017-03-21 18:23:56.055936"
         },
     """
-    new_dashboard = {
-        'user_id': dashboard['user_id'],
-        'activity_stream_last_viewed': dashboard['activity_stream_last_viewed'],
-        'email_last_sent': dashboard['email_last_sent']
-    }
-
-    return new_dashboard
+    return MAPPING.values(dashboard)
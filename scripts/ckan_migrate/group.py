@@ -1,8 +1,15 @@
 import logging
+import pyarrow as pa
+from ckan_migrate.id_registry import IdRegistry
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['group']
+
 
 def import_groups(old_groups, new_db):
     """ Get all old groups from CSV and import them """
@@ -13,15 +20,26 @@ def import_groups(old_groups, new_db):
         'skipped_rows': 0,
         'warnings': [],
         'errors': [],
-        'valid_groups_ids': []  # Initialize valid_groups_ids here
+        'valid_groups_ids': IdRegistry()
     }
-    names_in_use = []
-    for group in old_groups:
+    names_in_use = set()
+
+    def register_written(keys):
+        # Only the groups that were written are valid for the other tables
+        for (group_id,) in keys:
+            ret['valid_groups_ids'].add(group_id)
+
+    def transform_batch(batch):
+        return transform_group_batch(batch, ret, names_in_use)
+
+    upsert = Upserter(new_db, "group", ret, written=register_written)
+    rows_log = RowLog(log, new_db)
+    for group in import_rows(old_groups, MAPPING, upsert, ret, transform_batch):
         ret['total_rows'] += 1
-        log.info(f"Importing group: {group['name']}")
+        rows_log.info("Importing group: %s", group['name'])
         new_group = transform_group(group)
         if not new_group:
-            log.warning(f" - Skipping group {group['name']}.")
+            log.warning(" - Skipping group %s.", group['name'])
             ret['skipped_rows'] += 1
             continue
 
@@ -33,30 +51,37 @@ def import_groups(old_groups, new_db):
                 f" - Group '{original_name}' has a duplicate name."
                 f" New name: {new_group['name']} (old: {original_name})"
             )
-        ret['valid_groups_ids'].append(new_group['id'])
-
-        fields = new_group.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the group ID exists
-        sql = 'SELECT * FROM "group" WHERE id = %s'
-        new_db.cursor.execute(sql, (group["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Group {group['name']} already exists, updating the record")
-            sql = f'UPDATE "group" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            new_db.cursor.execute(sql, tuple(new_group[field] for field in fields) + (group["id"],))
-        else:
-            sql = f'INSERT INTO "group" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_group[field] for field in fields))
-        log.info(f" - Group {group['name']} imported successfully.")
-        names_in_use.append(new_group['name'])
-        ret['migrated_rows'] += 1
-
-    new_db.conn.commit()
+
+        upsert.add(new_group)
+        names_in_use.add(new_group['name'])
+
+    upsert.close()
     return ret
 
 
+def transform_group_batch(batch, ret, names_in_use):
+    """ Like the rows loop of import_groups, for an Arrow record batch of
+        old groups. Only the duplicate names are checked row by row.
+    """
+    batch = MAPPING.transform_batch(batch)
+    columns = dict(zip(batch.schema.names, batch.columns))
+    names = columns['name'].to_pylist()
+    ids = columns['id'].to_pylist()
+    for i, name in enumerate(names):
+        if name in names_in_use:
+            # Add a suffix to the name
+            names[i] = f"{name}_{hash(ids[i])}"
+            ret['errors'].append(
+                f" - Group '{name}' has a duplicate name."
+                f" New name: {names[i]} (old: {name})"
+            )
+        names_in_use.add(names[i])
+    columns['name'] = pa.array(names, type=columns['name'].type)
+    return pa.RecordBatch.from_arrays(list(columns.values()), names=list(columns))
+
+
 def transform_group(group, migrate_deleted=True):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return a dict for the new DB object (see MAPPING)
         Old groups looks like:
           {
             "id":"group-id",
@@ -75,17 +100,4 @@ def transform_group(group, migrate_deleted=True):
     if not migrate_deleted and group['state'] == 'deleted':
         return None
 
-    new_group = {
-        'id': group['id'],
-        'name': group['name'],
-        'title': group['title'],
-        'description': group['description'],
-        'created': group['created'],
-        'state': group['state'],
-        'type': group['type'],
-        'approval_status': group['approval_status'],
-        'image_url': group['image_url'],
-        'is_organization': group['is_organization']
-    }
-
-    return new_group
+    return MAPPING.transform(group)
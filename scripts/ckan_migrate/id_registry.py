@@ -0,0 +1,203 @@
+import uuid
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+# 128 bits values (UUIDs, hashes), as big-endian bytes so they sort like the integers
+UUID_DTYPE = np.dtype('S16')
+
+# Added values are merged in the sorted array when they are more than this
+# share of it (and at least MERGE_MIN), so each add costs O(log n) amortized
+MERGE_RATIO = 0.125
+MERGE_MIN = 4096
+
+# Canonical (lowercase, hyphenated) UUID strings
+UUID_PATTERN = r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
+
+
+class Bytes16Set:
+    """ Set of 16 bytes values (UUIDs, 128 bits hashes) kept in a sorted NumPy
+        array, 16 bytes per value, so lookups are binary searches and many
+        values can be tested at once (contains_many).
+        Added values wait in a Python set until they are MERGE_RATIO of the
+        array, so a lookup after each add does not merge the whole array.
+        Worker processes read the array from shared memory (see share).
+    """
+
+    def __init__(self, values=None):
+        self.array = np.empty(0, dtype=UUID_DTYPE)
+        self.pending = set()
+        # The shared memory block of the array, in worker processes (see attach)
+        self.shared_memory = None
+        if values is not None:
+            self.array = np.unique(np.asarray(values, dtype=UUID_DTYPE))
+
+    def share(self):
+        """ Copy the array to a shared memory block, so worker processes can
+            use the set without copying it (see attach).
+            Return (shared_memory, handle): `handle` is sent to the workers and
+            `shared_memory` must be unlinked once they are done.
+        """
+        self._merge_pending()
+        shared_memory = SharedMemory(create=True, size=max(self.array.nbytes, 1))
+        shared = np.ndarray(self.array.shape, dtype=UUID_DTYPE, buffer=shared_memory.buf)
+        shared[:] = self.array
+        return shared_memory, (shared_memory.name, len(self.array))
+
+    @classmethod
+    def attach(cls, handle):
+        """ Set reading the array shared by Bytes16Set.share. Values added
+            in the worker are merged in a copy of the array, not shared.
+        """
+        name, size = handle
+        values = cls()
+        values.shared_memory = SharedMemory(name=name)
+        values.array = np.ndarray((size,), dtype=UUID_DTYPE, buffer=values.shared_memory.buf)
+        return values
+
+    def add(self, value):
+        if value in self:
+            return
+        self.pending.add(value)
+        if len(self.pending) > max(MERGE_MIN, len(self.array) * MERGE_RATIO):
+            self._merge_pending()
+
+    def _merge_pending(self):
+        if self.pending:
+            added = np.array(list(self.pending), dtype=UUID_DTYPE)
+            self.array = np.union1d(self.array, added)
+            self.pending = set()
+
+    def __contains__(self, value):
+        if value in self.pending:
+            return True
+        position = np.searchsorted(self.array, value)
+        # NumPy strips the trailing null bytes of S16 values
+        return position < len(self.array) and self.array[position] == value.rstrip(b'\x00')
+
+    def contains_many(self, values):
+        """ Return a boolean array, True for each of `values` (a S16 array) in the set """
+        found = np.zeros(len(values), dtype=bool)
+        if len(self.array):
+            positions = np.searchsorted(self.array, values)
+            in_range = positions < len(self.array)
+            found[in_range] = self.array[positions[in_range]] == values[in_range]
+        if self.pending:
+            pending = np.array(list(self.pending), dtype=UUID_DTYPE)
+            found |= np.isin(values, pending)
+        return found
+
+    def __len__(self):
+        return len(self.array) + len(self.pending)
+
+    def __iter__(self):
+        self._merge_pending()
+        for value in self.array:
+            # NumPy strips the trailing null bytes of S16 values
+            yield value.ljust(16, b'\x00')
+
+
+def uuid_array(ids):
+    """ UUIDs of an Arrow string array of canonical UUID strings, as a S16
+        array, with no Python work per ID. Nulls and other strings are
+        left out: return (uuids, mask) with the mask of the UUID strings.
+    """
+    mask = pc.fill_null(pc.match_substring_regex(ids, UUID_PATTERN), False)
+    hex_digits = pc.replace_substring(ids.filter(mask), '-', '')
+    mask = mask.to_numpy(zero_copy_only=False)
+    if not len(hex_digits):
+        return np.empty(0, dtype=UUID_DTYPE), mask
+    # The 32 hex digits of each UUID follow each other in the data buffer
+    _, offsets, data = hex_digits.buffers()
+    start = np.frombuffer(offsets, dtype=np.int32)[hex_digits.offset]
+    digits = np.frombuffer(data, dtype=np.uint8)[start:start + len(hex_digits) * 32]
+    # '0'-'9' are 48-57 and 'a'-'f' are 97-102
+    nibbles = np.where(digits >= 97, digits - 87, digits - 48).astype(np.uint8).reshape(-1, 2)
+    values = (nibbles[:, 0] << 4) | nibbles[:, 1]
+    return np.ascontiguousarray(values).view(UUID_DTYPE), mask
+
+
+class IdRegistry:
+    """ Set of the IDs imported to a table (e.g. the valid users IDs), used
+        to filter the rows of other tables that point to them.
+        UUIDs are stored as 128 bits integers in a Bytes16Set (16 bytes per ID
+        instead of a ~90 bytes Python string), so lookups are binary searches
+        and whole columns of IDs can be tested at once (contains_many).
+        IDs that are not UUIDs are kept in a regular set.
+        Worker processes read the registry from shared memory (see share).
+    """
+
+    def __init__(self, ids=None):
+        self.uuids = Bytes16Set()
+        self.others = set()
+        for id_ in ids or []:
+            self.add(id_)
+
+    def share(self):
+        """ Share the UUIDs with worker processes (see Bytes16Set.share).
+            Return (shared_memory, handle) for IdRegistry.attach.
+        """
+        shared_memory, handle = self.uuids.share()
+        return shared_memory, (handle, self.others)
+
+    @classmethod
+    def attach(cls, handle):
+        """ Registry reading the UUIDs shared by IdRegistry.share """
+        uuids_handle, others = handle
+        registry = cls()
+        registry.uuids = Bytes16Set.attach(uuids_handle)
+        registry.others = set(others)
+        return registry
+
+    @staticmethod
+    def _uuid_bytes(id_):
+        """ UUID of a canonical (lowercase, hyphenated) UUID string, as bytes """
+        try:
+            value = uuid.UUID(id_)
+        except (TypeError, ValueError, AttributeError):
+            return None
+        # Other spellings of the same UUID are different IDs in the database
+        if str(value) != id_:
+            return None
+        return value.bytes
+
+    def add(self, id_):
+        value = self._uuid_bytes(id_)
+        if value is None:
+            self.others.add(id_)
+        else:
+            self.uuids.add(value)
+
+    def __contains__(self, id_):
+        value = self._uuid_bytes(id_)
+        if value is None:
+            return id_ in self.others
+        return value in self.uuids
+
+    def contains_many(self, ids):
+        """ Return a boolean array, True for each of `ids` (an Arrow string
+            array, or a list of strings) in the registry. Nulls are not.
+        """
+        if isinstance(ids, pa.ChunkedArray):
+            ids = ids.combine_chunks()
+        elif not isinstance(ids, pa.Array):
+            ids = pa.array(ids, type=pa.string())
+        if not pa.types.is_string(ids.type):
+            ids = pc.cast(ids, pa.string())
+        values, is_uuid = uuid_array(ids)
+        found = np.zeros(len(ids), dtype=bool)
+        found[is_uuid] = self.uuids.contains_many(values)
+        if self.others:
+            others = np.flatnonzero(~is_uuid)
+            found[others] = [id_ in self.others for id_ in ids.take(others).to_pylist()]
+        return found
+
+    def __len__(self):
+        return len(self.uuids) + len(self.others)
+
+    def __iter__(self):
+        for value in self.uuids:
+            yield str(uuid.UUID(bytes=value))
+        yield from self.others
@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+from ckan_migrate.id_registry import UUID_DTYPE, Bytes16Set
+
+
+log = logging.getLogger(__name__)
+
+# Rows read per round trip when loading the keys
+KEY_FETCH_SIZE = 50000
+
+# Column types whose text is the value itself, the keys of other types
+# are normalized by the DB (see KeyIndex.normalize)
+TEXT_TYPES = {'text', 'character varying'}
+
+# Text of the NULL values of a key. PostgreSQL text can not contain NUL
+# characters, so no value has this text
+NULL_KEY = '\x00NULL'
+
+
+def key_text(value):
+    """ Text of a value of a key column (see NULL_KEY) """
+    return NULL_KEY if value is None else str(value)
+
+
+def key_label(key):
+    """ A key as the text of the errors and the quarantine files """
+    return ", ".join('NULL' if value == NULL_KEY else value for value in key)
+
+
+def key_hash(key):
+    """ 128 bits hash of a key (a tuple of strings). The values are joined
+        with NUL characters, that no value but NULL_KEY has
+    """
+    return hashlib.blake2b('\x00'.join(key).encode(), digest_size=16).digest()
+
+
+class KeyIndex:
+    """ Keys of the rows that already exist in a table of the new DB.
+        The key columns (and only them) are read once, with a server-side
+        cursor, so the importers know locally if a row must be inserted or
+        updated.
+        Keys are tuples of strings (the text of each key column, as the DB
+        writes it: the keys of the rows to import are normalized first).
+        They are kept as 128 bits hashes in a Bytes16Set, 16 bytes per key
+        whatever its columns.
+        The keys loaded once can be read by worker processes from shared
+        memory (see share).
+    """
+
+    def __init__(self, new_db, table, key, types):
+        self.new_db = new_db
+        self.table = table
+        self.key = tuple(key)
+        self.types = types
+        self.hashes = None
+        self.cast = any(self.types.get(field, 'text') not in TEXT_TYPES for field in self.key)
+
+    def load(self):
+        columns = ", ".join(f'"{field}"::text' for field in self.key)
+        cursor = self.new_db.conn.cursor(name=f"keys_{self.table}")
+        cursor.itersize = KEY_FETCH_SIZE
+        cursor.execute(f'SELECT {columns} FROM "{self.table}"')
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(KEY_FETCH_SIZE)
+            if not rows:
+                break
+            hashes = [key_hash(tuple(key_text(value) for value in row)) for row in rows]
+            chunks.append(np.array(hashes, dtype=UUID_DTYPE))
+        cursor.close()
+        self.hashes = Bytes16Set(np.concatenate(chunks) if chunks else [])
+        log.info(" - %s: %s existing keys loaded", self.table, len(self.hashes))
+
+    def share(self):
+        """ Share the keys with worker processes (see Bytes16Set.share).
+            Return (shared_memory, handle) for KeyIndex.attach.
+        """
+        if self.hashes is None:
+            self.load()
+        shared_memory, handle = self.hashes.share()
+        return shared_memory, (self.table, self.key, self.types, handle)
+
+    @classmethod
+    def attach(cls, new_db, handle):
+        """ Index reading the keys shared by KeyIndex.share. The keys inserted
+            by the worker are only added to its own copy.
+        """
+        table, key, types, hashes_handle = handle
+        index = cls(new_db, table, key, types)
+        index.hashes = Bytes16Set.attach(hashes_handle)
+        return index
+
+    def normalize(self, keys):
+        """ Map each of `keys` (tuples of strings) to the text of its values
+            in the column types of the table, like the loaded keys (e.g.
+            '10.0' is '10' in a double precision column and timestamps are
+            written by the DB). Return {key: normalized key}, or None when
+            all the key columns are text and the keys are already normalized.
+            Keys that are not valid values of their columns are kept as they
+            are, their rows fail when they are written.
+        """
+        if not self.cast:
+            return None
+        normalized = {key: key for key in keys}
+        if normalized:
+            normalized.update(self._cast(list(normalized)))
+        return normalized
+
+    def _cast(self, keys):
+        """ Cast the `keys` by the DB, in halves when some are not valid """
+        count = len(self.key)
+        columns = ", ".join(f"k{i}" for i in range(count))
+        casted = ", ".join(f"k{i}::{self.types.get(field, 'text')}::text" for i, field in enumerate(self.key))
+        cursor = self.new_db.conn.cursor()
+        cursor.execute("SAVEPOINT normalize_keys")
+        try:
+            found = execute_values(
+                cursor, f'SELECT {columns}, {casted} FROM (VALUES %s) AS v ({columns})',
+                [[None if value == NULL_KEY else value for value in key] for key in keys],
+                page_size=len(keys), fetch=True
+            )
+            cursor.execute("RELEASE SAVEPOINT normalize_keys")
+        except psycopg2.DataError:
+            cursor.execute("ROLLBACK TO SAVEPOINT normalize_keys")
+            if len(keys) == 1:
+                return {}
+            half = len(keys) // 2
+            return {**self._cast(keys[:half]), **self._cast(keys[half:])}
+        finally:
+            cursor.close()
+        return {tuple(map(key_text, row[:count])): tuple(map(key_text, row[count:])) for row in found}
+
+    def add(self, keys):
+        """ Add the keys of the inserted rows """
+        for key in keys:
+            self.hashes.add(key_hash(key))
+
+    def existing(self, keys):
+        """ Return the set of `keys` that exist in the table. Keys with
+            NULL values never exist: NULLs are never equal in SQL (nor in
+            the unique indexes), their rows are inserted.
+        """
+        if self.hashes is None:
+            self.load()
+        keys = list(keys)
+        found = self.hashes.contains_many(np.array([key_hash(key) for key in keys], dtype=UUID_DTYPE))
+        return {key for key, exists in zip(keys, found) if exists and NULL_KEY not in key}
@@ -0,0 +1,92 @@
+import logging
+import logging.handlers
+import queue
+import time
+
+
+LOG_FILE = 'migration.log'
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# One row of each table is logged every LOG_EVERY rows (default for
+# --log-every) or every LOG_SECONDS seconds (default for --log-seconds)
+LOG_EVERY = 10000
+LOG_SECONDS = 10
+
+
+class RowLog:
+    """ Sampled log of the rows read by an importer. Only the first row,
+        one every `log_every` rows and one every `log_seconds` seconds are
+        logged (both from the new_db attributes, see --log-every), with the
+        number of rows read so far. The message is a %-style template, it is
+        only formatted for the rows that are logged.
+        Warnings and errors are not sampled, log them with the logger.
+    """
+
+    def __init__(self, log, new_db=None):
+        self.log = log
+        self.every = getattr(new_db, 'log_every', LOG_EVERY)
+        self.seconds = getattr(new_db, 'log_seconds', LOG_SECONDS)
+        self.rows = 0
+        self.next_row = 1
+        self.next_time = time.monotonic() + self.seconds if self.seconds else None
+
+    def info(self, msg, *args):
+        self.rows += 1
+        if self.rows >= self.next_row:
+            self.next_row = self.rows + self.every if self.every else float('inf')
+        elif self.next_time is None or time.monotonic() < self.next_time:
+            return
+        if self.next_time is not None:
+            self.next_time = time.monotonic() + self.seconds
+        self.log.info(msg + " (%d rows read)", *args, self.rows)
+
+
+class _LocalQueueHandler(logging.handlers.QueueHandler):
+    """ Put the records in a queue of this process as they are, the
+        listener thread formats them (QueueHandler formats them first,
+        to send them to other processes)
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(log_file=LOG_FILE, mode='a'):
+    """ Log to the console and to `log_file` from a background thread:
+        the loggers only put their records in a queue and the listener
+        formats and writes them, so the import threads do not wait for
+        the console or the disk.
+        Return the listener, stop it at the end to write the last records.
+    """
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(), logging.FileHandler(log_file, mode)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, *handlers)
+    root = logging.getLogger()
+    root.handlers = [_LocalQueueHandler(records)]
+    root.setLevel(logging.INFO)
+    listener.start()
+    return listener
+
+
+def worker_log_queue(context):
+    """ Queue for the records of worker processes (started with the
+        multiprocessing `context`, see --table-workers), handled by the
+        handlers of this process (see setup_worker_logging).
+        Return (queue, listener), stop the listener once the workers exit.
+    """
+    records = context.Queue()
+    listener = logging.handlers.QueueListener(records, *logging.getLogger().handlers)
+    listener.start()
+    return records, listener
+
+
+def setup_worker_logging(records):
+    """ Send the records of a worker process to the queue of the main
+        process (see worker_log_queue)
+    """
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(records)]
+    root.setLevel(logging.INFO)
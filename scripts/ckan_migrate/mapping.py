@@ -0,0 +1,264 @@
+import logging
+from operator import itemgetter
+import pyarrow as pa
+
+
+log = logging.getLogger(__name__)
+
+
+class TableMapping:
+    """ How the rows of an old table become rows of the new table:
+          keep: old columns copied as they are
+          rename: {new column: old column}
+          fallback: {new column: old column}, the new column is copied from the
+            old column when the old table does not have it (e.g. resources
+            get a metadata_modified from their created date)
+          constants: {new column: value}, the same value for every row
+          drop: old columns that are not migrated
+          references: the rows to reject (orphans), whose column has no row in
+            another table of the new DB (see StagedUpserter). The referenced
+            tables are imported first (see migrate.import_dependencies)
+        The rules are compiled once (see compile) into a function that returns
+        the values of a new row as a tuple, in the order of `fields`, or applied
+        to whole columns of Arrow record batches (see transform_batch).
+    """
+
+    def __init__(self, table, keep=(), rename=None, fallback=None, constants=None, drop=(), references=()):
+        self.table = table
+        self.keep = tuple(keep)
+        self.rename = rename or {}
+        self.fallback = fallback or {}
+        self.constants = constants or {}
+        self.drop = tuple(drop)
+        self.references = list(references)
+        # Columns of the new rows, in the order of the values
+        self.fields = self.keep + tuple(self.rename) + tuple(self.fallback) + tuple(self.constants)
+        self._sources = {}
+        self._values = {}
+
+    def sources(self, old_columns):
+        """ Old column of each new column (but the constants) for the old
+            rows with these `old_columns`
+        """
+        old_columns = tuple(old_columns)
+        if old_columns not in self._sources:
+            sources = list(self.keep) + list(self.rename.values())
+            sources += [new if new in old_columns else old for new, old in self.fallback.items()]
+            unknown = [column for column in old_columns if column not in sources and column not in self.drop]
+            if unknown:
+                log.warning(" - Columns of the old %s table that are not migrated: %s", self.table, ', '.join(unknown))
+            self._sources[old_columns] = sources
+        return self._sources[old_columns]
+
+    def compile(self, old_columns):
+        """ Build the function that returns the values of the new row
+            for the old rows with these `old_columns`
+        """
+        sources = self.sources(old_columns)
+        getter = itemgetter(*sources)
+        if len(sources) == 1:
+            single = getter
+
+            def getter(row):
+                return (single(row),)
+        constants = tuple(self.constants.values())
+        if not constants:
+            return getter
+
+        def values(row):
+            return getter(row) + constants
+        return values
+
+    def values(self, row):
+        """ Values of the new row for an old row (a dict), as a tuple in the
+            order of `fields`. The function is compiled once for each set of
+            old columns (e.g. resources with or without metadata_modified).
+        """
+        columns = tuple(row.keys())
+        values = self._values.get(columns)
+        if values is None:
+            values = self._values[columns] = self.compile(columns)
+        return values(row)
+
+    def transform(self, row):
+        """ New row for an old row, as a dict """
+        return dict(zip(self.fields, self.values(row)))
+
+    def transform_batch(self, batch, valid_ids=None):
+        """ New rows for an Arrow record batch of old rows, as a record batch
+            with the columns in the order of `fields`. Columns are selected,
+            renamed and repeated (constants) as a whole.
+            `valid_ids` ({old column: IdRegistry}) leaves out the rows whose
+            column is not in its registry, tested for the whole column (see
+            IdRegistry.contains_many).
+        """
+        for column, registry in (valid_ids or {}).items():
+            batch = batch.filter(pa.array(registry.contains_many(batch.column(column))))
+        arrays = [batch.column(source) for source in self.sources(batch.schema.names)]
+        arrays += [pa.repeat(value, batch.num_rows) for value in self.constants.values()]
+        return pa.RecordBatch.from_arrays(arrays, names=list(self.fields))
+
+
+MAPPINGS = {}
+
+
+def register(mapping):
+    """ Add the mapping of a table to MAPPINGS """
+    MAPPINGS[mapping.table] = mapping
+    return mapping
+
+
+def import_batches(batches, upsert, ret, transform):
+    """ Import Arrow record batches of old rows (see loaders.TableRows),
+        transformed by columns with `transform` (e.g. the transform_batch
+        of their mapping), with no Python loop per row for a StagedUpserter.
+        The rows left out by `transform` are skipped.
+    """
+    for batch in batches:
+        ret['total_rows'] += batch.num_rows
+        new_batch = transform(batch)
+        skipped = batch.num_rows - new_batch.num_rows
+        if skipped:
+            log.warning(" - Skipping %s %s rows of a batch of %s", skipped, upsert.table, batch.num_rows)
+            ret['skipped_rows'] += skipped
+        upsert.add_batch(new_batch)
+
+
+def import_rows(old_rows, mapping, upsert, ret, transform=None):
+    """ Old rows that the importer transforms one by one. The rows of
+        extracted tables (see loaders.TableRows) are imported here by
+        whole columns instead (see import_batches), with `transform` or
+        the transform_batch of their `mapping`, and none is returned.
+    """
+    if hasattr(old_rows, 'batches'):
+        import_batches(old_rows.batches(), upsert, ret, transform or mapping.transform_batch)
+        return ()
+    return old_rows
+
+
+# revision_id is deprecated in new CKAN, it is dropped from most tables
+register(TableMapping(
+    'activity',
+    keep=('id', 'timestamp', 'user_id', 'object_id', 'revision_id', 'activity_type', 'data'),
+    # New field in CKAN 2.11, migrated activities are public
+    constants={'permission_labels': ['public']},
+    # Activities from users that do not exist in the new DB are rejected
+    references=[{'column': 'user_id', 'table': 'user'}],
+))
+register(TableMapping(
+    'activity_detail',
+    keep=('id', 'activity_id', 'object_id', 'object_type', 'activity_type', 'data'),
+    # Details of activities that were not imported are rejected
+    references=[{'column': 'activity_id', 'table': 'activity'}],
+))
+register(TableMapping(
+    'dashboard',
+    keep=('user_id', 'activity_stream_last_viewed', 'email_last_sent'),
+))
+register(TableMapping(
+    'group',
+    keep=(
+        'id', 'name', 'title', 'description', 'created', 'state', 'type', 'approval_status',
+        'image_url', 'is_organization',
+    ),
+    drop=('revision_id',),
+))
+register(TableMapping(
+    'group_extra',
+    keep=('id', 'group_id', 'key', 'value', 'state'),
+    drop=('revision_id',),
+))
+register(TableMapping(
+    'member',
+    keep=('id', 'table_id', 'group_id', 'state', 'table_name', 'capacity'),
+    drop=('revision_id',),
+    # Members from users or groups that do not exist in the new DB are rejected
+    references=[
+        {'column': 'table_id', 'table': 'user', 'when': "table_name = 'user'"},
+        {'column': 'group_id', 'table': 'group'},
+    ],
+))
+register(TableMapping(
+    'package',
+    keep=(
+        'id', 'name', 'title', 'version', 'url', 'notes', 'license_id', 'author', 'author_email',
+        'maintainer', 'maintainer_email', 'state', 'type', 'owner_org', 'private', 'metadata_modified',
+        'creator_user_id', 'metadata_created',
+    ),
+    # plugin_data is a new field in CKAN 2.11 but we don't have data for it
+    drop=('revision_id',),
+))
+register(TableMapping(
+    'package_extra',
+    keep=('id', 'package_id', 'key', 'value', 'state'),
+    drop=('revision_id',),
+    # Extras of packages that were not imported are rejected
+    references=[{'column': 'package_id', 'table': 'package'}],
+))
+register(TableMapping(
+    'package_relationship',
+    keep=('id', 'subject_package_id', 'object_package_id', 'type', 'comment', 'state'),
+    drop=('revision_id',),
+))
+register(TableMapping(
+    'package_tag',
+    keep=('id', 'package_id', 'tag_id', 'state'),
+    drop=('revision_id',),
+))
+register(TableMapping(
+    'rating',
+    keep=('id', 'user_id', 'user_ip_address', 'package_id', 'rating', 'created'),
+))
+register(TableMapping(
+    'resource',
+    keep=(
+        'id', 'url', 'format', 'description', 'position', 'hash', 'state', 'extras', 'name',
+        'resource_type', 'mimetype', 'mimetype_inner', 'size', 'last_modified', 'cache_url',
+        'cache_last_updated', 'created', 'url_type', 'package_id',
+    ),
+    # New in CKAN 2.11, the created date is used when the old table does not have it
+    fallback={'metadata_modified': 'created'},
+    drop=('revision_id', 'webstore_url', 'webstore_last_updated'),
+))
+register(TableMapping(
+    'resource_view',
+    keep=('id', 'resource_id', 'title', 'description', 'view_type', 'order', 'config'),
+))
+register(TableMapping(
+    'system_info',
+    keep=('id', 'key', 'value', 'state'),
+    drop=('revision_id',),
+))
+register(TableMapping(
+    'tag',
+    keep=('id', 'name', 'vocabulary_id'),
+))
+register(TableMapping(
+    'task_status',
+    keep=('id', 'entity_id', 'entity_type', 'task_type', 'key', 'value', 'state', 'error', 'last_updated'),
+))
+register(TableMapping(
+    'term_translation',
+    keep=('term', 'term_translation', 'lang_code'),
+))
+register(TableMapping(
+    'tracking_raw',
+    keep=('user_key', 'url', 'tracking_type', 'access_timestamp'),
+))
+register(TableMapping(
+    'user',
+    keep=('id', 'name', 'email', 'about', 'created', 'fullname', 'sysadmin', 'state'),
+    drop=('apikey', 'openid', 'password', 'reset_key', 'activity_streams_email_notifications'),
+))
+register(TableMapping(
+    'user_following_dataset',
+    keep=('follower_id', 'object_id', 'datetime'),
+))
+register(TableMapping(
+    'user_following_group',
+    keep=('follower_id', 'object_id', 'datetime'),
+))
+register(TableMapping(
+    'vocabulary',
+    keep=('id', 'name'),
+))
@@ -1,10 +1,15 @@
 import logging
+from ckan_migrate.upsert import StagedUpserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['member']
 
-def import_members(old_members, new_db, valid_users_ids=None):
+
+def import_members(old_members, new_db):
     """ Get all old members from CSV and import them
         Return a list of errors and warnings for the general log
     """
@@ -17,45 +22,25 @@ def import_members(old_members, new_db, valid_users_ids=None):
         'errors': []
     }
 
-    for member in old_members:
+    upsert = StagedUpserter(new_db, "member", ret, references=MAPPING.references)
+    rows_log = RowLog(log, new_db)
+    for member in import_rows(old_members, MAPPING, upsert, ret):
         ret['total_rows'] += 1
-        log.info(f"Importing member: {member['id']} (table: {member['table_name']}, capacity: {member['capacity']})")
+        rows_log.info("Importing member: %s (table: %s, capacity: %s)", member['id'], member['table_name'], member['capacity'])
         new_member = transform_member(member)
         if not new_member:
-            log.warning(f" - Skipping member {member['id']}.")
-            ret['skipped_rows'] += 1
-            continue
-
-        # if table is "user", check if the user_id exists in the new DB
-        if member['table_name'] == 'user' and valid_users_ids and member['table_id'] not in valid_users_ids:
-            ret['errors'].append(
-                f" - Member '{member['id']}' ignored, has a table_id '{member['table_id']}'"
-                " that does not exist in the new database. Setting it to None."
-            )
+            log.warning(" - Skipping member %s.", member['id'])
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_member.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the member ID exists
-        sql = 'SELECT * FROM "member" WHERE id = %s'
-        new_db.cursor.execute(sql, (member["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Member {member['id']} already exists, updating the record")
-            sql = f'UPDATE "member" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            new_db.cursor.execute(sql, tuple(new_member[field] for field in fields) + (member["id"],))
-        else:
-            sql = f'INSERT INTO "member" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_member[field] for field in fields))
-        log.info(f" - Member {member['id']} imported successfully.")
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_member)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_member(member, migrate_deleted=True):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old members looks like:
           {
             "id":"member-id",
@@ -70,15 +55,4 @@ def transform_member(member, migrate_deleted=True):
     if not migrate_deleted and member['state'] == 'deleted':
         return None
 
-    new_member = {
-        'id': member['id'],
-        'table_id': member['table_id'],
-        'group_id': member['group_id'],
-        'state': member['state'],
-        'table_name': member['table_name'],
-        'capacity': member['capacity']
-    }
-
-    # Note: revision_id is deprecated in new CKAN - we skip it
-
-    return new_member
+    return MAPPING.values(member)
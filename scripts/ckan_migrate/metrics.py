@@ -0,0 +1,364 @@
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+
+log = logging.getLogger(__name__)
+
+# Counters of each table: rows read, written to the new DB and skipped,
+# and bytes written (extraction)
+COUNTERS = ('total_rows', 'migrated_rows', 'skipped_rows', 'bytes')
+
+# Defaults for --status-file and --metrics-interval
+STATUS_FILE = 'migration_status.json'
+INTERVAL = 10
+
+
+class Metrics:
+    """ Live progress of the tables of an extraction or a migration (the
+        `phase`). The counters of each table come from the `ret` dicts of
+        the importers (see track), from updates of the extractor (see
+        update) and from the shared memory of the worker processes (see
+        share). A background thread rewrites every `interval` seconds the
+        JSON `status_file`, the Prometheus textfile collector file
+        `prometheus_file` and, with `console`, a progress line on stderr.
+        The ETA of each table comes from its expected rows (see expect).
+    """
+
+    def __init__(self, phase, status_file=STATUS_FILE, prometheus_file=None, console=False, interval=INTERVAL):
+        self.phase = phase
+        self.status_file = status_file
+        self.prometheus_file = prometheus_file
+        self.console = console
+        self.interval = interval
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _table(self, table):
+        if table not in self.tables:
+            self.tables[table] = {'expected': None, 'started': None, 'finished': None, 'failed': False, 'parts': {}}
+        return self.tables[table]
+
+    def expect(self, estimates):
+        """ Expected rows of each table ({table: rows}, e.g. the row
+            estimates of the catalog). The tables are listed as waiting.
+        """
+        with self.lock:
+            for table, rows in estimates.items():
+                self._table(table)['expected'] = rows
+
+    def start(self, table):
+        """ The import of a table starts (its parts are followed with track) """
+        with self.lock:
+            info = self._table(table)
+            info['started'] = info['started'] or time.time()
+
+    def track(self, table, ret, part=None):
+        """ Read the counters of a table (or a `part` of it) from `ret`
+            while it is imported
+        """
+        with self.lock:
+            info = self._table(table)
+            info['started'] = info['started'] or time.time()
+            info['parts'][part] = ret
+
+    def update(self, table, part=None, **counters):
+        with self.lock:
+            info = self._table(table)
+            info['started'] = info['started'] or time.time()
+            info['parts'].setdefault(part, {}).update(counters)
+
+    def share(self, slots, context=multiprocessing):
+        """ Shared memory for the counters of the (table, part) `slots`
+            updated by worker processes (see WorkerMetrics)
+        """
+        counters = SharedCounters(slots, context)
+        with self.lock:
+            for table, part in slots:
+                self._table(table)['parts'][part] = counters.part(table, part)
+        return counters
+
+    def finish(self, table, counters=None, failed=False):
+        """ The table is done (or `failed`), `counters` (e.g. the merged
+            results of its parts) replace the counters of its parts
+        """
+        with self.lock:
+            info = self._table(table)
+            sources = info['parts'].values()
+            info['started'] = info['started'] or min(
+                (source.get('started') for source in sources if source.get('started')), default=time.time()
+            )
+            # The shared memory of the workers is released after the table
+            if counters is not None:
+                info['parts'] = {None: {name: counters.get(name, 0) for name in COUNTERS}}
+            else:
+                info['parts'] = {part: {name: source.get(name, 0) for name in COUNTERS}
+                                 for part, source in info['parts'].items()}
+            info['finished'] = time.time()
+            info['failed'] = failed
+
+    def begin(self):
+        """ Start writing the status every `interval` seconds """
+        self.thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """ Stop the background thread and write the final status """
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.report(final=True)
+        if self.console:
+            sys.stderr.write("\n")
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.report()
+            except Exception as e:
+                log.warning("Error writing the migration status: %s", e)
+
+    def status(self, final=False):
+        """ Counters, rows per second and ETA of each table and of the whole phase """
+        now = time.time()
+        tables = {}
+        with self.lock:
+            for table, info in self.tables.items():
+                sources = list(info['parts'].values())
+                counters = {name: sum(source.get(name, 0) for source in sources) for name in COUNTERS}
+                started = info['started'] or min(
+                    (source.get('started') for source in sources if source.get('started')), default=None
+                )
+                if info['failed']:
+                    state = 'failed'
+                elif info['finished']:
+                    state = 'done'
+                elif started:
+                    state = 'running'
+                else:
+                    state = 'waiting'
+                elapsed = (info['finished'] or now) - started if started else 0
+                rate = counters['total_rows'] / elapsed if elapsed > 0 else 0
+                expected = info['expected']
+                if state in ('done', 'failed'):
+                    eta = 0
+                elif expected is not None and rate > 0:
+                    eta = max(expected - counters['total_rows'], 0) / rate
+                else:
+                    eta = None
+                tables[table] = dict(
+                    counters, state=state, expected_rows=expected, elapsed_seconds=round(elapsed, 1),
+                    rows_per_second=round(rate, 1), eta_seconds=None if eta is None else round(eta),
+                )
+
+        elapsed = now - self.started
+        total_rows = sum(table['total_rows'] for table in tables.values())
+        rate = total_rows / elapsed if elapsed > 0 else 0
+        # Rows still expected from the tables that are not done
+        remaining = sum(
+            max((table['expected_rows'] or 0) - table['total_rows'], 0)
+            for table in tables.values() if table['state'] not in ('done', 'failed')
+        )
+        status = {
+            'phase': self.phase,
+            'started': datetime.fromtimestamp(self.started).isoformat(),
+            'updated': datetime.fromtimestamp(now).isoformat(),
+            'finished': final,
+            'elapsed_seconds': round(elapsed, 1),
+            'tables_done': sum(table['state'] == 'done' for table in tables.values()),
+            'tables_failed': sorted(name for name, table in tables.items() if table['state'] == 'failed'),
+            'tables_running': sorted(name for name, table in tables.items() if table['state'] == 'running'),
+            'tables_total': len(tables),
+            'expected_rows': sum(table['expected_rows'] or 0 for table in tables.values()),
+            'rows_per_second': round(rate, 1),
+            'eta_seconds': 0 if final else (round(remaining / rate) if rate > 0 else None),
+        }
+        for name in COUNTERS:
+            status[name] = sum(table[name] for table in tables.values())
+        status['tables'] = tables
+        return status
+
+    def report(self, final=False):
+        status = self.status(final)
+        if self.status_file:
+            _write_file(self.status_file, json.dumps(status, indent=2))
+        if self.prometheus_file:
+            _write_file(self.prometheus_file, prometheus_text(status))
+        if self.console:
+            sys.stderr.write("\r" + progress_line(status))
+            sys.stderr.flush()
+
+
+class SharedCounters:
+    """ COUNTERS (and start time) of the (table, part) slots in shared
+        memory: worker processes write them, the Metrics of the main
+        process read them. Passed to the workers when they are started.
+    """
+
+    FIELDS = COUNTERS + ('started',)
+
+    def __init__(self, slots, context=multiprocessing):
+        self.slots = {slot: position for position, slot in enumerate(slots)}
+        self.values = context.RawArray('d', len(slots) * len(self.FIELDS))
+
+    def set(self, table, part, **counters):
+        base = self.slots[(table, part)] * len(self.FIELDS)
+        for position, name in enumerate(self.FIELDS):
+            if name in counters:
+                self.values[base + position] = counters[name]
+
+    def get(self, table, part, name, default=0):
+        base = self.slots[(table, part)] * len(self.FIELDS)
+        return int(self.values[base + self.FIELDS.index(name)]) or default
+
+    def part(self, table, part):
+        return _SharedPart(self, table, part)
+
+    def __contains__(self, slot):
+        return slot in self.slots
+
+
+class _SharedPart:
+    """ Counters of one slot of SharedCounters, read like a dict """
+
+    def __init__(self, counters, table, part):
+        self.counters = counters
+        self.table = table
+        self.part = part
+
+    def get(self, name, default=0):
+        return self.counters.get(self.table, self.part, name, default)
+
+
+class WorkerMetrics:
+    """ Metrics of a worker process, written to the SharedCounters of the
+        main process. The `ret` dicts tracked by the importers are copied
+        every `interval` seconds by a background thread and by flush().
+    """
+
+    def __init__(self, counters, interval=1):
+        self.counters = counters
+        self.interval = interval
+        self.tracked = {}
+        self.thread = None
+
+    def start(self, table, part=None):
+        if (table, part) in self.counters:
+            self.counters.set(table, part, started=time.time())
+
+    def track(self, table, ret, part=None):
+        if (table, part) not in self.counters:
+            return
+        self.start(table, part)
+        self.tracked[(table, part)] = ret
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+            self.thread.start()
+
+    def update(self, table, part=None, **counters):
+        if (table, part) in self.counters:
+            self.counters.set(table, part, **counters)
+
+    def flush(self):
+        for (table, part), ret in list(self.tracked.items()):
+            self.counters.set(table, part, **{name: ret[name] for name in COUNTERS if name in ret})
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+def track_import(new_db, table, ret):
+    """ Follow the counters of the import of a table (see Metrics.track)
+        when new_db has metrics
+    """
+    metrics = getattr(new_db, 'metrics', None)
+    if metrics:
+        metrics.track(table, ret, getattr(new_db, 'partition', None))
+
+
+def row_estimates(tables_info_file='tables_info.json'):
+    """ Rows of each table from the tables_info.json of the extract mode
+        (estimates from the catalog, unless extracted with --exact-counts)
+    """
+    if not os.path.exists(tables_info_file):
+        return {}
+    with open(tables_info_file) as f:
+        return {info['table_name']: info.get('row_count') for info in json.load(f)}
+
+
+# Metrics of the Prometheus textfile: name, field of the tables, help
+PROMETHEUS_METRICS = (
+    ('ckan_migrator_rows', None, 'Rows of each table read (total), written (migrated) and skipped'),
+    ('ckan_migrator_bytes', 'bytes', 'Bytes written for each table'),
+    ('ckan_migrator_expected_rows', 'expected_rows', 'Expected rows of each table (catalog estimates)'),
+    ('ckan_migrator_rows_per_second', 'rows_per_second', 'Rows read per second for each table'),
+    ('ckan_migrator_table_eta_seconds', 'eta_seconds', 'Estimated seconds to finish each table'),
+)
+
+
+def prometheus_text(status):
+    """ The status (see Metrics.status) in the Prometheus text format """
+    phase = status['phase']
+    lines = []
+    for metric, field, description in PROMETHEUS_METRICS:
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} gauge")
+        for table, values in sorted(status['tables'].items()):
+            labels = f'phase="{phase}",table="{table}"'
+            if field is None:
+                for counter in ('total', 'migrated', 'skipped'):
+                    lines.append(f'{metric}{{{labels},counter="{counter}"}} {values[counter + "_rows"]}')
+            elif values[field] is not None:
+                lines.append(f"{metric}{{{labels}}} {values[field]}")
+    lines.append("# HELP ckan_migrator_table_state Tables waiting, running, done and failed")
+    lines.append("# TYPE ckan_migrator_table_state gauge")
+    for table, values in sorted(status['tables'].items()):
+        for state in ('waiting', 'running', 'done', 'failed'):
+            value = int(values['state'] == state)
+            lines.append(f'ckan_migrator_table_state{{phase="{phase}",table="{table}",state="{state}"}} {value}')
+    lines.append("# HELP ckan_migrator_eta_seconds Estimated seconds to finish the phase")
+    lines.append("# TYPE ckan_migrator_eta_seconds gauge")
+    if status['eta_seconds'] is not None:
+        lines.append(f'ckan_migrator_eta_seconds{{phase="{phase}"}} {status["eta_seconds"]}')
+    lines.append("# HELP ckan_migrator_last_update_timestamp_seconds Last update of these metrics")
+    lines.append("# TYPE ckan_migrator_last_update_timestamp_seconds gauge")
+    lines.append(f'ckan_migrator_last_update_timestamp_seconds{{phase="{phase}"}} {time.time():.0f}')
+    return "\n".join(lines) + "\n"
+
+
+def progress_line(status):
+    """ One line summary of the status, for the console """
+    if status['expected_rows']:
+        rows = f"{status['total_rows']:,}/{status['expected_rows']:,} rows"
+    else:
+        rows = f"{status['total_rows']:,} rows"
+    eta = '?' if status['eta_seconds'] is None else _format_seconds(status['eta_seconds'])
+    running = ', '.join(status['tables_running']) or '-'
+    return (
+        f"{status['phase']}: {status['tables_done']}/{status['tables_total']} tables, {rows}, "
+        f"{status['rows_per_second']:,.0f} rows/s, ETA {eta}, running: {running}"
+    )
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def _write_file(path, text):
+    """ Replace the file at once, readers never see a partial file """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -1,10 +1,19 @@
 import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from ckan_migrate.id_registry import IdRegistry
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['package']
 
-def import_packages(old_packages, new_db, valid_users_ids=None):
+
+def import_packages(old_packages, new_db, valid_users_ids=None, valid_groups_ids=None):
     """ Get all old packages from CSV and import them
         Return a list of errors and warnings for the general log
     """
@@ -15,17 +24,28 @@ def import_packages(old_packages, new_db, valid_users_ids=None):
         'skipped_rows': 0,
         'warnings': [],
         'errors': [],
-        'valid_packages_ids': [],
+        'valid_packages_ids': IdRegistry(),
     }
 
     # Handle potential duplicate names
-    names_in_use = []
-    for package in old_packages:
+    names_in_use = set()
+
+    def register_written(keys):
+        # Only the packages that were written are valid for the other tables
+        for (package_id,) in keys:
+            ret['valid_packages_ids'].add(package_id)
+
+    def transform_batch(batch):
+        return transform_package_batch(batch, ret, names_in_use, valid_users_ids, valid_groups_ids)
+
+    upsert = Upserter(new_db, "package", ret, written=register_written)
+    rows_log = RowLog(log, new_db)
+    for package in import_rows(old_packages, MAPPING, upsert, ret, transform_batch):
         ret['total_rows'] += 1
-        log.info(f"Importing package: {package['name']}")
+        rows_log.info("Importing package: %s", package['name'])
         new_package = transform_package(package)
         if not new_package:
-            log.warning(f" - Skipping package {package['name']}.")
+            log.warning(" - Skipping package %s.", package['name'])
             ret['skipped_rows'] += 1
             continue
 
@@ -46,29 +66,70 @@ def import_packages(old_packages, new_db, valid_users_ids=None):
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_package.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the package ID exists
-        sql = 'SELECT * FROM "package" WHERE id = %s'
-        new_db.cursor.execute(sql, (package["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Package {package['name']} already exists, updating the record")
-            sql = f'UPDATE "package" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            new_db.cursor.execute(sql, tuple(new_package[field] for field in fields) + (package["id"],))
-        else:
-            sql = f'INSERT INTO "package" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_package[field] for field in fields))
-        log.info(f" - Package {package['name']} imported successfully.")
-        names_in_use.append(new_package['name'])
-        ret['migrated_rows'] += 1
-        ret['valid_packages_ids'].append(new_package['id'])
-
-    new_db.conn.commit()
+        owner_org = new_package['owner_org']
+        if valid_groups_ids and owner_org and owner_org not in valid_groups_ids:
+            ret['warnings'].append(
+                f" - Package '{new_package['name']}' has an owner_org '{owner_org}'"
+                " that does not exist in the new database. Setting it to None."
+            )
+            new_package['owner_org'] = None
+
+        upsert.add(new_package)
+        names_in_use.add(new_package['name'])
+
+    upsert.close()
     return ret
 
 
+def transform_package_batch(batch, ret, names_in_use, valid_users_ids=None, valid_groups_ids=None):
+    """ Like the rows loop of import_packages, for an Arrow record batch of
+        old packages. The creators and owner organizations are tested for
+        whole columns (see IdRegistry.contains_many), only the duplicate
+        names are checked row by row.
+    """
+    batch = MAPPING.transform_batch(batch)
+    columns = dict(zip(batch.schema.names, batch.columns))
+    if valid_users_ids:
+        valid_creators = valid_users_ids.contains_many(columns['creator_user_id'])
+    else:
+        valid_creators = np.ones(batch.num_rows, dtype=bool)
+
+    names = columns['name'].to_pylist()
+    ids = columns['id'].to_pylist()
+    for i, name in enumerate(names):
+        if name in names_in_use:
+            # Add a suffix to the name
+            names[i] = f"{name}_{hash(ids[i])}"
+            ret['errors'].append(
+                f" - Package '{name}' has a duplicate name."
+                f" New name: {names[i]} (old: {name})"
+            )
+        if not valid_creators[i]:
+            ret['errors'].append(
+                f" - Package '{names[i]}' ignored, has a creator_user_id '{columns['creator_user_id'][i].as_py()}'"
+                " that does not exist in the new database. Setting it to None."
+            )
+            continue
+        names_in_use.add(names[i])
+    columns['name'] = pa.array(names, type=columns['name'].type)
+
+    if valid_groups_ids:
+        owner_orgs = columns['owner_org']
+        has_owner = pc.fill_null(pc.not_equal(owner_orgs, ''), False).to_numpy(zero_copy_only=False)
+        unknown = has_owner & ~valid_groups_ids.contains_many(owner_orgs) & valid_creators
+        for i in np.flatnonzero(unknown):
+            ret['warnings'].append(
+                f" - Package '{names[i]}' has an owner_org '{owner_orgs[i].as_py()}'"
+                " that does not exist in the new database. Setting it to None."
+            )
+        columns['owner_org'] = pc.if_else(pa.array(unknown), pa.scalar(None, owner_orgs.type), owner_orgs)
+
+    batch = pa.RecordBatch.from_arrays(list(columns.values()), names=list(columns))
+    return batch.filter(pa.array(valid_creators))
+
+
 def transform_package(package, migrate_deleted=True):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return a dict for the new DB object (see MAPPING)
         Old packages looks like:
           {
             "id":"package-id",
@@ -95,28 +156,4 @@ def transform_package(package, migrate_deleted=True):
     if not migrate_deleted and package['state'] == 'deleted':
         return None
 
-    new_package = {
-        'id': package['id'],
-        'name': package['name'],
-        'title': package['title'],
-        'version': package['version'],
-        'url': package['url'],
-        'notes': package['notes'],
-        'license_id': package['license_id'],
-        'author': package['author'],
-        'author_email': package['author_email'],
-        'maintainer': package['maintainer'],
-        'maintainer_email': package['maintainer_email'],
-        'state': package['state'],
-        'type': package['type'],
-        'owner_org': package['owner_org'],
-        'private': package['private'],
-        'metadata_modified': package['metadata_modified'],
-        'creator_user_id': package['creator_user_id'],
-        'metadata_created': package['metadata_created']
-    }
-
-    # Note: revision_id is deprecated in new CKAN - we skip it
-    # Note: plugin_data is a new field in CKAN 2.11 but we don't have data for it
-
-    return new_package
+    return MAPPING.transform(package)
@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import StagedUpserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['package_extra']
+
 
 def import_package_extras(old_package_extras, new_db):
     """ Get all old package extras from CSV and import them
@@ -17,52 +22,25 @@ def import_package_extras(old_package_extras, new_db):
         'errors': []
     }
 
-    for package_extra in old_package_extras:
+    upsert = StagedUpserter(new_db, "package_extra", ret, references=MAPPING.references)
+    rows_log = RowLog(log, new_db)
+    for package_extra in import_rows(old_package_extras, MAPPING, upsert, ret):
         ret['total_rows'] += 1
-        log.info(f"Importing package extra: {package_extra['id']} (key: {package_extra['key']})")
+        rows_log.info("Importing package extra: %s (key: %s)", package_extra['id'], package_extra['key'])
         new_package_extra = transform_package_extra(package_extra)
         if not new_package_extra:
-            log.warning(f" - Skipping package extra {package_extra['id']}.")
+            log.warning(" - Skipping package extra %s.", package_extra['id'])
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_package_extra.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the package extra ID exists
-        sql = 'SELECT * FROM "package_extra" WHERE id = %s'
-        new_db.cursor.execute(sql, (package_extra["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Package extra {package_extra['id']} already exists, updating the record")
-            sql = f'UPDATE "package_extra" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            try:
-                new_db.cursor.execute(sql, tuple(new_package_extra[field] for field in fields) + (package_extra["id"],))
-            except Exception as e:
-                log.error(f" - Error updating package extra {package_extra['id']}: {e}")
-                ret['errors'].append(f"Error updating package extra {package_extra['id']}: {e}")
-                ret['skipped_rows'] += 1
-                # rollback to keep the transaction clean
-                new_db.conn.rollback()
-                continue
-        else:
-            sql = f'INSERT INTO "package_extra" ({", ".join(fields)}) VALUES ({placeholders})'
-            try:
-                new_db.cursor.execute(sql, tuple(new_package_extra[field] for field in fields))
-            except Exception as e:
-                log.error(f" - Error inserting package extra {package_extra['id']}: {e}")
-                ret['errors'].append(f"Error inserting package extra {package_extra['id']}: {e}")
-                ret['skipped_rows'] += 1
-                # rollback to keep the transaction clean
-                new_db.conn.rollback()
-                continue
-        log.info(f" - Package extra {package_extra['id']} imported successfully.")
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_package_extra)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_package_extra(package_extra, migrate_deleted=True):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old package extras looks like:
           {
             "id":"package-extra-id",
@@ -76,14 +54,4 @@ def transform_package_extra(package_extra, migrate_deleted=True):
     if not migrate_deleted and package_extra['state'] == 'deleted':
         return None
 
-    new_package_extra = {
-        'id': package_extra['id'],
-        'package_id': package_extra['package_id'],
-        'key': package_extra['key'],
-        'value': package_extra['value'],
-        'state': package_extra['state']
-    }
-
-    # Note: revision_id is deprecated in new CKAN - we skip it
-
-    return new_package_extra
+    return MAPPING.values(package_extra)
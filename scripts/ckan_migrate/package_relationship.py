@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['package_relationship']
+
 
 def import_package_relationships(old_package_relationships, new_db):
     """ Get all old package relationships from CSV and import them
@@ -17,38 +22,25 @@ def import_package_relationships(old_package_relationships, new_db):
         'errors': []
     }
 
-    for package_relationship in old_package_relationships:
+    upsert = Upserter(new_db, "package_relationship", ret)
+    rows_log = RowLog(log, new_db)
+    for package_relationship in import_rows(old_package_relationships, MAPPING, upsert, ret):
         ret['total_rows'] += 1
-        log.info(f"Importing package relationship: {package_relationship['id']} ({package_relationship['type']})")
+        rows_log.info("Importing package relationship: %s (%s)", package_relationship['id'], package_relationship['type'])
         new_package_relationship = transform_package_relationship(package_relationship)
         if not new_package_relationship:
-            log.warning(f" - Skipping package relationship {package_relationship['id']}.")
+            log.warning(" - Skipping package relationship %s.", package_relationship['id'])
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_package_relationship.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the package relationship ID exists
-        sql = 'SELECT * FROM "package_relationship" WHERE id = %s'
-        new_db.cursor.execute(sql, (package_relationship["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Package relationship {package_relationship['id']} already exists, updating the record")
-            sql = f'UPDATE "package_relationship" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            new_db.cursor.execute(
-                sql, tuple(new_package_relationship[field] for field in fields) + (package_relationship["id"],)
-            )
-        else:
-            sql = f'INSERT INTO "package_relationship" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_package_relationship[field] for field in fields))
-        log.info(f" - Package relationship {package_relationship['id']} imported successfully.")
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_package_relationship)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_package_relationship(package_relationship, migrate_deleted=True):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old package relationships looks like:
           {
             "id":"package-relationship-id",
@@ -63,15 +55,4 @@ def transform_package_relationship(package_relationship, migrate_deleted=True):
     if not migrate_deleted and package_relationship['state'] == 'deleted':
         return None
 
-    new_package_relationship = {
-        'id': package_relationship['id'],
-        'subject_package_id': package_relationship['subject_package_id'],
-        'object_package_id': package_relationship['object_package_id'],
-        'type': package_relationship['type'],
-        'comment': package_relationship['comment'],
-        'state': package_relationship['state']
-    }
-
-    # Note: revision_id is deprecated in new CKAN - we skip it
-
-    return new_package_relationship
+    return MAPPING.values(package_relationship)
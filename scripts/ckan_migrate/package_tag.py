@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['package_tag']
+
 
 def import_package_tags(old_package_tags, new_db):
     """ Get all old package tags from CSV and import them
@@ -17,54 +22,28 @@ def import_package_tags(old_package_tags, new_db):
         'errors': []
     }
 
-    for package_tag in old_package_tags:
+    upsert = Upserter(new_db, "package_tag", ret)
+    rows_log = RowLog(log, new_db)
+    for package_tag in import_rows(old_package_tags, MAPPING, upsert, ret):
         ret['total_rows'] += 1
-        log.info(
-            f"Importing package tag: {package_tag['id']} (package: {package_tag['package_id']}, tag: {package_tag['tag_id']})"
+        rows_log.info(
+            "Importing package tag: %s (package: %s, tag: %s)",
+            package_tag['id'], package_tag['package_id'], package_tag['tag_id']
         )
         new_package_tag = transform_package_tag(package_tag)
         if not new_package_tag:
-            log.warning(f" - Skipping package tag {package_tag['id']}.")
+            log.warning(" - Skipping package tag %s.", package_tag['id'])
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_package_tag.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the package tag ID exists
-        sql = 'SELECT * FROM "package_tag" WHERE id = %s'
-        new_db.cursor.execute(sql, (package_tag["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Package tag {package_tag['id']} already exists, updating the record")
-            sql = f'UPDATE "package_tag" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            try:
-                new_db.cursor.execute(sql, tuple(new_package_tag[field] for field in fields) + (package_tag["id"],))
-            except Exception as e:
-                log.error(f" - Error updating package tag {package_tag['id']}: {e}")
-                ret['errors'].append(f"Error updating package tag {package_tag['id']}: {e}")
-                ret['skipped_rows'] += 1
-                # rollback to keep the transaction clean
-                new_db.conn.rollback()
-                continue
-        else:
-            sql = f'INSERT INTO "package_tag" ({", ".join(fields)}) VALUES ({placeholders})'
-            try:
-                new_db.cursor.execute(sql, tuple(new_package_tag[field] for field in fields))
-            except Exception as e:
-                log.error(f" - Error inserting package tag {package_tag['id']}: {e}")
-                ret['errors'].append(f"Error inserting package tag {package_tag['id']}: {e}")
-                ret['skipped_rows'] += 1
-                # rollback to keep the transaction clean
-                new_db.conn.rollback()
-                continue
-        log.info(f" - Package tag {package_tag['id']} imported successfully.")
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_package_tag)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_package_tag(package_tag, migrate_deleted=True):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old package tags looks like:
           {
             "id":"package-tag-id",
@@ -77,13 +56,4 @@ def transform_package_tag(package_tag, migrate_deleted=True):
     if not migrate_deleted and package_tag['state'] == 'deleted':
         return None
 
-    new_package_tag = {
-        'id': package_tag['id'],
-        'package_id': package_tag['package_id'],
-        'tag_id': package_tag['tag_id'],
-        'state': package_tag['state']
-    }
-
-    # Note: revision_id is deprecated in new CKAN - we skip it
-
-    return new_package_tag
+    return MAPPING.values(package_tag)
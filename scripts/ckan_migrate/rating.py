@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['rating']
+
 
 def import_ratings(old_ratings, new_db):
     """ Get all old ratings from CSV and import them
@@ -17,36 +22,25 @@ def import_ratings(old_ratings, new_db):
         'errors': []
     }
 
-    for rating in old_ratings:
+    upsert = Upserter(new_db, "rating", ret)
+    rows_log = RowLog(log, new_db)
+    for rating in import_rows(old_ratings, MAPPING, upsert, ret):
         ret['total_rows'] += 1
-        log.info(f"Importing rating: {rating['id']} (package: {rating['package_id']})")
+        rows_log.info("Importing rating: %s (package: %s)", rating['id'], rating['package_id'])
         new_rating = transform_rating(rating)
         if not new_rating:
-            log.warning(f" - Skipping rating {rating['id']}.")
+            log.warning(" - Skipping rating %s.", rating['id'])
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_rating.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the rating ID exists
-        sql = 'SELECT * FROM "rating" WHERE id = %s'
-        new_db.cursor.execute(sql, (rating["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Rating {rating['id']} already exists, updating the record")
-            sql = f'UPDATE "rating" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            new_db.cursor.execute(sql, tuple(new_rating[field] for field in fields) + (rating["id"],))
-        else:
-            sql = f'INSERT INTO "rating" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_rating[field] for field in fields))
-        log.info(f" - Rating {rating['id']} imported successfully.")
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_rating)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_rating(rating):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old ratings looks like:
           {
             "id":"rating-id",
@@ -57,13 +51,4 @@ def transform_rating(rating):
             "created":"2017-03-21 18:23:56.055936"
         },
     """
-    new_rating = {
-        'id': rating['id'],
-        'user_id': rating['user_id'],
-        'user_ip_address': rating['user_ip_address'],
-        'package_id': rating['package_id'],
-        'rating': rating['rating'],
-        'created': rating['created']
-    }
-
-    return new_rating
+    return MAPPING.values(rating)
@@ -0,0 +1,86 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+# String columns with less distinct values than this share of their rows
+# (state, capacity, activity_type...) are built from their dictionary
+MAX_DICTIONARY_RATIO = 0.5
+
+
+class Record:
+    """ An old row, read like a dict (row['state'], row.get('state'), keys())
+        but stored as the tuple of its values. The positions of the columns
+        are shared by all the records of a chunk, so a record costs a tuple
+        instead of a dict with its own hash table.
+    """
+
+    __slots__ = ('_values', '_positions')
+
+    def __init__(self, values, positions):
+        self._values = values
+        self._positions = positions
+
+    def __getitem__(self, column):
+        return self._values[self._positions[column]]
+
+    def get(self, column, default=None):
+        position = self._positions.get(column)
+        return default if position is None else self._values[position]
+
+    def __contains__(self, column):
+        return column in self._positions
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def keys(self):
+        return self._positions.keys()
+
+    def values(self):
+        return self._values
+
+    def items(self):
+        return zip(self._positions, self._values)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+def column_positions(columns):
+    return {column: position for position, column in enumerate(columns)}
+
+
+def tuple_records(columns, rows):
+    """ Records of the tuples `rows` (e.g. fetched from a cursor) """
+    positions = column_positions(columns)
+    return [Record(row, positions) for row in rows]
+
+
+def batch_records(batch):
+    """ Records of an Arrow record batch, the repeated strings of a
+        column are one Python object (see column_values)
+    """
+    positions = column_positions(batch.schema.names)
+    columns = [column_values(column) for column in batch.columns]
+    return [Record(values, positions) for values in zip(*columns)]
+
+
+def column_values(array):
+    """ Python values of an Arrow array.
+        Low cardinality string columns are dictionary encoded, so each
+        distinct value is built once and shared by all the rows, instead
+        of one string per row.
+    """
+    if pa.types.is_dictionary(array.type):
+        encoded = array
+    elif pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        encoded = pc.dictionary_encode(array)
+        if len(encoded.dictionary) > len(array) * MAX_DICTIONARY_RATIO:
+            return array.to_pylist()
+    else:
+        return array.to_pylist()
+    dictionary = encoded.dictionary.to_pylist()
+    return [None if index is None else dictionary[index] for index in encoded.indices.to_pylist()]
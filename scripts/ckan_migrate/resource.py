@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['resource']
+
 
 def import_resources(old_resources, new_db, valid_packages_ids=None):
     """ Get all old resources from CSV and import them
@@ -17,55 +22,31 @@ def import_resources(old_resources, new_db, valid_packages_ids=None):
         'errors': []
     }
 
-    for resource in old_resources:
+    # Resources of packages that were not imported are left out
+    valid_ids = {'package_id': valid_packages_ids} if valid_packages_ids else None
+
+    def transform_batch(batch):
+        return MAPPING.transform_batch(batch, valid_ids=valid_ids)
+
+    upsert = Upserter(new_db, "resource", ret)
+    rows_log = RowLog(log, new_db)
+    for resource in import_rows(old_resources, MAPPING, upsert, ret, transform_batch):
         ret['total_rows'] += 1
-        log.info(f"Importing resource: {resource['id']}")
+        rows_log.info("Importing resource: %s", resource['id'])
         new_resource = transform_resource(resource, valid_packages_ids=valid_packages_ids)
         if not new_resource:
-            log.warning(f" - Skipping resource {resource['id']}.")
+            log.warning(" - Skipping resource %s.", resource['id'])
             ret['skipped_rows'] += 1
             continue
 
-        fields = list(new_resource.keys())
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the resource ID exists
-        sql = 'SELECT * FROM "resource" WHERE id = %s'
-        new_db.cursor.execute(sql, (resource["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Resource {resource['id']} already exists, updating the record")
-            sql = f'UPDATE "resource" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            try:
-                new_db.cursor.execute(sql, tuple(new_resource[field] for field in fields) + (resource["id"],))
-                new_db.conn.commit()
-            except Exception as e:
-                log.error(f" - Error updating resource {resource['id']}: {e}")
-                ret['errors'].append(f"Error updating resource {resource['id']}: {e}")
-                ret['skipped_rows'] += 1
-                new_db.conn.rollback()
-                continue
-            else:
-                log.info(f" - Resource {resource['id']} updated successfully.")
-                ret['migrated_rows'] += 1
-        else:
-            sql = f'INSERT INTO "resource" ({", ".join(fields)}) VALUES ({placeholders})'
-            try:
-                new_db.cursor.execute(sql, tuple(new_resource[field] for field in fields))
-                new_db.conn.commit()
-            except Exception as e:
-                log.error(f" - Error inserting resource {resource['id']}: {e}")
-                ret['errors'].append(f"Error inserting resource {resource['id']}: {e}")
-                ret['skipped_rows'] += 1
-                new_db.conn.rollback()
-                continue
-            else:
-                log.info(f" - Resource {resource['id']} created successfully.")
-                ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_resource)
 
+    upsert.close()
     return ret
 
 
 def transform_resource(resource, migrate_deleted=True, valid_packages_ids=None):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old resources looks like:
           {
             "id":"resource-id",
@@ -97,31 +78,4 @@ def transform_resource(resource, migrate_deleted=True, valid_packages_ids=None):
     if valid_packages_ids and resource['package_id'] not in valid_packages_ids:
         return None
 
-    new_resource = {
-        'id': resource['id'],
-        'url': resource['url'],
-        'format': resource['format'],
-        'description': resource['description'],
-        'position': resource['position'],
-        'hash': resource['hash'],
-        'state': resource['state'],
-        'extras': resource['extras'],
-        'name': resource['name'],
-        'resource_type': resource['resource_type'],
-        'mimetype': resource['mimetype'],
-        'mimetype_inner': resource['mimetype_inner'],
-        'size': resource['size'],
-        'last_modified': resource['last_modified'],
-        'cache_url': resource['cache_url'],
-        'cache_last_updated': resource['cache_last_updated'],
-        'created': resource['created'],
-        'url_type': resource['url_type'],
-        'package_id': resource['package_id']
-    }
-
-    # Add metadata_modified field (new in CKAN 2.11) - use created date as fallback
-    new_resource['metadata_modified'] = resource.get('metadata_modified', resource['created'])
-
-    # Note: revision_id, webstore_url, webstore_last_updated are deprecated in new CKAN - we skip them
-
-    return new_resource
+    return MAPPING.values(resource)
@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['system_info']
+
 
 def import_system_info(old_system_infos, new_db):
     """ Get all old system info from CSV and import them
@@ -17,36 +22,25 @@ def import_system_info(old_system_infos, new_db):
         'errors': []
     }
 
-    for system_info in old_system_infos:
+    upsert = Upserter(new_db, "system_info", ret)
+    rows_log = RowLog(log, new_db)
+    for system_info in import_rows(old_system_infos, MAPPING, upsert, ret):
         ret['total_rows'] += 1
-        log.info(f"Importing system info: {system_info['key']}")
+        rows_log.info("Importing system info: %s", system_info['key'])
         new_system_info = transform_system_info(system_info)
         if not new_system_info:
-            log.warning(f" - Skipping system info {system_info['key']}.")
+            log.warning(" - Skipping system info %s.", system_info['key'])
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_system_info.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the system info ID exists
-        sql = 'SELECT * FROM "system_info" WHERE id = %s'
-        new_db.cursor.execute(sql, (system_info["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - System info {system_info['key']} already exists, updating the record")
-            sql = f'UPDATE "system_info" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            new_db.cursor.execute(sql, tuple(new_system_info[field] for field in fields) + (system_info["id"],))
-        else:
-            sql = f'INSERT INTO "system_info" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_system_info[field] for field in fields))
-        log.info(f" - System info {system_info['key']} imported successfully.")
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_system_info)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_system_info(system_info, migrate_deleted=True):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old system info looks like:
           {
             "id":1,
@@ -59,13 +53,4 @@ def transform_system_info(system_info, migrate_deleted=True):
     if not migrate_deleted and system_info['state'] == 'deleted':
         return None
 
-    new_system_info = {
-        'id': system_info['id'],
-        'key': system_info['key'],
-        'value': system_info['value'],
-        'state': system_info['state']
-    }
-
-    # Note: revision_id is deprecated in new CKAN - we skip it
-
-    return new_system_info
+    return MAPPING.values(system_info)
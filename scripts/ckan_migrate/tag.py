@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['tag']
+
 
 def import_tags(old_tags, new_db):
     """ Get all old tags from CSV and import them
@@ -17,14 +22,16 @@ def import_tags(old_tags, new_db):
         'errors': []
     }
 
+    upsert = Upserter(new_db, "tag", ret)
     # Handle potential duplicate names
-    names_in_use = []
+    names_in_use = set()
+    rows_log = RowLog(log, new_db)
     for tag in old_tags:
         ret['total_rows'] += 1
-        log.info(f"Importing tag: {tag['name']}")
+        rows_log.info("Importing tag: %s", tag['name'])
         new_tag = transform_tag(tag)
         if not new_tag:
-            log.warning(f" - Skipping tag {tag['name']}.")
+            log.warning(" - Skipping tag %s.", tag['name'])
             ret['skipped_rows'] += 1
             continue
 
@@ -39,28 +46,15 @@ def import_tags(old_tags, new_db):
                 f" New name: {new_tag['name']} (old: {original_name})"
             )
 
-        fields = new_tag.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the tag ID exists
-        sql = 'SELECT * FROM "tag" WHERE id = %s'
-        new_db.cursor.execute(sql, (tag["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Tag {tag['name']} already exists, updating the record")
-            sql = f'UPDATE "tag" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            new_db.cursor.execute(sql, tuple(new_tag[field] for field in fields) + (tag["id"],))
-        else:
-            sql = f'INSERT INTO "tag" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_tag[field] for field in fields))
-        log.info(f" - Tag {tag['name']} imported successfully.")
-        names_in_use.append(unique_key)
-        ret['migrated_rows'] += 1
+        upsert.add(new_tag)
+        names_in_use.add(unique_key)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_tag(tag):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return a dict for the new DB object (see MAPPING)
         Old tags looks like:
           {
             "id":"tag-id",
@@ -68,10 +62,4 @@ def transform_tag(tag):
             "vocabulary_id":"vocabulary-id"
         },
     """
-    new_tag = {
-        'id': tag['id'],
-        'name': tag['name'],
-        'vocabulary_id': tag['vocabulary_id']
-    }
-
-    return new_tag
+    return MAPPING.transform(tag)
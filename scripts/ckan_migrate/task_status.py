@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['task_status']
+
 
 def import_task_status(old_task_statuses, new_db):
     """ Get all old task status from CSV and import them
@@ -17,36 +22,25 @@ def import_task_status(old_task_statuses, new_db):
         'errors': []
     }
 
-    for task_status in old_task_statuses:
+    upsert = Upserter(new_db, "task_status", ret)
+    rows_log = RowLog(log, new_db)
+    for task_status in import_rows(old_task_statuses, MAPPING, upsert, ret):
         ret['total_rows'] += 1
-        log.info(f"Importing task status: {task_status['id']} (type: {task_status['task_type']})")
+        rows_log.info("Importing task status: %s (type: %s)", task_status['id'], task_status['task_type'])
         new_task_status = transform_task_status(task_status)
         if not new_task_status:
-            log.warning(f" - Skipping task status {task_status['id']}.")
+            log.warning(" - Skipping task status %s.", task_status['id'])
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_task_status.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the task status ID exists
-        sql = 'SELECT * FROM "task_status" WHERE id = %s'
-        new_db.cursor.execute(sql, (task_status["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Task status {task_status['id']} already exists, updating the record")
-            sql = f'UPDATE "task_status" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            new_db.cursor.execute(sql, tuple(new_task_status[field] for field in fields) + (task_status["id"],))
-        else:
-            sql = f'INSERT INTO "task_status" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_task_status[field] for field in fields))
-        log.info(f" - Task status {task_status['id']} imported successfully.")
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_task_status)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_task_status(task_status):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old task status looks like:
           {
             "id":"task-status-id",
@@ -60,16 +54,4 @@ def transform_task_status(task_status):
             "last_updated":"2017-03-21 18:23:56.055936"
         },
     """
-    new_task_status = {
-        'id': task_status['id'],
-        'entity_id': task_status['entity_id'],
-        'entity_type': task_status['entity_type'],
-        'task_type': task_status['task_type'],
-        'key': task_status['key'],
-        'value': task_status['value'],
-        'state': task_status['state'],
-        'error': task_status['error'],
-        'last_updated': task_status['last_updated']
-    }
-
-    return new_task_status
+    return MAPPING.values(task_status)
@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['term_translation']
+
 
 def import_term_translations(old_term_translations, new_db):
     """ Get all old term translations from CSV and import them
@@ -17,48 +22,25 @@ def import_term_translations(old_term_translations, new_db):
         'errors': []
     }
 
-    for term_translation in old_term_translations:
+    upsert = Upserter(new_db, "term_translation", ret, key=('term', 'lang_code'))
+    rows_log = RowLog(log, new_db)
+    for term_translation in import_rows(old_term_translations, MAPPING, upsert, ret):
         ret['total_rows'] += 1
-        log.info(f"Importing term translation: {term_translation['term']} ({term_translation['lang_code']})")
+        rows_log.info("Importing term translation: %s (%s)", term_translation['term'], term_translation['lang_code'])
         new_term_translation = transform_term_translation(term_translation)
         if not new_term_translation:
-            log.warning(f" - Skipping term translation {term_translation['term']} ({term_translation['lang_code']}).")
+            log.warning(" - Skipping term translation %s (%s).", term_translation['term'], term_translation['lang_code'])
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_term_translation.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the term translation exists (composite primary key)
-        sql = 'SELECT * FROM "term_translation" WHERE term = %s AND lang_code = %s'
-        new_db.cursor.execute(sql, (term_translation["term"], term_translation["lang_code"]))
-        if new_db.cursor.fetchone():
-            log.warning(
-                (
-                    f" - Term translation {term_translation['term']} "
-                    f"({term_translation['lang_code']}) already exists, updating the record"
-                )
-            )
-            sql = f'UPDATE "term_translation" SET ({", ".join(fields)}) = ({placeholders}) WHERE term= %s AND lang_code= %s'
-            new_db.cursor.execute(
-                sql,
-                tuple(
-                    new_term_translation[field] for field in fields
-                ) + (
-                    term_translation["term"], term_translation["lang_code"]
-                )
-            )
-        else:
-            sql = f'INSERT INTO "term_translation" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_term_translation[field] for field in fields))
-        log.info(f" - Term translation {term_translation['term']} ({term_translation['lang_code']}) imported successfully.")
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_term_translation)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_term_translation(term_translation):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old term translations looks like:
           {
             "term":"dataset",
@@ -66,10 +48,4 @@ def transform_term_translation(term_translation):
             "lang_code":"es"
         },
     """
-    new_term_translation = {
-        'term': term_translation['term'],
-        'term_translation': term_translation['term_translation'],
-        'lang_code': term_translation['lang_code']
-    }
-
-    return new_term_translation
+    return MAPPING.values(term_translation)
@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import StagedUpserter
+from ckan_migrate.mapping import MAPPINGS, import_rows
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['tracking_raw']
+
 
 def import_tracking_raw(old_tracking, new_db):
     """ Get all old tracking raw from DB and import them
@@ -16,42 +21,28 @@ def import_tracking_raw(old_tracking, new_db):
         'warnings': [],
         'errors': []
     }
-    for tracking_raw in old_tracking:
+
+    upsert = StagedUpserter(
+        new_db, "tracking_raw", ret, key=('user_key', 'url', 'tracking_type', 'access_timestamp'), update=False
+    )
+    rows_log = RowLog(log, new_db)
+    for tracking_raw in import_rows(old_tracking, MAPPING, upsert, ret):
         ret['total_rows'] += 1
-        log.info(f"Importing tracking raw: {tracking_raw['user_key']} ({tracking_raw['tracking_type']})")
+        rows_log.info("Importing tracking raw: %s (%s)", tracking_raw['user_key'], tracking_raw['tracking_type'])
         new_tracking_raw = transform_tracking_raw(tracking_raw)
         if not new_tracking_raw:
-            log.warning(f" - Skipping tracking raw {tracking_raw['user_key']}.")
+            log.warning(" - Skipping tracking raw %s.", tracking_raw['user_key'])
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_tracking_raw.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the tracking raw exists (composite primary key)
-        sql = ('SELECT * FROM "tracking_raw" WHERE user_key = %s AND url = %s '
-               'AND tracking_type = %s AND access_timestamp = %s')
-        new_db.cursor.execute(
-            sql, (
-                tracking_raw["user_key"], tracking_raw["url"],
-                tracking_raw["tracking_type"], tracking_raw["access_timestamp"]
-            )
-        )
-        if new_db.cursor.fetchone():
-            log.warning(f" - Tracking raw {tracking_raw['user_key']} already exists, skipping")
-            ret['skipped_rows'] += 1
-            continue
-        else:
-            sql = f'INSERT INTO "tracking_raw" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_tracking_raw[field] for field in fields))
-        log.info(f" - Tracking raw {tracking_raw['user_key']} imported successfully.")
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_tracking_raw)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_tracking_raw(tracking_raw):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old tracking raw looks like:
           {
             "user_key":"user-key-123",
@@ -60,11 +51,4 @@ def transform_tracking_raw(tracking_raw):
             "access_timestamp":"2017-03-21 18:23:56.055936"
         },
     """
-    new_tracking_raw = {
-        'user_key': tracking_raw['user_key'],
-        'url': tracking_raw['url'],
-        'tracking_type': tracking_raw['tracking_type'],
-        'access_timestamp': tracking_raw['access_timestamp']
-    }
-
-    return new_tracking_raw
+    return MAPPING.values(tracking_raw)
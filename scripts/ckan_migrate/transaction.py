@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import psycopg2
+
+
+log = logging.getLogger(__name__)
+
+# Rows written between commits (default for --commit-every)
+COMMIT_EVERY = 10000
+
+# Rows that can not be written are saved here, one {table}.ndjson file per table
+# (one {table}.part-0000.ndjson file per partition with --table-workers)
+QUARANTINE_FOLDER = 'quarantine'
+
+# Quarantine files opened by this process, written again in append mode
+# (e.g. a StagedUpserter and the Upserter of its batched merge)
+_quarantine_paths = set()
+
+
+class BatchTransaction:
+    """ Write batches of rows to the new DB, each batch in a SAVEPOINT,
+        committing every `commit_every` written rows (see --commit-every).
+        When a batch fails it is split in halves, recursively, to find the
+        failing rows: only those rows are skipped, the rest are written.
+        Failing rows are quarantined: reported as errors in `ret` (the
+        import_* result) and saved with their error in QUARANTINE_FOLDER.
+    """
+
+    def __init__(self, new_db, table, ret, commit_every=None):
+        self.conn = new_db.conn
+        self.table = table
+        self.ret = ret
+        self.commit_every = commit_every or getattr(new_db, 'commit_every', COMMIT_EVERY)
+        # Part of the table imported by this connection (see --table-workers)
+        self.partition = getattr(new_db, 'partition', None)
+        self.cursor = self.conn.cursor()
+        self.uncommitted = 0
+        self.quarantine_file = None
+        self.fields = None
+
+    def write(self, rows, write, describe, fields=None):
+        """ Call write(rows), with the rows bisected on errors.
+            `describe(row)` identifies a row in the error messages.
+            `fields` names the values of the rows when they are tuples.
+            Return the rows written.
+        """
+        self.fields = fields
+        written = self._write(rows, write, describe)
+        self.uncommitted += len(written)
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+        return written
+
+    def _write(self, rows, write, describe):
+        self.cursor.execute("SAVEPOINT batch")
+        try:
+            write(rows)
+            self.cursor.execute("RELEASE SAVEPOINT batch")
+            return rows
+        except psycopg2.Error as e:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT batch")
+            if len(rows) == 1:
+                self._quarantine(rows[0], describe, e)
+                return []
+            log.warning(" - Batch of %s %s rows failed, splitting it", len(rows), self.table)
+        middle = len(rows) // 2
+        return self._write(rows[:middle], write, describe) + self._write(rows[middle:], write, describe)
+
+    def _quarantine(self, row, describe, error):
+        error = str(error).strip()
+        log.error(" - Error importing %s %s: %s", self.table, describe(row), error)
+        self.ret['errors'].append(f"Error importing {self.table} {describe(row)}: {error}")
+        self.ret['skipped_rows'] += 1
+        if self.quarantine_file is None:
+            if not os.path.exists(QUARANTINE_FOLDER):
+                os.makedirs(QUARANTINE_FOLDER)
+            name = self.table if self.partition is None else f"{self.table}.part-{self.partition:04d}"
+            path = os.path.join(QUARANTINE_FOLDER, f"{name}.ndjson")
+            self.quarantine_file = open(path, 'a' if path in _quarantine_paths else 'w')
+            _quarantine_paths.add(path)
+        if self.fields:
+            row = dict(zip(self.fields, row))
+        self.quarantine_file.write(json.dumps({'error': error, 'row': row}, default=str) + "\n")
+
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        """ Commit the pending rows """
+        self.commit()
+        self.cursor.close()
+        if self.quarantine_file is not None:
+            self.quarantine_file.close()
@@ -0,0 +1,502 @@
+import io
+import json
+import logging
+import psycopg2
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR
+from psycopg2.extras import execute_values
+from ckan_migrate.key_index import NULL_KEY, KeyIndex, key_label, key_text
+from ckan_migrate.metrics import track_import
+from ckan_migrate.records import column_values
+from ckan_migrate.transaction import BatchTransaction
+
+
+log = logging.getLogger(__name__)
+
+# Rows written per statement
+BATCH_SIZE = 1000
+
+# Rows sent per COPY to the staging tables
+COPY_BATCH_SIZE = 10000
+
+# Column types and unique keys of each table, by connection DSN and table (see target_table)
+_targets = {}
+
+
+def target_table(new_db, table):
+    """ Get the column types and the unique indexes (as frozensets of
+        column names) of a table of the new DB.
+        Read once per database and table and cached.
+    """
+    target = (new_db.conn.dsn, table)
+    if target not in _targets:
+        cursor = new_db.conn.cursor()
+        try:
+            cursor.execute(
+                'SELECT a.attname, format_type(a.atttypid, NULL) '
+                'FROM pg_attribute a '
+                'WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped',
+                (f'"{table}"',)
+            )
+            types = dict(cursor.fetchall())
+            # Only plain (not partial nor expression) indexes can be used by ON CONFLICT
+            cursor.execute(
+                'SELECT ARRAY('
+                '  SELECT a.attname FROM unnest(x.indkey) AS k(attnum)'
+                '  JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k.attnum'
+                ') '
+                'FROM pg_index x '
+                'WHERE x.indrelid = %s::regclass AND x.indisunique '
+                'AND x.indpred IS NULL AND x.indexprs IS NULL',
+                (f'"{table}"',)
+            )
+            unique_keys = [frozenset(row[0]) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+        _targets[target] = {'types': types, 'unique_keys': unique_keys}
+    return _targets[target]
+
+
+def upsert_sql(table, fields, key, update, on_conflict, data, select):
+    """ Build the statement to write the rows of the `data` query to a table.
+        With a unique index on `key` it is an INSERT ... ON CONFLICT,
+        otherwise the existing rows are updated and the new ones inserted
+        in a single statement.
+        `select` is the final query over `merged`, the written rows with
+        an `inserted` column (True if the row was inserted).
+    """
+    columns = ", ".join(f'"{field}"' for field in fields)
+    conflict = ", ".join(f'"{field}"' for field in key)
+    if on_conflict:
+        if update:
+            assignments = ", ".join(f'"{field}" = EXCLUDED."{field}"' for field in fields)
+            action = f"DO UPDATE SET {assignments}"
+        else:
+            action = "DO NOTHING"
+        return (
+            f'WITH merged AS ('
+            f'INSERT INTO "{table}" ({columns}) {data} '
+            f'ON CONFLICT ({conflict}) {action} '
+            'RETURNING (xmax = 0) AS inserted'
+            f') {select}'
+        )
+
+    matches = " AND ".join(f't."{field}" = data."{field}"' for field in key)
+    exists = f'SELECT 1 FROM "{table}" t WHERE {matches}'
+    inserted = (
+        f'INSERT INTO "{table}" ({columns}) '
+        f'SELECT {columns} FROM data WHERE NOT EXISTS ({exists}) '
+        'RETURNING 1'
+    )
+    if not update:
+        merged = 'SELECT true AS inserted FROM inserted'
+        return f'WITH data ({columns}) AS ({data}), inserted AS ({inserted}), merged AS ({merged}) {select}'
+    assignments = ", ".join(f'"{field}" = data."{field}"' for field in fields)
+    return (
+        f'WITH data ({columns}) AS ({data}), '
+        f'updated AS (UPDATE "{table}" t SET {assignments} FROM data WHERE {matches} RETURNING 1), '
+        f'inserted AS ({inserted}), '
+        'merged AS (SELECT true AS inserted FROM inserted UNION ALL SELECT false FROM updated) '
+        f'{select}'
+    )
+
+
+def key_getter(fields, key):
+    """ Function that returns the key of a row (the tuple of the values of
+        `fields`) as a tuple of strings, NULLs as NULL_KEY (see KeyIndex)
+    """
+    positions = [fields.index(field) for field in key]
+
+    def row_key(values):
+        return tuple(key_text(values[position]) for position in positions)
+    return row_key
+
+
+class Upserter:
+    """ Write the transformed rows of a table to the new DB in batches.
+        Rows are added one by one (add, or add_values for the tuples of a
+        TableMapping) and written every `batch_size` rows with one INSERT
+        and one UPDATE statement, instead of one SELECT and one UPDATE or
+        INSERT per row.
+        `key` are the columns that identify a row (e.g. ('term', 'lang_code')).
+        The existing keys are read once (see KeyIndex), so new and existing
+        rows are told apart with no round trip.
+        Existing rows are updated, or left untouched with `update=False`.
+        The counters and errors of `ret` (the import_* result) are updated.
+        Batches are written and committed by a BatchTransaction, so a
+        failing row only skips itself.
+        `written(keys)` is called with the keys of the rows written by each
+        batch (e.g. to register the imported IDs).
+    """
+
+    def __init__(self, new_db, table, ret, key=('id',), update=True, batch_size=BATCH_SIZE, commit_every=None,
+                 written=None):
+        self.new_db = new_db
+        self.table = table
+        self.ret = ret
+        self.key = tuple(key)
+        self.update = update
+        self.batch_size = batch_size
+        self.transaction = BatchTransaction(new_db, table, ret, commit_every)
+        self.cursor = self.transaction.cursor
+        self.batch = []
+        self.fields = None
+        self.row_key = None
+        self.statements = {}
+        self.index = None
+        self.written = written
+        # Progress of the import (see --status-file)
+        track_import(new_db, table, ret)
+
+    def add(self, row):
+        """ Add a transformed row (a dict), written with the next batch """
+        self.add_values(tuple(row), tuple(row.values()))
+
+    def add_values(self, fields, values):
+        """ Add a transformed row as the tuple of the `values` of its `fields` """
+        if fields is not self.fields and fields != self.fields:
+            self.flush()
+            self.fields = fields
+            self.row_key = key_getter(fields, self.key)
+        elif len(self.batch) >= self.batch_size:
+            self.flush()
+        self.batch.append(values)
+
+    def add_batch(self, batch):
+        """ Add the transformed rows of an Arrow record batch """
+        fields = tuple(batch.schema.names)
+        for values in zip(*(column_values(column) for column in batch.columns)):
+            self.add_values(fields, values)
+
+    def close(self):
+        """ Write the pending rows and commit """
+        self.flush()
+        self.transaction.close()
+
+    def _statements(self):
+        """ INSERT and UPDATE statements (and UPDATE row template) for the current fields """
+        if self.fields not in self.statements:
+            types = target_table(self.new_db, self.table)['types']
+            columns = ", ".join(f'"{field}"' for field in self.fields)
+            insert_sql = f'INSERT INTO "{self.table}" ({columns}) VALUES %s'
+            update_sql = template = None
+            assignments = ", ".join(f'"{field}" = data."{field}"' for field in self.fields if field not in self.key)
+            if assignments:
+                matches = " AND ".join(f't."{field}" = data."{field}"' for field in self.key)
+                update_sql = (
+                    f'UPDATE "{self.table}" t SET {assignments} '
+                    f'FROM (VALUES %s) AS data ({columns}) WHERE {matches}'
+                )
+                # VALUES are not typed when they are not inserted
+                template = "(" + ", ".join(f"%s::{types.get(field, 'text')}" for field in self.fields) + ")"
+            self.statements[self.fields] = insert_sql, update_sql, template
+        return self.statements[self.fields]
+
+    def flush(self):
+        if not self.batch:
+            return
+        if self.index is None:
+            # The keys loaded by the parent of a --table-workers process (see run_partitioned)
+            shared = getattr(self.new_db, 'key_index', None)
+            if shared is not None and (shared.table, shared.key) == (self.table, self.key):
+                self.index = shared
+            else:
+                # The new DB is only read when there are rows to write
+                types = target_table(self.new_db, self.table)['types']
+                self.index = KeyIndex(self.new_db, self.table, self.key, types)
+        row_key = self.row_key
+        # Compare the keys as the DB writes them (see KeyIndex.normalize)
+        normalized = self.index.normalize({row_key(row) for row in self.batch})
+        if normalized is not None:
+            def row_key(row):
+                return normalized[self.row_key(row)]
+        rows = self._unique_rows(self.batch, row_key)
+        self.batch = []
+
+        existing = self.index.existing([row_key(row) for row in rows])
+        if not self.update:
+            # Rows that already exist are left untouched
+            rows = [row for row in rows if row_key(row) not in existing]
+            self.ret['skipped_rows'] += len(existing)
+
+        def write(batch):
+            new_rows = [row for row in batch if row_key(row) not in existing]
+            old_rows = [row for row in batch if row_key(row) in existing]
+            self._write(new_rows, old_rows)
+
+        written = self.transaction.write(rows, write, lambda row: key_label(row_key(row)), self.fields)
+        inserted = [row_key(row) for row in written if row_key(row) not in existing]
+        self.index.add(inserted)
+        self.ret['migrated_rows'] += len(written)
+        if self.written:
+            self.written([row_key(row) for row in written])
+        log.info(" - %s: %s rows inserted, %s updated", self.table, len(inserted), len(written) - len(inserted))
+
+    def _write(self, new_rows, old_rows):
+        insert_sql, update_sql, template = self._statements()
+        if new_rows:
+            execute_values(self.cursor, insert_sql, new_rows, page_size=len(new_rows))
+        if old_rows and update_sql:
+            execute_values(self.cursor, update_sql, old_rows, template=template, page_size=len(old_rows))
+
+    def _unique_rows(self, rows, row_key):
+        """ A key is written once per batch. Like row by row writes,
+            the last row wins (or the first one with `update=False`).
+            Keys with NULL values are never equal, all their rows are written.
+        """
+        unique = {}
+        nulls = []
+        for row in rows:
+            key = row_key(row)
+            if NULL_KEY in key:
+                nulls.append(row)
+            elif self.update or key not in unique:
+                unique[key] = row
+        duplicates = len(rows) - len(unique) - len(nulls)
+        if duplicates:
+            if self.update:
+                self.ret['migrated_rows'] += duplicates
+            else:
+                self.ret['skipped_rows'] += duplicates
+        return list(unique.values()) + nulls
+
+
+def copy_value(value, pg_type='text'):
+    """ Format a value of a `pg_type` column for COPY ... FROM STDIN (text format) """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list) and pg_type.endswith('[]'):
+        items = (
+            'NULL' if item is None else '"' + str(item).replace('\\', '\\\\').replace('"', '\\"') + '"'
+            for item in value
+        )
+        value = '{' + ','.join(items) + '}'
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def pg_array_literals(array):
+    """ Format an Arrow list array as PostgreSQL array literals ({"a","b"}),
+        with Arrow compute functions (no Python work per row)
+    """
+    items = pc.cast(array.flatten(), pa.string())
+    items = pc.replace_substring(pc.replace_substring(items, '\\', '\\\\'), '"', '\\"')
+    items = pc.fill_null(pc.binary_join_element_wise('"', items, '"', ''), 'NULL')
+    # The offsets of a sliced array do not start at 0
+    offsets = pc.subtract(array.offsets, array.offsets[0])
+    quoted = pa.ListArray.from_arrays(offsets, items, mask=array.is_null())
+    return pc.binary_join_element_wise('{', pc.binary_join(quoted, ','), '}', '')
+
+
+class StagedUpserter:
+    """ Like Upserter, for the largest tables.
+        Rows are loaded with COPY into a temporary staging table and
+        written to the table with a single set-based statement when the
+        upserter is closed.
+        `references` are the rows to reject (orphans) before writing, as dicts:
+          {'column': 'user_id', 'table': 'user', 'when': "table_name = 'user'"}
+        A staged row is rejected if its `column` (when not NULL and `when`
+        is true, if given) is not an `id` of the new DB `table`.
+        Rejected rows are moved to a reject table and reported as errors.
+        Rows are staged by a BatchTransaction: if a COPY fails (a value
+        the column type rejects) it is split to find the failing rows,
+        which are skipped and quarantined.
+        If the merge fails the staged rows are written by an Upserter,
+        so only the failing rows are skipped (and quarantined).
+    """
+
+    def __init__(self, new_db, table, ret, key=('id',), update=True, references=None, batch_size=COPY_BATCH_SIZE):
+        self.new_db = new_db
+        self.table = table
+        self.ret = ret
+        self.key = tuple(key)
+        self.update = update
+        self.references = references or []
+        self.batch_size = batch_size
+        self.stage = f"stage_{table}"
+        self.rejects = f"reject_{table}"
+        self.transaction = BatchTransaction(new_db, table, ret)
+        self.cursor = self.transaction.cursor
+        self.batch = []
+        self.fields = None
+        self.staged_rows = 0
+        # Progress of the import (see --status-file)
+        track_import(new_db, table, ret)
+
+    def add(self, row):
+        """ Add a transformed row (a dict), copied to the staging table with the next batch """
+        self.add_values(tuple(row), tuple(row.values()))
+
+    def add_values(self, fields, values):
+        """ Add a transformed row as the tuple of the `values` of its `fields`
+            (the same fields for all the rows)
+        """
+        if self.fields is None:
+            self.fields = fields
+            self._create_stage()
+        elif len(self.batch) >= self.batch_size:
+            self.flush()
+        self.batch.append(values)
+
+    def add_batch(self, batch):
+        """ Add the transformed rows of an Arrow record batch, copied at once
+            to the staging table: the columns are written as CSV by Arrow,
+            with no Python work per row
+        """
+        if not batch.num_rows:
+            return
+        if self.fields is None:
+            self.fields = tuple(batch.schema.names)
+            self._create_stage()
+        # Staging order matters for duplicated keys
+        self.flush()
+        arrays = [pg_array_literals(array) if pa.types.is_list(array.type) else array for array in batch.columns]
+        buffer = io.BytesIO()
+        pa_csv.write_csv(
+            pa.RecordBatch.from_arrays(arrays, names=list(self.fields)), buffer,
+            pa_csv.WriteOptions(include_header=False)
+        )
+        buffer.seek(0)
+        columns = ", ".join(f'"{field}"' for field in self.fields)
+        self.cursor.execute("SAVEPOINT stage_batch")
+        try:
+            self.cursor.copy_expert(f'COPY "{self.stage}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+            self.cursor.execute("RELEASE SAVEPOINT stage_batch")
+        except psycopg2.Error as e:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT stage_batch")
+            log.warning(" - COPY of %s rows failed (%s), staging them in batches", self.table, str(e).strip())
+            # The rows are staged one batch at a time, the failing ones are quarantined
+            self.batch = list(zip(*(column_values(column) for column in batch.columns)))
+            self.flush()
+            return
+        self.staged_rows += batch.num_rows
+        log.info(" - %s: %s rows staged", self.table, self.staged_rows)
+
+    def flush(self):
+        """ COPY the pending rows to the staging table """
+        if not self.batch:
+            return
+        rows, self.batch = self.batch, []
+        row_key = key_getter(self.fields, self.key)
+        written = self.transaction.write(rows, self._copy, lambda row: key_label(row_key(row)), self.fields)
+        self.staged_rows += len(written)
+        log.info(" - %s: %s rows staged", self.table, self.staged_rows)
+
+    def _copy(self, rows):
+        types = target_table(self.new_db, self.table)['types']
+        field_types = [types.get(field, 'text') for field in self.fields]
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(copy_value(value, pg_type) for value, pg_type in zip(row, field_types)) + '\n')
+        buffer.seek(0)
+        columns = ", ".join(f'"{field}"' for field in self.fields)
+        self.cursor.copy_expert(f'COPY "{self.stage}" ({columns}) FROM STDIN', buffer)
+
+    def close(self):
+        """ Reject the orphan rows, merge the staged rows into the table and commit """
+        try:
+            if self.fields is not None:
+                self.flush()
+                self._reject_orphans()
+                self._merge()
+        finally:
+            self._drop_stage()
+        self.transaction.close()
+
+    def _drop_stage(self):
+        """ Temporary tables survive the commits of a batched merge and the
+            connection can import other tables, drop them (also on errors)
+        """
+        conn = self.new_db.conn
+        if self.fields is None or conn.closed:
+            return
+        if conn.get_transaction_status() == TRANSACTION_STATUS_INERROR:
+            conn.rollback()
+        self.cursor.execute(f'DROP TABLE IF EXISTS "{self.stage}", "{self.rejects}"')
+
+    def _create_stage(self):
+        columns = ", ".join(f'"{field}"' for field in self.fields)
+        # Left by an import of the table that failed before close
+        self.cursor.execute(f'DROP TABLE IF EXISTS "{self.stage}", "{self.rejects}"')
+        # Same column types as the table, but no constraints
+        self.cursor.execute(
+            f'CREATE TEMP TABLE "{self.stage}" AS '
+            f'SELECT {columns} FROM "{self.table}" WITH NO DATA'
+        )
+        # Staging order, the last row of a duplicated key wins
+        self.cursor.execute(f'ALTER TABLE "{self.stage}" ADD COLUMN stage_row bigserial')
+        self.cursor.execute(f'CREATE TEMP TABLE "{self.rejects}" (reason text, row jsonb)')
+
+    def _reject_orphans(self):
+        for reference in self.references:
+            column = reference['column']
+            condition = f"s.\"{column}\" IS NOT NULL AND ({reference.get('when', 'true')})"
+            reason = f"{column} not found in {reference['table']}"
+            # Anti-join, the orphans are moved to the reject table in the same statement
+            self.cursor.execute(
+                f'WITH rejected AS ('
+                f'DELETE FROM "{self.stage}" s WHERE {condition} '
+                f'AND NOT EXISTS (SELECT 1 FROM "{reference["table"]}" r WHERE r.id = s."{column}") '
+                f'RETURNING s.*'
+                f') INSERT INTO "{self.rejects}" SELECT %s, to_jsonb(rejected) - \'stage_row\' FROM rejected',
+                (reason,)
+            )
+
+        self.cursor.execute(f'SELECT reason, row FROM "{self.rejects}"')
+        rejected = self.cursor.fetchall()
+        for reason, row in rejected:
+            label = key_label(tuple(key_text(row[field]) for field in self.key))
+            self.ret['errors'].append(f"Error importing {self.table} {label}: {reason}")
+        if rejected:
+            log.warning(" - %s: %s rows rejected", self.table, len(rejected))
+        self.ret['skipped_rows'] += len(rejected)
+        self.staged_rows -= len(rejected)
+
+    def _merge(self):
+        target = target_table(self.new_db, self.table)
+        on_conflict = frozenset(self.key) in target['unique_keys']
+        columns = ", ".join(f'"{field}"' for field in self.fields)
+        conflict = ", ".join(f'"{field}"' for field in self.key)
+        order = "DESC" if self.update else "ASC"
+        data = (
+            f'SELECT {columns} FROM ('
+            f'SELECT DISTINCT ON ({conflict}) * FROM "{self.stage}" ORDER BY {conflict}, stage_row {order}'
+            f') AS staged'
+        )
+        select = 'SELECT count(*) FILTER (WHERE inserted), count(*) FROM merged'
+        sql = upsert_sql(self.table, self.fields, self.key, self.update, on_conflict, data, select)
+
+        self.cursor.execute("SAVEPOINT staged_merge")
+        try:
+            self.cursor.execute(sql)
+            inserted, merged = self.cursor.fetchone()
+            self.cursor.execute("RELEASE SAVEPOINT staged_merge")
+        except psycopg2.Error as e:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT staged_merge")
+            log.warning(" - Merge of %s failed (%s), importing the staged rows in batches", self.table, str(e).strip())
+            self._merge_in_batches()
+            return
+
+        # Duplicated keys are written once, like row by row writes
+        duplicates = self.staged_rows - merged if self.update else 0
+        self.ret['migrated_rows'] += merged + duplicates
+        self.ret['skipped_rows'] += self.staged_rows - merged - duplicates
+        log.info(" - %s: %s rows inserted, %s updated", self.table, inserted, merged - inserted)
+
+    def _merge_in_batches(self):
+        upsert = Upserter(self.new_db, self.table, self.ret, self.key, self.update)
+        columns = ", ".join(f'"{field}"' for field in self.fields)
+        # Server-side cursor, the staged rows are read in batches.
+        # WITH HOLD keeps it open when the upserter commits
+        cursor = self.new_db.conn.cursor(name=f"read_{self.stage}", withhold=True)
+        cursor.itersize = upsert.batch_size
+        cursor.execute(f'SELECT {columns} FROM "{self.stage}" ORDER BY stage_row')
+        for row in cursor:
+            upsert.add_values(self.fields, row)
+        cursor.close()
+        upsert.close()
@@ -2,10 +2,16 @@ import importlib
 # To check if scripts/ckan_migrate/customize/user.py is defined 
 # and import a custom transform_user function
 import logging
+from ckan_migrate.id_registry import IdRegistry
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['user']
+
 
 def import_users(old_users, new_db):
     """ Get all old users from DB and import them
@@ -13,7 +19,7 @@ def import_users(old_users, new_db):
     """
     log.info("Getting users from old database...")
     ret = {
-        'valid_users_ids': [],
+        'valid_users_ids': IdRegistry(),
         'valid_users_names': [],
         'total_rows': 0,
         'migrated_rows': 0,
@@ -23,17 +29,24 @@ def import_users(old_users, new_db):
     }
     # Old CKAN version allows duplicated emails
     # CKAN 2.11 do not allow them so we will hack them
-    emails_in_use = []
+    emails_in_use = set()
+
+    def register_written(keys):
+        # Only the users that were written are valid for the other tables
+        for (user_id,) in keys:
+            ret['valid_users_ids'].add(user_id)
+
+    upsert = Upserter(new_db, "user", ret, written=register_written)
+    rows_log = RowLog(log, new_db)
     for user in old_users:
         ret['total_rows'] += 1
-        log.info(f"Importing user: {user['name']}")
+        rows_log.info("Importing user: %s", user['name'])
         new_user = transform_user(user)
         if not new_user:
-            log.warning(f" - Skipping user {user['name']}.")
+            log.warning(" - Skipping user %s.", user['name'])
             ret['skipped_rows'] += 1
             continue
 
-        ret['valid_users_ids'].append(new_user['id'])
         ret['valid_users_names'].append(new_user['name'])
         if new_user['email'] and new_user['email'] in emails_in_use:
             # Add a hash to the email
@@ -45,29 +58,15 @@ def import_users(old_users, new_db):
                 f" New email: {new_user['email']} (old: {dup_email})"
             )
 
-        fields = new_user.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the user ID exists
-        sql = 'SELECT * FROM "user" WHERE id = %s'
-        new_db.cursor.execute(sql, (user["id"],))
-        fields_str = ', '.join(fields)
-        if new_db.cursor.fetchone():
-            log.warning(f" - User {user['name']} already exists, updating the record")
-            sql = f'UPDATE "user" SET ({fields_str}) = ({placeholders}) WHERE id= %s'
-            new_db.cursor.execute(sql, tuple(new_user[field] for field in fields) + (user["id"],))
-        else:
-            sql = f'INSERT INTO "user" ({fields_str}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_user[field] for field in fields))
-        log.info(f" - User {user['name']} imported successfully.")
-        emails_in_use.append(new_user['email'])
-        ret['migrated_rows'] += 1
+        upsert.add(new_user)
+        emails_in_use.add(new_user['email'])
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_user(user, migrate_deleted=True):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return a dict for the new DB object (see MAPPING)
         Old users looks like (it could be different in your case)
           {
             "id":"0478ad7d-xxxxx",
@@ -91,19 +90,9 @@ def transform_user(user, migrate_deleted=True):
         custom_user = importlib.import_module("ckan_migrate.customize.user")
         if hasattr(custom_user, "transform_user"):
             log.info("Using custom transform_user function from customize/user.py")
-            user = custom_user.transform_user(user)
+            # Custom functions get (and may change) a dict
+            user = custom_user.transform_user(dict(user))
             if not user:
                 return None
 
-    new_user = {
-        'id': user['id'],
-        'name': user['name'],
-        'email': user['email'],
-        'about': user['about'],
-        'created': user['created'],
-        'fullname': user['fullname'],
-        'sysadmin': user['sysadmin'],
-        'state': user['state']
-    }
-
-    return new_user
+    return MAPPING.transform(user)
@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['user_following_dataset']
+
 
 def import_user_following_datasets(old_user_following_datasets, new_db, valid_users_ids=None):
     """ Get all old user following datasets from CSV and import them
@@ -17,23 +22,23 @@ def import_user_following_datasets(old_user_following_datasets, new_db, valid_us
         'errors': []
     }
 
+    upsert = Upserter(new_db, "user_following_dataset", ret, key=('follower_id', 'object_id'))
+    rows_log = RowLog(log, new_db)
     for user_following_dataset in old_user_following_datasets:
         ret['total_rows'] += 1
-        log.info(
-            f"Importing user fo.ing dataset: {user_following_dataset['follower_id']} -> {user_following_dataset['object_id']}"
+        rows_log.info(
+            "Importing user fo.ing dataset: %s -> %s", user_following_dataset['follower_id'], user_following_dataset['object_id']
         )
         new_user_following_dataset = transform_user_following_dataset(user_following_dataset)
         if not new_user_following_dataset:
             log.warning(
-                (
-                    f" - Skipping user following dataset {user_following_dataset['follower_id']} -> "
-                    f"{user_following_dataset['object_id']}."
-                )
+                " - Skipping user following dataset %s -> %s.",
+                user_following_dataset['follower_id'], user_following_dataset['object_id']
             )
             ret['skipped_rows'] += 1
             continue
 
-        if valid_users_ids and new_user_following_dataset['follower_id'] not in valid_users_ids:
+        if valid_users_ids and user_following_dataset['follower_id'] not in valid_users_ids:
             ret['errors'].append(
                 f" - User following dataset '{user_following_dataset['follower_id']} -> {user_following_dataset['object_id']}'"
                 " ignored, the follower user does not exist in the new database."
@@ -41,47 +46,14 @@ def import_user_following_datasets(old_user_following_datasets, new_db, valid_us
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_user_following_dataset.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the user following dataset relationship exists
-        sql = 'SELECT * FROM "user_following_dataset" WHERE follower_id = %s AND object_id = %s'
-        new_db.cursor.execute(sql, (user_following_dataset["follower_id"], user_following_dataset["object_id"]))
-        if new_db.cursor.fetchone():
-            log.warning(
-                (
-                    f" - User following dataset {user_following_dataset['follower_id']} -> "
-                    f"{user_following_dataset['object_id']} already exists, updating the record"
-                )
-            )
-            sql = (
-                f'UPDATE "user_following_dataset" SET ({", ".join(fields)}) = ({placeholders}) '
-                'WHERE follower_id= %s AND object_id= %s'
-            )
-            new_db.cursor.execute(
-                sql,
-                tuple(
-                    new_user_following_dataset[field] for field in fields
-                ) + (
-                    user_following_dataset["follower_id"], user_following_dataset["object_id"]
-                )
-            )
-        else:
-            sql = f'INSERT INTO "user_following_dataset" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_user_following_dataset[field] for field in fields))
-        log.info(
-            (
-                f" - User following dataset {user_following_dataset['follower_id']} -> "
-                f"{user_following_dataset['object_id']} imported successfully."
-            )
-        )
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_user_following_dataset)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_user_following_dataset(user_following_dataset):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old user following datasets looks like:
           {
             "follower_id":"user-id",
@@ -89,10 +61,4 @@ def transform_user_following_dataset(user_following_dataset):
             "datetime":"2017-03-21 18:23:56.055936"
         },
     """
-    new_user_following_dataset = {
-        'follower_id': user_following_dataset['follower_id'],
-        'object_id': user_following_dataset['object_id'],
-        'datetime': user_following_dataset['datetime']
-    }
-
-    return new_user_following_dataset
+    return MAPPING.values(user_following_dataset)
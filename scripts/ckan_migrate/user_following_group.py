@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['user_following_group']
+
 
 def import_user_following_groups(old_user_following_groups, new_db, valid_users_ids=None):
     """ Get all old user following groups from CSV and import them
@@ -17,23 +22,23 @@ def import_user_following_groups(old_user_following_groups, new_db, valid_users_
         'errors': []
     }
 
+    upsert = Upserter(new_db, "user_following_group", ret, key=('follower_id', 'object_id'))
+    rows_log = RowLog(log, new_db)
     for user_following_group in old_user_following_groups:
         ret['total_rows'] += 1
-        log.info(
-            f"Importing user following group: {user_following_group['follower_id']} -> {user_following_group['object_id']}"
+        rows_log.info(
+            "Importing user following group: %s -> %s", user_following_group['follower_id'], user_following_group['object_id']
         )
         new_user_following_group = transform_user_following_group(user_following_group)
         if not new_user_following_group:
             log.warning(
-                (
-                    f" - Skipping user following group {user_following_group['follower_id']} -> "
-                    f"{user_following_group['object_id']}."
-                )
+                " - Skipping user following group %s -> %s.",
+                user_following_group['follower_id'], user_following_group['object_id']
             )
             ret['skipped_rows'] += 1
             continue
 
-        if valid_users_ids and new_user_following_group['follower_id'] not in valid_users_ids:
+        if valid_users_ids and user_following_group['follower_id'] not in valid_users_ids:
             ret['errors'].append(
                 f" - User following group '{user_following_group['follower_id']} -> {user_following_group['object_id']}'"
                 " ignored, the follower user does not exist in the new database."
@@ -41,48 +46,14 @@ def import_user_following_groups(old_user_following_groups, new_db, valid_users_
             ret['skipped_rows'] += 1
             continue
 
-        fields = new_user_following_group.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the user following group relationship exists
-        sql = 'SELECT * FROM "user_following_group" WHERE follower_id = %s AND object_id = %s'
-        new_db.cursor.execute(sql, (user_following_group["follower_id"], user_following_group["object_id"]))
-        if new_db.cursor.fetchone():
-            log.warning(
-                (
-                    f" - User following group {user_following_group['follower_id']} -> "
-                    "{user_following_group['object_id']} already exists, updating the record"
-                )
-            )
-            sql = (
-                f'UPDATE "user_following_group" SET ({", ".join(fields)}) = ({placeholders}) '
-                'WHERE follower_id= %s AND object_id= %s'
-            )
-            new_db.cursor.execute(
-                sql,
-                tuple(
-                    new_user_following_group[field]
-                    for field in fields
-                ) + (
-                    user_following_group["follower_id"], user_following_group["object_id"]
-                )
-            )
-        else:
-            sql = f'INSERT INTO "user_following_group" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_user_following_group[field] for field in fields))
-        log.info(
-            (
-                f" - User following group {user_following_group['follower_id']} -> "
-                f"{user_following_group['object_id']} imported successfully."
-            )
-        )
-        ret['migrated_rows'] += 1
+        upsert.add_values(MAPPING.fields, new_user_following_group)
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_user_following_group(user_following_group):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return the values of the new DB object (in the order of MAPPING.fields)
         Old user following groups looks like:
           {
             "follower_id":"user-id",
@@ -90,10 +61,4 @@ def transform_user_following_group(user_following_group):
             "datetime":"2017-03-21 18:23:56.055936"
         },
     """
-    new_user_following_group = {
-        'follower_id': user_following_group['follower_id'],
-        'object_id': user_following_group['object_id'],
-        'datetime': user_following_group['datetime']
-    }
-
-    return new_user_following_group
+    return MAPPING.values(user_following_group)
@@ -1,8 +1,13 @@
 import logging
+from ckan_migrate.upsert import Upserter
+from ckan_migrate.mapping import MAPPINGS
+from ckan_migrate.logs import RowLog
 
 
 log = logging.getLogger(__name__)
 
+MAPPING = MAPPINGS['vocabulary']
+
 
 def import_vocabularies(old_vocabularies, new_db):
     """ Get all old vocabularies from CSV and import them """
@@ -16,13 +21,15 @@ def import_vocabularies(old_vocabularies, new_db):
     }
 
     # Handle potential duplicate names
-    names_in_use = []
+    names_in_use = set()
+    upsert = Upserter(new_db, "vocabulary", ret)
+    rows_log = RowLog(log, new_db)
     for vocabulary in old_vocabularies:
         ret['total_rows'] += 1
-        log.info(f"Importing vocabulary: {vocabulary['name']}")
+        rows_log.info("Importing vocabulary: %s", vocabulary['name'])
         new_vocabulary = transform_vocabulary(vocabulary)
         if not new_vocabulary:
-            log.warning(f" - Skipping vocabulary {vocabulary['name']}.")
+            log.warning(" - Skipping vocabulary %s.", vocabulary['name'])
             ret['skipped_rows'] += 1
             continue
 
@@ -35,37 +42,19 @@ def import_vocabularies(old_vocabularies, new_db):
                 f" New name: {new_vocabulary['name']} (old: {original_name})"
             )
 
-        fields = new_vocabulary.keys()
-        placeholders = ', '.join(['%s'] * len(fields))
-        # Check if the vocabulary ID exists
-        sql = 'SELECT * FROM "vocabulary" WHERE id = %s'
-        new_db.cursor.execute(sql, (vocabulary["id"],))
-        if new_db.cursor.fetchone():
-            log.warning(f" - Vocabulary {vocabulary['name']} already exists, updating the record")
-            sql = f'UPDATE "vocabulary" SET ({", ".join(fields)}) = ({placeholders}) WHERE id= %s'
-            new_db.cursor.execute(sql, tuple(new_vocabulary[field] for field in fields) + (vocabulary["id"],))
-        else:
-            sql = f'INSERT INTO "vocabulary" ({", ".join(fields)}) VALUES ({placeholders})'
-            new_db.cursor.execute(sql, tuple(new_vocabulary[field] for field in fields))
-        log.info(f" - Vocabulary {vocabulary['name']} imported successfully.")
-        names_in_use.append(new_vocabulary['name'])
-        ret['migrated_rows'] += 1
+        upsert.add(new_vocabulary)
+        names_in_use.add(new_vocabulary['name'])
 
-    new_db.conn.commit()
+    upsert.close()
     return ret
 
 
 def transform_vocabulary(vocabulary):
-    """ Get an old db object and return a dict for the new DB object
+    """ Get an old db object and return a dict for the new DB object (see MAPPING)
         Old vocabularies looks like:
           {
             "id":"vocabulary-id",
             "name":"vocabulary-name"
         },
     """
-    new_vocabulary = {
-        'id': vocabulary['id'],
-        'name': vocabulary['name']
-    }
-
-    return new_vocabulary
+    return MAPPING.transform(vocabulary)
@@ -0,0 +1,107 @@
+"""
+Helpers to write the extracted files compressed while they are streamed
+and to read them back transparently.
+gzip uses the standard library, zstd requires the zstandard package.
+"""
+
+import gzip
+import io
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# File extension added by each compression method
+COMPRESSION_EXTENSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+# zstd frames are closed every ZSTD_FRAME_SIZE bytes of input, so each frame
+# can be decompressed independently (and in parallel) by other tools
+ZSTD_FRAME_SIZE = 64 * 1024 * 1024
+
+
+def compressed_path(path, compression=None):
+    """ Return the file path with the extension of the compression method """
+    if not compression:
+        return path
+    return path + COMPRESSION_EXTENSIONS[compression]
+
+
+class _ZstdFrameWriter(io.RawIOBase):
+    """ Multi-threaded zstd writer that starts a new frame every `frame_size` bytes """
+
+    def __init__(self, f, level=3, frame_size=ZSTD_FRAME_SIZE):
+        # threads=-1 uses one compression thread per CPU core
+        compressor = zstandard.ZstdCompressor(level=level, threads=-1)
+        self.writer = compressor.stream_writer(f)
+        self.frame_size = frame_size
+        self.frame_bytes = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.writer.write(data)
+        self.frame_bytes += len(data)
+        if self.frame_bytes >= self.frame_size:
+            self.writer.flush(zstandard.FLUSH_FRAME)
+            self.frame_bytes = 0
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            # Ends the last frame and closes the underlying file
+            self.writer.close()
+        super().close()
+
+
+def open_output(path, compression=None, text=False):
+    """ Open a file to write, compressing it with `compression` (None, gzip or zstd).
+        `path` must already include the compression extension (see compressed_path).
+        Return a binary file object, or a text one if `text` is True.
+    """
+    if compression == 'gzip':
+        f = gzip.open(path, 'wb', compresslevel=6)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstd compression requires the zstandard package (pip install zstandard)")
+        f = io.BufferedWriter(_ZstdFrameWriter(open(path, 'wb')))
+    elif compression:
+        raise ValueError(f"Unknown compression: {compression}")
+    else:
+        f = open(path, 'wb')
+    if text:
+        return io.TextIOWrapper(f, encoding='utf-8', newline='')
+    return f
+
+
+def find_extracted_file(path):
+    """ Return the existing file for `path`, plain or compressed (.gz, .zst).
+        If more than one exists the most recent one is used.
+        Return None if there is no file.
+    """
+    candidates = [path] + [path + ext for ext in COMPRESSION_EXTENSIONS.values()]
+    existing = [candidate for candidate in candidates if os.path.exists(candidate)]
+    if not existing:
+        return None
+    return max(existing, key=os.path.getmtime)
+
+
+def open_input(path):
+    """ Open a (maybe compressed) extracted file to read, in binary mode.
+        The compression is detected from the file extension.
+    """
+    if path.endswith(COMPRESSION_EXTENSIONS['gzip']):
+        return gzip.open(path, 'rb')
+    if path.endswith(COMPRESSION_EXTENSIONS['zstd']):
+        if zstandard is None:
+            raise ImportError("Reading zstd files requires the zstandard package (pip install zstandard)")
+        decompressor = zstandard.ZstdDecompressor()
+        # The files have many frames, read all of them
+        return io.BufferedReader(decompressor.stream_reader(open(path, 'rb'), read_across_frames=True))
+    return open(path, 'rb')
@@ -5,11 +5,48 @@ and data.
 """
 
 import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ
 import pandas as pd
+import pyarrow as pa
 import json
+import multiprocessing
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
-from typing import Dict, List, Any
+from compression import open_output
+from writers import Chunk, TableWriter, TYPED_FORMATS, output_file_name, remove_table_files
+from ckan_migrate.metrics import WorkerMetrics
+from ckan_migrate.records import tuple_records
+from typing import Dict, Iterator, List, Any
+
+
+# PostgreSQL types (as named by information_schema) kept as native Arrow types
+# Any other type is exported as text
+PG_ARROW_TYPES = {
+    'boolean': pa.bool_(),
+    'smallint': pa.int16(),
+    'integer': pa.int32(),
+    'bigint': pa.int64(),
+    'real': pa.float32(),
+    'double precision': pa.float64(),
+    'text': pa.string(),
+    'character varying': pa.string(),
+    'character': pa.string(),
+    'date': pa.date32(),
+    'timestamp without time zone': pa.timestamp('us'),
+    'timestamp with time zone': pa.timestamp('us', tz='UTC'),
+}
+
+# pg_constraint.contype codes
+CONSTRAINT_TYPES = {
+    'p': 'PRIMARY KEY',
+    'f': 'FOREIGN KEY',
+    'u': 'UNIQUE',
+    'c': 'CHECK',
+    'x': 'EXCLUDE',
+    't': 'TRIGGER',
+}
 
 
 class PSQL:
@@ -27,6 +64,12 @@ class PSQL:
         }
         self.conn = None
         self.cursor = None
+        # Exported snapshot shared by parallel workers (see use_snapshot)
+        self.snapshot_id = None
+        # Structure of all the tables (see load_catalog)
+        self.catalog = None
+        # Progress of the extraction (see ckan_migrate.metrics)
+        self.metrics = None
 
     def connect(self):
         """
@@ -52,6 +95,43 @@ class PSQL:
             self.conn.close()
         print("Database connection closed.")
 
+    def export_snapshot(self):
+        """
+        Open a new connection with a REPEATABLE READ transaction and export
+        its snapshot, so other connections can read the database exactly as
+        this transaction sees it.
+        Return (connection, snapshot_id). The connection must stay open
+        (and its transaction unfinished) while the snapshot is in use.
+        Return (None, None) if the server cannot export snapshots.
+        """
+        conn = None
+        try:
+            conn = psycopg2.connect(**self.connection_params)
+            conn.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_export_snapshot();")
+            snapshot_id = cursor.fetchone()[0]
+            print(f"Exported snapshot {snapshot_id}")
+            return conn, snapshot_id
+        except psycopg2.Error as e:
+            print(f"Warning: could not export a snapshot, tables may be read at different moments: {e}")
+            if conn:
+                conn.close()
+            return None, None
+
+    def use_snapshot(self, snapshot_id: str):
+        """
+        Start a new REPEATABLE READ transaction that reads from the exported
+        snapshot `snapshot_id` (see export_snapshot).
+        Read-only transactions that live until the next call.
+        """
+        self.conn.rollback()
+        if self.snapshot_id is None:
+            self.conn.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+        self.snapshot_id = snapshot_id
+        # It must be the first statement of the transaction
+        self.cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+
     def get_all_tables(self) -> List[str]:
         """
         Get list of all tables in the database (excluding system tables).
@@ -71,51 +151,120 @@ class PSQL:
             print(f"Error fetching tables: {e}")
             return []
 
-    def get_table_info(self, table_name: str) -> Dict[str, Any]:
+    def load_catalog(self, exact_counts: bool = False) -> Dict[str, Dict]:
         """
-        Get detailed information about a specific table.
+        Read the structure of all the tables in two round trips: the columns
+        (from information_schema, to keep its type names) and, from pg_catalog,
+        the row estimates, total size, constraints and indexes.
+        Row counts are the planner estimates (pg_class.reltuples), only tables
+        that were never analyzed are counted. Use `exact_counts` to run a
+        COUNT(*) on every table.
+        The catalog is cached and used by get_table_info and the reports.
         """
-        # Get column information
         column_query = """
         SELECT
+            table_name,
             column_name,
             data_type,
             is_nullable,
             column_default,
             character_maximum_length
         FROM information_schema.columns
-        WHERE table_name = %s AND table_schema = 'public'
-        ORDER BY ordinal_position;
+        WHERE table_schema = 'public'
+        ORDER BY table_name, ordinal_position;
         """
 
-        # Get row count
-        count_query = f'SELECT COUNT(*) FROM "{table_name}";'
+        table_query = """
+        SELECT
+            c.relname,
+            c.reltuples::bigint,
+            c.relpages,
+            pg_total_relation_size(c.oid),
+            (
+                SELECT json_agg(json_build_object(
+                    'name', con.conname,
+                    'type', con.contype,
+                    'columns', (
+                        SELECT array_agg(a.attname ORDER BY k.n)
+                        FROM unnest(con.conkey) WITH ORDINALITY AS k(attnum, n)
+                        JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+                    ),
+                    'definition', pg_get_constraintdef(con.oid)
+                ) ORDER BY con.conname)
+                FROM pg_constraint con
+                WHERE con.conrelid = c.oid
+            ),
+            (
+                SELECT json_agg(json_build_object(
+                    'name', i.relname,
+                    'unique', x.indisunique,
+                    'primary', x.indisprimary,
+                    'definition', pg_get_indexdef(x.indexrelid)
+                ) ORDER BY i.relname)
+                FROM pg_index x
+                JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE x.indrelid = c.oid
+            )
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p');
+        """
 
+        catalog = {}
+        cursor = self.conn.cursor()
         try:
-            # Get columns
-            self.cursor.execute(column_query, (table_name,))
-            columns = []
-            for row in self.cursor.fetchall():
-                columns.append({
-                    'name': row[0],
-                    'type': row[1],
-                    'nullable': row[2],
-                    'default': row[3],
-                    'max_length': row[4]
+            cursor.execute(column_query)
+            columns = {}
+            for row in cursor.fetchall():
+                columns.setdefault(row[0], []).append({
+                    'name': row[1],
+                    'type': row[2],
+                    'nullable': row[3],
+                    'default': row[4],
+                    'max_length': row[5]
                 })
 
-            # Get row count
-            self.cursor.execute(count_query)
-            row_count = self.cursor.fetchone()[0]
-
-            return {
-                'table_name': table_name,
-                'columns': columns,
-                'row_count': row_count
-            }
+            cursor.execute(table_query)
+            for relname, reltuples, relpages, total_size, constraints, indexes in cursor.fetchall():
+                constraints = constraints or []
+                for constraint in constraints:
+                    constraint['type'] = CONSTRAINT_TYPES.get(constraint['type'], constraint['type'])
+                # Never analyzed: -1 since PostgreSQL 14, 0 (with pages) before
+                unknown = reltuples < 0 or (reltuples == 0 and relpages > 0)
+                catalog[relname] = {
+                    'table_name': relname,
+                    'columns': columns.get(relname, []),
+                    'row_count': max(reltuples, 0),
+                    'row_count_exact': False,
+                    'total_size': total_size,
+                    'constraints': constraints,
+                    'indexes': indexes or [],
+                }
+                if exact_counts or unknown:
+                    cursor.execute(f'SELECT COUNT(*) FROM "{relname}";')
+                    catalog[relname]['row_count'] = cursor.fetchone()[0]
+                    catalog[relname]['row_count_exact'] = True
         except psycopg2.Error as e:
-            print(f"Error getting info for table {table_name}: {e}")
+            print(f"Error reading the database catalog: {e}")
+            self.conn.rollback()
+        finally:
+            cursor.close()
+
+        self.catalog = catalog
+        return catalog
+
+    def get_table_info(self, table_name: str) -> Dict[str, Any]:
+        """
+        Get detailed information about a specific table from the catalog
+        (see load_catalog).
+        """
+        if self.catalog is None:
+            self.load_catalog()
+        info = self.catalog.get(table_name)
+        if info is None:
+            print(f"Error getting info for table {table_name}: not found in the catalog")
             return {}
+        return info
 
     def extract_table_data(self, table_name: str,
                            limit: int = None) -> pd.DataFrame:
@@ -153,80 +302,252 @@ class PSQL:
             return df
         except Exception as e:
             print(f"Error extracting data from table {table_name}: {e}")
-            return pd.DataFrame()
+            raise
 
     def save_table_data(self, table_name: str, df: pd.DataFrame,
-                        output_dir: str = "extracted_data"):
+                        output_dir: str = "extracted_data",
+                        compression: str = None,
+                        output_formats: List[str] = ("csv", "ndjson")):
         """
-        Save table data to different formats (CSV, JSON).
+        Save table data to one file per output format (CSV and NDJSON by
+        default), writing the DataFrame once to all of them.
+        `compression` (gzip or zstd) compresses the files.
+        On errors the files are removed and the error is raised.
         """
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+        writer = TableWriter(table_name, output_formats, output_dir, compression)
+        try:
+            writer.write(Chunk(list(df.columns), frame=df))
+            writer.close()
+        except Exception as e:
+            print(f"Error saving data for {table_name}: {e}")
+            writer.discard()
+            raise
+        for path in writer.paths.values():
+            print(f"Saved {table_name} data to {path}")
+
+    def iter_table_rows(self, table_name: str, fetch_size: int = 10000,
+                        limit: int = None, select: str = None,
+                        where: str = None) -> Iterator[tuple]:
+        """
+        Read a table through a named (server-side) cursor and yield tuples
+        (column_names, rows) with at most `fetch_size` rows each.
+        Only one chunk is held in client memory at a time.
+        `select` replaces the default SELECT * query and `where` filters
+        the rows (used to read a range of the table).
+        """
+        query = select or f'SELECT * FROM "{table_name}"'
+        if where:
+            query += f" WHERE {where}"
+        if limit:
+            query += f" LIMIT {limit}"
+
+        # A named cursor keeps the result set on the server and sends
+        # `itersize` rows per network round trip
+        cursor = self.conn.cursor(name=f"extract_{table_name}")
+        cursor.itersize = fetch_size
+        try:
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                columns = [desc[0] for desc in cursor.description]
+                yield columns, rows
+        finally:
+            cursor.close()
+            # Close the read transaction the named cursor was living in
+            # (unless it is reading an exported snapshot, see use_snapshot)
+            if not self.snapshot_id:
+                self.conn.rollback()
+
+    def iter_table_records(self, table_name: str, fetch_size: int = 10000,
+                           where: str = None) -> Iterator[List[Dict]]:
+        """
+        Read a table through a server-side cursor and yield lists of at most
+        `fetch_size` records, like the rows loaded from the extracted files.
+        Columns are read as in the Parquet output (see _typed_select).
+        `where` filters the rows (used to read a partition of the table).
+        """
+        table_info = self.get_table_info(table_name)
+        if not table_info:
+            return
+        select = self._typed_select(table_name, table_info['columns'])
+        for columns, rows in self.iter_table_rows(table_name, fetch_size, select=select, where=where):
+            yield tuple_records(columns, rows)
 
-        # Save as CSV
-        csv_path = os.path.join(output_dir, f"{table_name}.csv")
+    def stream_table_data(self, table_name: str, columns: List[Dict],
+                          output_formats: List[str] = ("csv", "ndjson"),
+                          output_dir: str = "extracted_data",
+                          fetch_size: int = 10000,
+                          limit: int = None, where: str = None,
+                          file_name: str = None, compression: str = None, part: int = None) -> int:
+        """
+        Extract a table in chunks and write each chunk, as it arrives, to
+        one file per output format (csv, ndjson, parquet, arrow), so memory stays
+        flat whatever the table size.
+        Columns are read with their own type when it has an Arrow
+        equivalent and as text otherwise (see _typed_select).
+        `where` and `file_name` are used to extract a range of the table
+        to its own files (the shard `part`). `compression` (gzip or zstd)
+        compresses the CSV and NDJSON files while they are written.
+        Return the number of rows written. On errors the partial files are
+        removed and the error is raised.
+        """
+        schema = self._arrow_schema(columns)
+        select = self._typed_select(table_name, columns)
+        writer = TableWriter(file_name or table_name, output_formats, output_dir, compression, schema)
         try:
-            df.to_csv(csv_path, index=False)
-            print(f"Saved {table_name} CSV data to {csv_path}")
+            for names, rows in self.iter_table_rows(table_name, fetch_size, limit, select=select, where=where):
+                writer.write(Chunk(names, rows))
+                print(f"  {table_name}: {writer.total_rows} rows written")
+                self._report(table_name, part, total_rows=writer.total_rows, bytes=writer.size())
+            writer.close()
         except Exception as e:
-            print(f"Error saving CSV for {table_name}: {e}")
+            print(f"Error streaming data from table {table_name}: {e}")
+            writer.discard()
+            raise
+        self._report(table_name, part, total_rows=writer.total_rows, bytes=writer.size())
+
+        if writer.total_rows:
+            for path in writer.paths.values():
+                print(f"Saved {table_name} data to {path}")
+        print(f"Extracted {writer.total_rows} rows from table '{table_name}'")
+        return writer.total_rows
+
+    def _report(self, table_name: str, part: int = None, **counters):
+        """
+        Update the progress of the extraction of a table (or of the shard
+        `part`) in self.metrics, if any.
+        """
+        if self.metrics:
+            self.metrics.update(table_name, part, **counters)
 
-        # Save as JSON with datetime handling
-        json_path = os.path.join(output_dir, f"{table_name}.json")
+    def _arrow_schema(self, columns: List[Dict]) -> pa.Schema:
+        """
+        Build the Arrow schema for a table from its PostgreSQL column types.
+        Types without an exact Arrow equivalent are kept as text.
+        """
+        fields = []
+        for col in columns:
+            arrow_type = PG_ARROW_TYPES.get(col['type'], pa.string())
+            fields.append(pa.field(col['name'], arrow_type, nullable=col['nullable'] == 'YES'))
+        return pa.schema(fields)
+
+    def _typed_select(self, table_name: str, columns: List[Dict]) -> str:
+        """
+        Build the SELECT used for typed output. Columns without an Arrow
+        type (numeric, json, arrays, etc.) are read as text to keep their
+        exact value.
+        """
+        select_cols = []
+        for col in columns:
+            name = col['name']
+            if col['type'] in PG_ARROW_TYPES:
+                select_cols.append(f'"{name}"')
+            else:
+                select_cols.append(f'"{name}"::text AS "{name}"')
+        return f'SELECT {", ".join(select_cols)} FROM "{table_name}"'
+
+    def _copy_select(self, table_name: str, columns: List[Dict] = None,
+                     limit: int = None, where: str = None, text_booleans: bool = True) -> str:
+        """
+        Build the SELECT used by the COPY engine.
+        Booleans are written as True/False, like pandas does, so the CSV
+        files can be loaded by the migrate mode as before (unless
+        `text_booleans` is False, e.g. for the JSON documents).
+        With `limit` the rows are read in ctid order, so every format
+        written from the same snapshot gets the same rows.
+        """
+        if columns:
+            select_cols = []
+            for col in columns:
+                name = col['name']
+                if col['type'] == 'boolean' and text_booleans:
+                    select_cols.append(
+                        f"CASE WHEN \"{name}\" THEN 'True' WHEN NOT \"{name}\" THEN 'False' END AS \"{name}\""
+                    )
+                else:
+                    select_cols.append(f'"{name}"')
+            query = f'SELECT {", ".join(select_cols)} FROM "{table_name}"'
+        else:
+            query = f'SELECT * FROM "{table_name}"'
+        if where:
+            query += f" WHERE {where}"
+        if limit:
+            query += f" ORDER BY ctid LIMIT {limit}"
+        return query
+
+    def copy_table_data(self, table_name: str, columns: List[Dict] = None,
+                        output_formats: List[str] = ("csv", "ndjson"),
+                        output_dir: str = "extracted_data",
+                        limit: int = None, where: str = None,
+                        file_name: str = None, compression: str = None, part: int = None) -> int:
+        """
+        Extract a table with COPY ... TO STDOUT and write PostgreSQL's own
+        CSV output straight to disk, with no pandas or Python object per cell.
+        Timestamps, numerics and NULLs (empty unquoted values) are written
+        exactly as stored in the database.
+        The NDJSON file is built from row_to_json() of the same columns the
+        same way. All the formats are read in one REPEATABLE READ transaction
+        (or from the exported snapshot, see use_snapshot), so they have the
+        same rows.
+        `where` and `file_name` are used to extract a range of the table
+        to its own files (the shard `part`). `compression` (gzip or zstd)
+        compresses the files while they are written.
+        Return the number of rows written. On errors the partial files are
+        removed and the error is raised.
+        """
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        file_name = file_name or table_name
+        json_select = self._copy_select(table_name, columns, limit, where, text_booleans=False)
+        json_select = f'SELECT row_to_json(t) FROM ({json_select}) t'
+        copy_queries = {
+            'csv': f"COPY ({self._copy_select(table_name, columns, limit, where)}) TO STDOUT WITH CSV HEADER",
+            # One JSON document per row. The CSV format with control
+            # characters as quote/delimiter keeps the JSON text untouched
+            # (row_to_json escapes control characters itself)
+            'ndjson': f"COPY ({json_select}) TO STDOUT WITH CSV QUOTE e'\\x01' DELIMITER e'\\x02'",
+        }
+        total_rows = 0
+        total_bytes = 0
+        paths = []
+        cursor = self.conn.cursor()
         try:
-            # Create a copy for JSON export with datetime conversion
-            df_json = df.copy()
-
-            # Convert datetime columns to strings to avoid overflow issues
-            for col in df_json.columns:
-                if df_json[col].dtype == 'datetime64[ns]' or \
-                   pd.api.types.is_datetime64_any_dtype(df_json[col]):
-                    df_json[col] = df_json[col].astype(str)
-                elif df_json[col].dtype == 'object':
-                    # Handle mixed types that might contain dates
-                    try:
-                        # Check if any values look like timestamps
-                        sample_vals = df_json[col].dropna().head(5)
-                        if len(sample_vals) > 0:
-                            for val in sample_vals:
-                                if pd.api.types.is_datetime64_any_dtype(
-                                        pd.to_datetime(val, errors='ignore')):
-                                    df_json[col] = df_json[col].astype(str)
-                                    break
-                    except Exception:
-                        # If there's any issue, convert to string to be safe
-                        pass
-
-            df_json.to_json(json_path, orient='records', indent=2)
-            print(f"Saved {table_name} JSON data to {json_path}")
+            if not self.snapshot_id:
+                # Each COPY would read the table at a different moment
+                self.conn.rollback()
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            for output_format in output_formats:
+                path = os.path.join(output_dir, output_file_name(file_name, output_format, compression))
+                paths.append(path)
+                with open_output(path, compression) as f:
+                    cursor.copy_expert(copy_queries[output_format], f)
+                total_rows = cursor.rowcount
+                if total_rows <= 0:
+                    # Do not keep files for empty tables (same as save_table_data)
+                    os.remove(path)
+                    print(f"Extracted 0 rows from table '{table_name}'")
+                    return 0
+                total_bytes += os.path.getsize(path)
+                self._report(table_name, part, total_rows=total_rows, bytes=total_bytes)
+                print(f"Saved {table_name} data to {path}")
         except Exception as e:
-            print(f"Error saving JSON for {table_name}: {e}")
-            # Try alternative JSON export method
-            try:
-                # Fallback: convert all problematic columns to strings
-                df_safe = df.copy()
-                for col in df_safe.columns:
-                    if df_safe[col].dtype in ['datetime64[ns]', 'object']:
-                        df_safe[col] = df_safe[col].astype(str)
-
-                df_safe.to_json(json_path, orient='records', indent=2)
-                print(f"Saved {table_name} JSON data to {json_path} "
-                      "(fallback)")
-            except Exception as e2:
-                msg = f"Failed to save JSON for {table_name} even with "
-                msg += f"fallback: {e2}"
-                print(msg)
-                # Create a simple JSON with just the error info
-                error_data = {
-                    "error": f"Could not export {table_name} to JSON",
-                    "original_error": str(e),
-                    "fallback_error": str(e2),
-                    "row_count": len(df),
-                    "columns": list(df.columns)
-                }
-                with open(json_path, 'w') as f:
-                    json.dump(error_data, f, indent=2)
-                print(f"Saved error info for {table_name} to {json_path}")
+            print(f"Error copying data from table {table_name}: {e}")
+            self.conn.rollback()
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        finally:
+            cursor.close()
+            # Close the read transaction (unless it is reading an exported snapshot)
+            if not self.snapshot_id:
+                self.conn.rollback()
+
+        print(f"Extracted {total_rows} rows from table '{table_name}'")
+        return total_rows
 
     def generate_database_report(self, tables_info: List[Dict]) -> str:
         """
@@ -241,16 +562,20 @@ class PSQL:
         report.append("\n## Tables Summary\n")
 
         total_rows = 0
+        total_size = 0
         for table_info in tables_info:
             if table_info:
                 table_name = table_info['table_name']
                 row_count = table_info['row_count']
                 column_count = len(table_info['columns'])
                 total_rows += row_count
+                total_size += table_info['total_size']
+                estimated = "" if table_info['row_count_exact'] else " (estimated)"
 
                 report.append(f"### {table_name}")
-                report.append(f"- Rows: {row_count:,}")
+                report.append(f"- Rows: {row_count:,}{estimated}")
                 report.append(f"- Columns: {column_count}")
+                report.append(f"- Size: {_format_size(table_info['total_size'])}")
                 report.append("")
 
                 # Column details
@@ -263,16 +588,317 @@ class PSQL:
                     report.append(f"- `{col_name}` ({col_type}) {nullable}")
                 report.append("")
 
+                if table_info['constraints']:
+                    report.append("**Constraints:**")
+                    for constraint in table_info['constraints']:
+                        report.append(
+                            f"- `{constraint['name']}` {constraint['type']}: {constraint['definition']}"
+                        )
+                    report.append("")
+
+                if table_info['indexes']:
+                    report.append("**Indexes:**")
+                    for index in table_info['indexes']:
+                        report.append(f"- `{index['name']}`: {index['definition']}")
+                    report.append("")
+
         report.append("\n## Summary Statistics")
         report.append(f"- Total rows across all tables: {total_rows:,}")
         avg_rows = total_rows // len(tables_info) if tables_info else 0
         report.append(f"- Average rows per table: {avg_rows:,}")
+        report.append(f"- Total size: {_format_size(total_size)}")
+        if any(not info['row_count_exact'] for info in tables_info if info):
+            report.append("- Row counts are estimates from pg_class.reltuples (use --exact-counts to count them)")
 
         return "\n".join(report)
 
-    def extract_all_data(self, save_data: bool = True, row_limit: int = None, filename_prefix: str = ""):
+    def get_primary_key_column(self, table_name: str) -> str:
+        """
+        Return the primary key column of a table, or None if the table
+        has no primary key or it spans more than one column.
+        """
+        for constraint in self.get_table_info(table_name).get('constraints', []):
+            if constraint['type'] == 'PRIMARY KEY' and len(constraint['columns']) == 1:
+                return constraint['columns'][0]
+        return None
+
+    def get_table_ranges(self, table_name: str, shards: int,
+                         sample_rows: int = 100000) -> List[Dict]:
+        """
+        Split a table in (up to) `shards` ranges that can be read concurrently.
+        Tables with a single column primary key are split in keyset ranges,
+        the boundaries are the quantiles of a TABLESAMPLE of the key.
+        Other tables are split in ctid block ranges (PostgreSQL 14+ reads
+        them with TID range scans, older versions filter a full scan).
+        Return a list of dicts with the range bounds and its WHERE clause.
+        """
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT reltuples::bigint, relpages FROM pg_class WHERE oid = %s::regclass",
+                (f'"{table_name}"',)
+            )
+            reltuples, relpages = cursor.fetchone()
+            key = self.get_primary_key_column(table_name)
+            if key:
+                method, column, quoted, cast = 'keyset', key, f'"{key}"', ''
+                percent = min(100.0, max(0.01, 100.0 * sample_rows / max(reltuples, 1)))
+                fractions = [i / shards for i in range(1, shards)]
+                cursor.execute(
+                    f'SELECT (percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY "{key}"))::text[] '
+                    f'FROM "{table_name}" TABLESAMPLE SYSTEM (%s)',
+                    (fractions, percent)
+                )
+                # Already in the order of the key (and its collation), only
+                # the duplicates are removed: sorting the text would not
+                # keep that order (e.g. '10' < '9')
+                boundaries = list(dict.fromkeys(b for b in (cursor.fetchone()[0] or []) if b is not None))
+            else:
+                method, column, quoted, cast = 'ctid', 'ctid', 'ctid', '::tid'
+                step = relpages // shards
+                boundaries = [f"({i * step},0)" for i in range(1, shards)] if step else []
+
+            bounds = [None] + boundaries + [None]
+            ranges = []
+            for i in range(len(bounds) - 1):
+                lower, upper = bounds[i], bounds[i + 1]
+                conditions = []
+                if lower is not None:
+                    conditions.append(cursor.mogrify(f"{quoted} >= %s{cast}", (lower,)).decode())
+                if upper is not None:
+                    conditions.append(cursor.mogrify(f"{quoted} < %s{cast}", (upper,)).decode())
+                ranges.append({
+                    'index': i,
+                    'method': method,
+                    'column': column,
+                    'lower': lower,
+                    'upper': upper,
+                    'where': " AND ".join(conditions) or None,
+                })
+            return ranges
+        except psycopg2.Error as e:
+            print(f"Error splitting table {table_name}: {e}")
+            self.conn.rollback()
+            return []
+        finally:
+            cursor.close()
+
+    def process_table_shard(self, table: str, columns: List[Dict], shard: Dict,
+                            engine: str = "pandas", fetch_size: int = 10000,
+                            output_formats: List[str] = ("csv", "ndjson"),
+                            compression: str = None) -> int:
+        """
+        Extract one range of a table (see get_table_ranges) to its own
+        shard files. The pandas engine has no range support, the stream
+        engine is used instead.
+        Return the number of rows written.
+        """
+        file_name = f"{table}.part-{shard['index']:04d}"
+        print(f"\nProcessing table: {table} (shard {shard['index']}: {shard['where']})")
+        self._report(table, shard['index'], started=time.time())
+        if engine == "copy" and not TYPED_FORMATS.intersection(output_formats):
+            return self.copy_table_data(
+                table, columns, output_formats, where=shard['where'], file_name=file_name,
+                compression=compression, part=shard['index']
+            )
+        return self.stream_table_data(
+            table, columns, output_formats, fetch_size=fetch_size, where=shard['where'],
+            file_name=file_name, compression=compression, part=shard['index']
+        )
+
+    def save_manifest(self, table: str, shards: List[Dict],
+                      output_formats: List[str] = ("csv", "ndjson"),
+                      compression: str = None, output_dir: str = "extracted_data"):
+        """
+        Save the manifest of a table extracted in shards: the ranges and
+        the files of each shard, so the table can be rebuilt from them.
+        Shards without rows have no files.
+        """
+        manifest = {
+            'table_name': table,
+            'formats': list(output_formats),
+            'method': shards[0]['method'],
+            'column': shards[0]['column'],
+            'total_rows': sum(shard['rows'] for shard in shards),
+            'shards': [
+                {
+                    'index': shard['index'],
+                    'files': {
+                        output_format: output_file_name(
+                            f"{table}.part-{shard['index']:04d}", output_format, compression
+                        )
+                        for output_format in output_formats
+                    } if shard['rows'] else None,
+                    'lower': shard['lower'],
+                    'upper': shard['upper'],
+                    'rows': shard['rows'],
+                }
+                for shard in sorted(shards, key=lambda shard: shard['index'])
+            ],
+        }
+        manifest_path = os.path.join(output_dir, f"{table}.manifest.json")
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+        print(f"Saved {table} manifest ({len(shards)} shards) to {manifest_path}")
+
+    def process_table(self, table: str, save_data: bool = True, row_limit: int = None,
+                      engine: str = "pandas", fetch_size: int = 10000,
+                      output_formats: List[str] = ("csv", "ndjson"), compression: str = None,
+                      table_info: Dict = None):
+        """
+        Get the table information and, if requested, extract and save its data.
+        `table_info` is given by parallel workers, which have no catalog.
+        Return a tuple (table_info, extracted_rows).
+        """
+        print(f"\nProcessing table: {table}")
+        table_info = table_info or self.get_table_info(table)
+        rows = 0
+        if table_info and save_data:
+            self._report(table, started=time.time())
+            # Files of a previous extraction (other formats, a manifest) would hide the new ones
+            remove_table_files(table)
+            if engine == "stream" or TYPED_FORMATS.intersection(output_formats):
+                # Parquet and Arrow need the typed rows, always read through a server-side cursor
+                rows = self.stream_table_data(
+                    table, table_info['columns'], output_formats, fetch_size=fetch_size,
+                    limit=row_limit, compression=compression
+                )
+            elif engine == "copy":
+                rows = self.copy_table_data(
+                    table, table_info['columns'], output_formats, limit=row_limit, compression=compression
+                )
+            else:
+                df = self.extract_table_data(table, limit=row_limit)
+                if not df.empty:
+                    rows = len(df)
+                    self.save_table_data(table, df, compression=compression, output_formats=output_formats)
+                    self._report(table, total_rows=rows)
+        return table_info, rows
+
+    def process_tables_parallel(self, tables: List[str], jobs: int, shards: int = 1,
+                                shard_threshold: int = 1000000, **kwargs) -> Dict[str, tuple]:
+        """
+        Process tables in a pool of `jobs` processes, each one with its own
+        database connection.
+        Tables are submitted largest-first (using row estimates) so a huge
+        table does not start last and leave the other workers idle.
+        Tables with at least `shard_threshold` estimated rows are split in
+        `shards` ranges extracted concurrently to their own shard files.
+        All workers read from the same exported snapshot, so tables and
+        shards are consistent with each other even on a live database.
+        Return a dict {table: (table_info, extracted_rows)}, extracted_rows
+        is None for the tables that failed (their files are removed).
+        """
+        estimates = {table: self.get_table_info(table).get('row_count', 0) for table in tables}
+        ordered = sorted(tables, key=lambda t: estimates[t], reverse=True)
+
+        sharded = {}
+        if shards > 1 and not kwargs.get('row_limit'):
+            for table in ordered:
+                if estimates[table] >= shard_threshold:
+                    ranges = self.get_table_ranges(table, shards)
+                    if len(ranges) > 1:
+                        sharded[table] = ranges
+
+        # The coordinating transaction must stay open until all workers finish
+        snapshot_conn, snapshot_id = self.export_snapshot()
+
+        # Spawn the workers: the connections and threads (metrics, snapshot)
+        # of this process must not be forked
+        context = multiprocessing.get_context('spawn')
+        # The workers update the progress of their tables and shards in shared memory
+        counters = None
+        if self.metrics:
+            slots = [(table, None) for table in ordered if table not in sharded]
+            slots += [(table, shard['index']) for table, ranges in sharded.items() for shard in ranges]
+            counters = self.metrics.share(slots, context)
+
+        results = {}
+        shard_rows = {table: [] for table in sharded}
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=_init_worker,
+                                 initargs=(self.connection_params, snapshot_id, counters)) as executor:
+            futures = {}
+            for table in ordered:
+                table_info = self.get_table_info(table)
+                if table in sharded:
+                    results[table] = (table_info, 0)
+                    remove_table_files(table)
+                    for shard in sharded[table]:
+                        future = executor.submit(
+                            _process_shard_worker, table, table_info['columns'], shard, kwargs
+                        )
+                        futures[future] = (table, shard)
+                else:
+                    future = executor.submit(_process_table_worker, table, table_info, kwargs)
+                    futures[future] = (table, None)
+
+            for future in as_completed(futures):
+                table, shard = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error processing table {table}: {e}")
+                    result = None if shard else (self.get_table_info(table), None)
+                if shard:
+                    shard_rows[table].append(dict(shard, rows=result))
+                else:
+                    results[table] = result
+                if self.metrics and not shard:
+                    self.metrics.finish(table, failed=result[1] is None)
+
+        if snapshot_conn:
+            snapshot_conn.close()
+
+        output_formats = kwargs.get('output_formats', ("csv", "ndjson"))
+        for table, table_shards in shard_rows.items():
+            table_info = results[table][0]
+            if any(shard['rows'] is None for shard in table_shards):
+                # Without all its shards the table is not saved at all
+                print(f"Error processing table {table}: some shards failed, its shard files are removed")
+                self.remove_shard_files(table, table_shards, output_formats, kwargs.get('compression'))
+                results[table] = (table_info, None)
+            else:
+                self.save_manifest(table, table_shards, output_formats, kwargs.get('compression'))
+                results[table] = (table_info, sum(shard['rows'] for shard in table_shards))
+            if self.metrics:
+                self.metrics.finish(table, failed=results[table][1] is None)
+        return results
+
+    def remove_shard_files(self, table: str, shards: List[Dict],
+                           output_formats: List[str] = ("csv", "ndjson"),
+                           compression: str = None, output_dir: str = "extracted_data"):
+        """
+        Remove the files of the shards of a table (see process_table_shard).
+        """
+        for shard in shards:
+            for output_format in output_formats:
+                name = output_file_name(f"{table}.part-{shard['index']:04d}", output_format, compression)
+                path = os.path.join(output_dir, name)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def extract_all_data(self, save_data: bool = True, row_limit: int = None, filename_prefix: str = "",
+                         engine: str = "pandas", fetch_size: int = 10000, jobs: int = 1,
+                         output_formats: List[str] = ("csv", "ndjson"), shards: int = 1,
+                         shard_threshold: int = 1000000,
+                         compression: str = None, exact_counts: bool = False):
         """
         Main method to extract all database information and data.
+        The structure of all tables is read once from the catalog (see
+        load_catalog), with estimated row counts unless `exact_counts`.
+        engine "pandas" reads each table at once, "stream" reads it in
+        chunks of `fetch_size` rows through a server-side cursor and "copy"
+        writes the COPY output of PostgreSQL straight to disk.
+        Each table is written once to one file per `output_formats` ("csv",
+        "ndjson", "parquet" and/or "arrow"). Parquet and Arrow files are typed,
+        so with them the tables are always read through a server-side cursor.
+        `compression` (gzip or zstd) compresses the CSV and NDJSON files while
+        they are written.
+        With `jobs` > 1 tables are processed in parallel worker processes
+        and tables with more than `shard_threshold` estimated rows are read
+        in `shards` concurrent ranges (see process_tables_parallel).
+        Tables that fail are not saved (their partial files are removed).
+        Return the list of failed tables.
         """
         if not self.connect():
             return
@@ -283,23 +909,49 @@ class PSQL:
             if not tables:
                 print("No tables found in the database.")
                 return
+            self.load_catalog(exact_counts=exact_counts)
+            if self.metrics and save_data:
+                self.metrics.expect({table: self.get_table_info(table).get('row_count') for table in tables})
+
+            options = {
+                'save_data': save_data,
+                'row_limit': row_limit,
+                'engine': engine,
+                'fetch_size': fetch_size,
+                'output_formats': output_formats,
+                'compression': compression,
+            }
+            if not save_data:
+                # Nothing to extract, the catalog has everything
+                results = {table: (self.get_table_info(table), 0) for table in tables}
+            elif jobs > 1:
+                results = self.process_tables_parallel(
+                    tables, jobs, shards=shards, shard_threshold=shard_threshold, **options
+                )
+            else:
+                results = {}
+                for table in tables:
+                    try:
+                        results[table] = self.process_table(table, **options)
+                    except Exception as e:
+                        print(f"Error processing table {table}: {e}")
+                        self.conn.rollback()
+                        results[table] = (self.get_table_info(table), None)
+                    if self.metrics:
+                        self.metrics.finish(table, failed=results[table][1] is None)
 
-            # Get detailed info for each table
+            # Get detailed info for each table (keep the alphabetical order)
             tables_info = []
             extracted_data = {}
-
+            failed = []
             for table in tables:
-                print(f"\nProcessing table: {table}")
-                table_info = self.get_table_info(table)
+                table_info, rows = results[table]
                 if table_info:
                     tables_info.append(table_info)
-
-                    # Extract data if requested
-                    if save_data:
-                        df = self.extract_table_data(table, limit=row_limit)
-                        if not df.empty:
-                            extracted_data[table] = df
-                            self.save_table_data(table, df)
+                if rows is None:
+                    failed.append(table)
+                elif rows:
+                    extracted_data[table] = rows
 
             # Generate and save report
             report = self.generate_database_report(tables_info)
@@ -318,8 +970,72 @@ class PSQL:
             print(f"Processed {len(tables)} tables")
             if save_data:
                 print(f"Data saved for {len(extracted_data)} tables")
-            print("Check the 'extracted_data' directory for CSV and JSON "
-                  "files")
+            if failed:
+                print(f"Failed tables (not saved): {', '.join(failed)}")
+            print("Check the 'extracted_data' directory for the extracted files")
+            return failed
 
         finally:
             self.disconnect()
+
+
+def _format_size(size: int) -> str:
+    """
+    Format a size in bytes for the reports (e.g. 12.3 MB).
+    """
+    for unit in ["bytes", "kB", "MB", "GB"]:
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "TB"
+    return f"{size:,} {unit}" if unit == "bytes" else f"{size:,.1f} {unit}"
+
+
+# Connection used by each worker process of PSQL.process_tables_parallel
+# and the snapshot all of them read from
+_worker_db = None
+_worker_snapshot_id = None
+
+
+def _init_worker(connection_params, snapshot_id=None, counters=None):
+    """
+    Open one database connection per worker process.
+    The progress of the tables is written to the shared `counters`.
+    """
+    global _worker_db, _worker_snapshot_id
+    _worker_db = PSQL(**connection_params)
+    if not _worker_db.connect():
+        raise ConnectionError("Worker failed to connect to the database.")
+    _worker_db.metrics = WorkerMetrics(counters) if counters else None
+    _worker_snapshot_id = snapshot_id
+
+
+def _start_task():
+    """
+    Attach the worker connection to the shared snapshot before each task.
+    """
+    if _worker_snapshot_id:
+        _worker_db.use_snapshot(_worker_snapshot_id)
+
+
+def _process_table_worker(table, table_info, options):
+    """
+    Process a single table using the worker process connection.
+    """
+    _start_task()
+    return _worker_db.process_table(table, table_info=table_info, **options)
+
+
+def _process_shard_worker(table, columns, shard, options):
+    """
+    Extract a range of a table using the worker process connection.
+    """
+    _start_task()
+    return _worker_db.process_table_shard(
+        table, columns, shard,
+        engine=options['engine'],
+        fetch_size=options['fetch_size'],
+        output_formats=options['output_formats'],
+        compression=options['compression']
+    )
@@ -0,0 +1,380 @@
+"""
+Read the files saved by the extract mode for the migrate mode.
+Tables are read in chunks of rows, so memory depends on the chunk size and
+not on the table size, and each row is returned as a record read like the
+dicts returned by RealDictCursor (see ckan_migrate.records.Record).
+The chunks can also be read as Arrow record batches (see TableRows.batches),
+to be transformed by columns with no Python work per row.
+"""
+
+import csv
+import json
+import os
+import re
+import threading
+from queue import Queue, Empty, Full
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from compression import find_extracted_file, open_input
+from db import PG_ARROW_TYPES
+from ckan_migrate.records import batch_records
+
+
+EXTRACTED_DATA_FOLDER = 'extracted_data'
+
+# Rows per chunk (default for --chunk-size)
+CHUNK_SIZE = 10000
+
+# Bytes parsed at once by the Arrow CSV reader
+CSV_BLOCK_SIZE = 16 * 1024 * 1024
+
+# Text values of the extracted files can have newlines
+CSV_PARSE_OPTIONS = pa_csv.ParseOptions(newlines_in_values=True)
+
+# Values written for booleans by the extract engines (pandas and PostgreSQL)
+CSV_TRUE_VALUES = ['True', 'true', 't']
+CSV_FALSE_VALUES = ['False', 'false', 'f']
+
+# Columns of each extracted table, from tables_info.json (see load_tables_columns)
+_tables_columns = None
+
+
+def load_tables_columns(tables_info_path='tables_info.json'):
+    """ Return the columns of each table ({table_name: columns}) saved
+        by the extract mode in tables_info.json, or an empty dict if the
+        file does not exist.
+    """
+    global _tables_columns
+    if _tables_columns is None:
+        _tables_columns = {}
+        if os.path.exists(tables_info_path):
+            with open(tables_info_path) as f:
+                for table_info in json.load(f):
+                    _tables_columns[table_info['table_name']] = table_info['columns']
+        else:
+            print(f"{tables_info_path} not found, CSV column types will be inferred")
+    return _tables_columns
+
+
+def csv_column_types(table_name):
+    """ Return the Arrow type of each column of a table for the CSV parser.
+        Types without an Arrow equivalent are read as text and cast by
+        PostgreSQL when inserted.
+    """
+    return {
+        col['name']: PG_ARROW_TYPES.get(col['type'], pa.string())
+        for col in load_tables_columns().get(table_name, [])
+    }
+
+
+def lenient_type(arrow_type):
+    """ Type to read again a CSV column whose values are not valid `arrow_type`
+        values: integers are read as floats (pandas writes integer columns
+        with NULLs as 10.0) and other types as text. None for text columns.
+    """
+    if pa.types.is_integer(arrow_type):
+        return pa.float64()
+    if pa.types.is_string(arrow_type):
+        return None
+    return pa.string()
+
+
+def restore_types(batch, column_types):
+    """ Cast the columns of `batch` read with a lenient type back to their
+        type ({column: type}) when all their values fit (e.g. 10.0 is 10).
+        The others are written as read, PostgreSQL casts or rejects them.
+    """
+    arrays = list(batch.columns)
+    for name, arrow_type in column_types.items():
+        position = batch.schema.get_field_index(name)
+        if position < 0:
+            continue
+        try:
+            arrays[position] = pc.cast(arrays[position], arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            pass
+    return pa.RecordBatch.from_arrays(arrays, names=batch.schema.names)
+
+
+def _failed_column(error, csv_path):
+    """ Name of the column of a CSV conversion error (In CSV column #2: ...) """
+    match = re.match(r'In CSV column #(\d+)', str(error))
+    if not match:
+        return None
+    with open_input(csv_path) as f:
+        names = next(csv.reader([f.readline().decode()]))
+    position = int(match.group(1))
+    return names[position] if position < len(names) else None
+
+
+def _split_batches(batches, chunk_size):
+    """ Split Arrow record batches in batches of at most `chunk_size` rows """
+    for batch in batches:
+        for offset in range(0, batch.num_rows, chunk_size):
+            yield batch.slice(offset, chunk_size)
+
+
+def read_csv_batches(csv_path, chunk_size=CHUNK_SIZE):
+    """ Read CSV files like the ones extracted with extract mode and yield
+        Arrow record batches of at most `chunk_size` rows.
+        Column types come from tables_info.json and the file is parsed
+        by the Arrow CSV reader, booleans and NULLs (empty values) included,
+        so there is no per-cell Python work.
+        Compressed files (.gz, .zst) are found and decompressed transparently.
+    """
+    # Shard files are named {table}.part-0000.csv
+    table_name = os.path.basename(csv_path).split('.')[0]
+    csv_path = f"{EXTRACTED_DATA_FOLDER}/{csv_path}"
+    found_path = find_extracted_file(csv_path)
+    if found_path is None:
+        print(f"CSV file not found: {csv_path}")
+        return
+
+    column_types = csv_column_types(table_name)
+    # Columns read with a lenient type: {column: type of the column}
+    relaxed = {}
+    rows_read = 0
+    while True:
+        # The rows already yielded are skipped without converting them again
+        read_options = pa_csv.ReadOptions(block_size=CSV_BLOCK_SIZE, skip_rows_after_names=rows_read)
+        convert_options = pa_csv.ConvertOptions(
+            column_types=column_types,
+            true_values=CSV_TRUE_VALUES,
+            false_values=CSV_FALSE_VALUES,
+            strings_can_be_null=True,
+            # "" is an empty string, only unquoted empty values are NULL
+            # (not Arrow's default NA, null, N/A... which are text values here)
+            null_values=[''],
+            quoted_strings_can_be_null=False,
+        )
+        try:
+            with open_input(found_path) as f:
+                reader = pa_csv.open_csv(
+                    f, read_options=read_options, parse_options=CSV_PARSE_OPTIONS, convert_options=convert_options
+                )
+                for batch in _split_batches(reader, chunk_size):
+                    if relaxed:
+                        batch = restore_types(batch, relaxed)
+                    rows_read += batch.num_rows
+                    yield batch
+            return
+        except pa.ArrowInvalid as e:
+            # Values written in another format (e.g. by pandas): the column is
+            # read again from the failing block with a lenient type
+            name = _failed_column(e, found_path)
+            arrow_type = lenient_type(column_types[name]) if name in column_types else None
+            if arrow_type is None:
+                raise
+            print(f"Reading {found_path} column {name} as {arrow_type} from row {rows_read}: {e}")
+            relaxed.setdefault(name, column_types[name])
+            column_types[name] = arrow_type
+
+
+def read_parquet_batches(parquet_path, columns=None, chunk_size=CHUNK_SIZE):
+    """ Read Parquet files like the ones extracted with extract mode
+        (--output-format parquet) and yield Arrow record batches of at most
+        `chunk_size` rows.
+        Values keep their original type (NULLs are None), so no
+        type conversion is needed.
+        Use `columns` to read only some of the table columns.
+    """
+    parquet_path = f"{EXTRACTED_DATA_FOLDER}/{parquet_path}"
+    if os.path.exists(parquet_path) is False:
+        print(f"Parquet file not found: {parquet_path}")
+        return
+    parquet_file = pq.ParquetFile(parquet_path)
+    yield from _split_batches(parquet_file.iter_batches(batch_size=chunk_size, columns=columns), chunk_size)
+
+
+def read_arrow_batches(arrow_path, chunk_size=CHUNK_SIZE):
+    """ Read Arrow IPC files like the ones extracted with extract mode
+        (--output-format arrow) and yield Arrow record batches of at most
+        `chunk_size` rows.
+        The file is memory-mapped: record batches are read without parsing
+        or copying.
+    """
+    arrow_path = f"{EXTRACTED_DATA_FOLDER}/{arrow_path}"
+    if os.path.exists(arrow_path) is False:
+        print(f"Arrow file not found: {arrow_path}")
+        return
+    with pa.memory_map(arrow_path) as source:
+        reader = pa.ipc.open_file(source)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        yield from _split_batches(batches, chunk_size)
+
+
+def read_manifest_batches(manifest_path, chunk_size=CHUNK_SIZE):
+    """ Read a table extracted in shards (see PSQL.save_manifest),
+        reading its shard files in order.
+    """
+    with open(f"{EXTRACTED_DATA_FOLDER}/{manifest_path}") as f:
+        manifest = json.load(f)
+    if 'arrow' in manifest['formats']:
+        output_format, read = 'arrow', read_arrow_batches
+    elif 'parquet' in manifest['formats']:
+        output_format, read = 'parquet', read_parquet_batches
+    elif 'csv' in manifest['formats']:
+        output_format, read = 'csv', read_csv_batches
+    else:
+        print(f"No Arrow, Parquet or CSV files in manifest: {manifest_path}")
+        return
+    for shard in manifest['shards']:
+        if shard['files']:
+            yield from read(shard['files'][output_format], chunk_size=chunk_size)
+
+
+def read_table_batches(table_name, chunk_size=CHUNK_SIZE):
+    """ Read the extracted data of a table in Arrow record batches.
+        Tables extracted in shards are read from their manifest. When a
+        table was saved in several formats Arrow files are preferred, then
+        Parquet and then CSV files.
+    """
+    if os.path.exists(f"{EXTRACTED_DATA_FOLDER}/{table_name}.manifest.json"):
+        return read_manifest_batches(f"{table_name}.manifest.json", chunk_size)
+    if os.path.exists(f"{EXTRACTED_DATA_FOLDER}/{table_name}.arrow"):
+        return read_arrow_batches(f"{table_name}.arrow", chunk_size)
+    if os.path.exists(f"{EXTRACTED_DATA_FOLDER}/{table_name}.parquet"):
+        return read_parquet_batches(f"{table_name}.parquet", chunk_size=chunk_size)
+    return read_csv_batches(f"{table_name}.csv", chunk_size)
+
+
+def read_table_chunks(table_name, chunk_size=CHUNK_SIZE):
+    """ Read the extracted data of a table in lists of records (see
+        read_table_batches and ckan_migrate.records.batch_records)
+    """
+    for batch in read_table_batches(table_name, chunk_size):
+        yield batch_records(batch)
+
+
+def prefetch(chunks, depth=1, rows=True):
+    """ Iterate the rows of `chunks` while the next `depth` chunks are read
+        in a background thread, so reading (and decompressing) the files
+        overlaps with writing the current chunk to the database.
+        With `rows=False` the chunks themselves are yielded.
+    """
+    queue = Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def read():
+        try:
+            for chunk in chunks:
+                put(chunk)
+                if stop.is_set():
+                    return
+            put(done)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                item = queue.get(timeout=0.1)
+            except Empty:
+                if not thread.is_alive() and queue.empty():
+                    return
+                continue
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            if rows:
+                yield from item
+            else:
+                yield item
+    finally:
+        # The importer may stop before the end of the table
+        stop.set()
+
+
+def split_batch(batch, key, parts):
+    """ Split an Arrow record batch in `parts` batches by the hash of its
+        `key` columns, computed once for the whole batch (see --table-workers)
+    """
+    frame = batch.select(list(key)).to_pandas()
+    ids = pd.util.hash_pandas_object(frame, index=False).to_numpy() % parts
+    return [batch.filter(pa.array(ids == part)) for part in range(parts)]
+
+
+def partition_where(partition):
+    """ SQL condition to read the rows of the partition (key, part, parts)
+        of a table from the database (the same hash is used for every row
+        but it is not the one of split_batch)
+    """
+    key, part, parts = partition
+    columns = ", ".join(f'"{column}"::text' for column in key)
+    return f"mod(hashtext(concat_ws(E'\\x1f', {columns}))::bigint + 2147483648, {parts}) = {part}"
+
+
+def load_db_table(old_db, table_name, chunk_size=CHUNK_SIZE, partition=None):
+    """ Load a table straight from the old database (see PSQL.iter_table_records).
+        Return an iterator of records, the table is read `chunk_size` rows
+        at a time in the background (see prefetch).
+        `partition` (key, part, parts) reads only the rows of one part
+        of the table (see --table-workers).
+    """
+    where = partition_where(partition) if partition else None
+    return prefetch(old_db.iter_table_records(table_name, chunk_size, where=where))
+
+
+class TableRows:
+    """ Rows of an extracted table, read `chunk_size` rows at a time in
+        the background (see prefetch).
+        Iterate it for the rows as records, or call batches() for the Arrow
+        record batches (see ckan_migrate.mapping.import_batches).
+    """
+
+    def __init__(self, table_name, chunk_size=CHUNK_SIZE):
+        self.table_name = table_name
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        return prefetch(read_table_chunks(self.table_name, self.chunk_size))
+
+    def batches(self):
+        return prefetch(read_table_batches(self.table_name, self.chunk_size), rows=False)
+
+
+class QueueRows:
+    """ Rows of one part of an extracted table, received as Arrow record
+        batches from the process that reads the table (see
+        scheduler.run_partitioned), like TableRows.
+        None ends the rows, an exception is raised.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch_records(batch)
+
+    def batches(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+
+
+def load_table(table_name, chunk_size=CHUNK_SIZE):
+    """ Load the extracted data of a table.
+        Return the rows (see TableRows), the table is read `chunk_size`
+        rows at a time in the background.
+    """
+    return TableRows(table_name, chunk_size)
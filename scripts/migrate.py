@@ -7,10 +7,17 @@ and data.
 import argparse
 import json
 import logging
-import os
-import pandas as pd
 import psycopg2.extras
+from functools import partial
 from db import PSQL
+from loaders import CHUNK_SIZE, load_db_table, load_table, read_table_batches
+from scheduler import foreign_key_dependencies, run_partitioned, run_steps
+from ckan_migrate.transaction import COMMIT_EVERY
+from ckan_migrate.key_index import KeyIndex
+from ckan_migrate.upsert import target_table
+from ckan_migrate.logs import LOG_EVERY, LOG_SECONDS, setup_logging
+from ckan_migrate.metrics import INTERVAL, STATUS_FILE, Metrics, row_estimates
+from ckan_migrate.mapping import MAPPINGS
 from ckan_migrate.user import import_users
 from ckan_migrate.group import import_groups
 from ckan_migrate.vocabulary import import_vocabularies
@@ -35,15 +42,68 @@ from ckan_migrate.term_translation import import_term_translations
 from ckan_migrate.tracking_raw import import_tracking_raw
 
 
-# Configure logging to output to both stdout and file
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('migration.log')
-    ]
-)
+# Tables imported in migrate mode: final_logs key, table, importer and
+# the ID registries it uses to filter its rows
+IMPORT_STEPS = [
+    ('users', 'user', import_users, ()),
+    ('groups', 'group', import_groups, ()),
+    ('vocabularies', 'vocabulary', import_vocabularies, ()),
+    ('tags', 'tag', import_tags, ()),
+    # Do not migrate packages with creator_user_id that does not exist in the new DB
+    ('packages', 'package', import_packages, ('valid_users_ids', 'valid_groups_ids')),
+    ('resources', 'resource', import_resources, ('valid_packages_ids',)),
+    ('package_extras', 'package_extra', import_package_extras, ()),
+    ('package_tags', 'package_tag', import_package_tags, ()),
+    ('members', 'member', import_members, ()),
+    ('group_extras', 'group_extra', import_group_extras, ()),
+    ('resource_views', 'resource_view', import_resource_views, ()),
+    ('activities', 'activity', import_activities, ()),
+    ('activity_details', 'activity_detail', import_activity_details, ()),
+    ('dashboards', 'dashboard', import_dashboards, ('valid_users_ids',)),
+    ('system_info', 'system_info', import_system_info, ()),
+    ('task_status', 'task_status', import_task_status, ()),
+    ('user_following_groups', 'user_following_group', import_user_following_groups, ('valid_users_ids',)),
+    ('user_following_datasets', 'user_following_dataset', import_user_following_datasets, ('valid_users_ids',)),
+    ('package_relationships', 'package_relationship', import_package_relationships, ()),
+    ('ratings', 'rating', import_ratings, ()),
+    ('term_translations', 'term_translation', import_term_translations, ()),
+    ('tracking_raw', 'tracking_raw', import_tracking_raw, ()),
+]
+
+# The step that builds each ID registry. Registries are used to filter
+# the rows of other tables, not logged
+ID_REGISTRIES = {
+    'valid_users_ids': 'users',
+    'valid_groups_ids': 'groups',
+    'valid_packages_ids': 'packages',
+}
+
+# Steps that can be split between --table-workers processes, with the key
+# (the unique columns of the new table) that decides the part of each row.
+# The others keep state between rows (e.g. the names in use)
+PARTITION_KEYS = {
+    'resources': ('id',),
+    'package_extras': ('id',),
+    'package_tags': ('id',),
+    'members': ('id',),
+    'resource_views': ('id',),
+    'activities': ('id',),
+    'activity_details': ('id',),
+    'dashboards': ('user_id',),
+    'user_following_groups': ('follower_id', 'object_id'),
+    'user_following_datasets': ('follower_id', 'object_id'),
+    'tracking_raw': ('user_key', 'url', 'tracking_type', 'access_timestamp'),
+}
+
+# Partitioned steps written by an Upserter: the existing keys of their table
+# are read once and shared with the workers. The other ones are merged from
+# a staging table (see StagedUpserter)
+SHARED_KEY_INDEXES = {
+    'resources', 'package_tags', 'resource_views', 'dashboards', 'user_following_groups', 'user_following_datasets',
+}
+
+
+log = logging.getLogger(__name__)
 
 
 def parse_args():
@@ -55,12 +115,125 @@ def parse_args():
             'CKAN Database Migrator\n'
             'Extract data from old CKAN PostgreSQL database and migrate to new database\n'
             'The "mode" parameter defines if you want to migrate to a new CKAN DB instance '
+            '(from the extracted files or, with "direct", straight from the old database) '
             'or just extract the old database data or structure.\n'
         )
     )
 
     parser.add_argument(
-        '--mode', choices=['migrate', 'structure', 'extract'], default='migrate', help='Migration mode (default: migrate)'
+        '--mode', choices=['migrate', 'direct', 'structure', 'extract'], default='migrate',
+        help='Migration mode (default: migrate)'
+    )
+
+    parser.add_argument(
+        '--engine', choices=['copy', 'stream', 'pandas'], default='copy',
+        help=(
+            'Extraction engine for the extract mode (default: copy). '
+            '"copy" writes the PostgreSQL COPY output straight to disk, '
+            '"stream" reads tables in chunks through a server-side cursor to keep memory flat '
+            'and "pandas" loads each table in memory'
+        )
+    )
+    parser.add_argument(
+        '--fetch-size', type=int, default=10000,
+        help='Rows fetched per round trip by the stream engine (default: 10000)'
+    )
+
+    parser.add_argument(
+        '--chunk-size', type=int, default=CHUNK_SIZE,
+        help=(
+            f'Rows read at a time from the extracted files by the migrate mode '
+            f'or from the old database by the direct mode (default: {CHUNK_SIZE})'
+        )
+    )
+
+    parser.add_argument(
+        '--commit-every', type=int, default=COMMIT_EVERY,
+        help=(
+            f'Rows written to the new database between commits (default: {COMMIT_EVERY}). '
+            'Each batch is written in a savepoint, rows that fail are skipped and saved in quarantine/'
+        )
+    )
+    parser.add_argument(
+        '--log-every', type=int, default=LOG_EVERY,
+        help=(
+            f'Log one row of each table every N rows read (default: {LOG_EVERY}, 1 logs every row). '
+            'Warnings and errors are always logged'
+        )
+    )
+    parser.add_argument(
+        '--log-seconds', type=float, default=LOG_SECONDS,
+        help=f'Also log one row of each table every N seconds (default: {LOG_SECONDS}, 0 to disable)'
+    )
+    parser.add_argument(
+        '--status-file', default=STATUS_FILE,
+        help=(
+            f'JSON file rewritten with the progress of each table: rows, rows per second and ETA '
+            f'(default: {STATUS_FILE}). Used by the extract, migrate and direct modes'
+        )
+    )
+    parser.add_argument(
+        '--prometheus-file',
+        help=(
+            'Also write the progress to this file in the Prometheus text format, e.g. '
+            '/var/lib/node_exporter/textfile_collector/ckan_migrator.prom'
+        )
+    )
+    parser.add_argument(
+        '--metrics-interval', type=float, default=INTERVAL,
+        help=f'Seconds between two updates of the status files (default: {INTERVAL})'
+    )
+    parser.add_argument('--progress', action='store_true', help='Show a progress line on the console')
+
+    parser.add_argument(
+        '--output-format', nargs='+', choices=['csv', 'ndjson', 'parquet', 'arrow'], default=['csv', 'ndjson'],
+        help=(
+            'File formats for the extract mode (default: csv ndjson). Each table is read once '
+            'and written to all of them. "parquet" writes typed and compressed Parquet files, '
+            '"arrow" typed Arrow IPC files that the migrate mode memory-maps. '
+            'The migrate mode reads the Arrow, Parquet or CSV files'
+        )
+    )
+    parser.add_argument(
+        '--compress', choices=['none', 'gzip', 'zstd'], default='none',
+        help=(
+            'Compress the extracted CSV and JSON files while they are written (default: none). '
+            'zstd uses all CPU cores and requires the zstandard package'
+        )
+    )
+    parser.add_argument(
+        '--exact-counts', action='store_true',
+        help=(
+            'Count the rows of every table with COUNT(*) for the reports. '
+            'By default the PostgreSQL row estimates are used (no table scans)'
+        )
+    )
+    parser.add_argument(
+        '--jobs', type=int, default=1,
+        help=(
+            'Number of tables processed in parallel, each worker with its own connection (default: 1). '
+            'In migrate and direct modes each table is imported once the tables it depends on are done'
+        )
+    )
+
+    parser.add_argument(
+        '--table-workers', type=int, default=1,
+        help=(
+            'Number of worker processes importing each large table in migrate and direct modes, '
+            'each one with its own connections and a part of the rows (default: 1)'
+        )
+    )
+
+    parser.add_argument(
+        '--shards', type=int, default=None,
+        help=(
+            'Number of ranges read concurrently for big tables when --jobs > 1 '
+            '(default: same as --jobs). Each range is saved to its own shard file'
+        )
+    )
+    parser.add_argument(
+        '--shard-threshold', type=int, default=1000000,
+        help='Estimated rows from which a table is extracted in shards (default: 1000000)'
     )
 
     parser.add_argument('--old-host', default='localhost', help='Old database host (default: localhost)')
@@ -100,37 +273,83 @@ def get_old_db_connection(args):
     return old_db
 
 
-def load_from_csv(csv_path):
-    """ Load CSV files like the ones extracted with extract mode
-        and return a list of dicts similar to the ones returned by
-        RealDictCursor.
+def connect_new_db(args):
+    """
+    Connect to the new database, with the cursor used by the importers.
+    Return None if the connection fails.
+    """
+    new_db = PSQL(
+        host=args.new_host,
+        port=args.new_port,
+        dbname=args.new_dbname,
+        user=args.new_user,
+        password=args.new_password
+    )
+    if not new_db.connect():
+        return None
+    # Configure cursor to return dictionaries
+    new_db.cursor = new_db.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    # Used by the importers (see ckan_migrate.transaction.BatchTransaction)
+    new_db.commit_every = args.commit_every
+    # Used by the importers (see ckan_migrate.logs.RowLog)
+    new_db.log_every = args.log_every
+    new_db.log_seconds = args.log_seconds
+    return new_db
+
+
+def import_dependencies(new_db):
+    """
+    Get the steps each import step must wait for: the tables referenced by
+    its foreign keys in the new DB, the ID registries it uses and the tables
+    read by its importer to reject orphan rows, with no foreign key in the
+    new DB (the references of its mapping, see ckan_migrate.mapping).
+    """
+    steps = {table: name for name, table, _, _ in IMPORT_STEPS}
+    foreign_keys = foreign_key_dependencies(new_db.conn, steps)
+    dependencies = {}
+    for name, table, _, registries in IMPORT_STEPS:
+        tables = foreign_keys[table] | {reference['table'] for reference in MAPPINGS[table].references}
+        dependencies[name] = {steps[t] for t in tables if t in steps}
+        dependencies[name] |= {ID_REGISTRIES[registry] for registry in registries}
+    return dependencies
+
+
+def open_import_worker(args, snapshot_id, metrics=None):
+    """
+    Open the connections of an import worker (see --jobs): one to the new
+    database and, in direct mode, one to the old database reading from
+    the snapshot `snapshot_id`. The importers of the worker update `metrics`.
+    Return (new_db, old_db, load).
+    """
+    new_db = connect_new_db(args)
+    if new_db is None:
+        raise ConnectionError("Failed to connect to the new database.")
+    new_db.metrics = metrics
+    if args.mode != 'direct':
+        return new_db, None, partial(load_table, chunk_size=args.chunk_size)
+    old_db = get_old_db_connection(args)
+    if snapshot_id:
+        old_db.use_snapshot(snapshot_id)
+    return new_db, old_db, partial(load_db_table, old_db, chunk_size=args.chunk_size)
+
+
+def open_metrics(args):
+    """
+    Start the metrics of the extraction or migration (see --status-file).
     """
-    extracted_data_folder = 'extracted_data'
-    csv_path = f"{extracted_data_folder}/{csv_path}"
-    if os.path.exists(csv_path) is False:
-        print(f"CSV file not found: {csv_path}")
-        return []
-    df = pd.read_csv(csv_path)
-
-    # Convert DataFrame to list of dicts (similar to RealDictCursor output)
-    records = df.to_dict('records')
-
-    # Handle type conversions from CSV strings
-    for record in records:
-        # Convert ANY boolean strings to actual booleans
-        for key, value in record.items():
-            if isinstance(value, str):
-                if value.lower() == 'true':
-                    record[key] = True
-                elif value.lower() == 'false':
-                    record[key] = False
-
-        # Handle NaN values (pandas represents NULL as NaN)
-        for key, value in record.items():
-            if pd.isna(value):
-                record[key] = None
-
-    return records
+    metrics = Metrics(
+        args.mode, status_file=args.status_file, prometheus_file=args.prometheus_file,
+        console=args.progress, interval=args.metrics_interval
+    )
+    metrics.begin()
+    return metrics
+
+
+def close_import_worker(worker):
+    new_db, old_db, _ = worker
+    new_db.disconnect()
+    if old_db:
+        old_db.disconnect()
 
 
 def main():
@@ -147,7 +366,7 @@ def main():
         # Just extract the old database structure
         # and optionally compare with new database structure
         old_db = get_old_db_connection(args)
-        old_db.extract_all_data(save_data=False)
+        old_db.extract_all_data(save_data=False, jobs=args.jobs, exact_counts=args.exact_counts)
         print("Old database structure extracted successfully.")
 
         # Check if new database parameters are provided for structure comparison
@@ -164,7 +383,9 @@ def main():
             if new_db.connect():
                 new_db.cursor = new_db.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
                 print("New database connection established.")
-                new_db.extract_all_data(save_data=False, filename_prefix="new_")
+                new_db.extract_all_data(
+                    save_data=False, filename_prefix="new_", jobs=args.jobs, exact_counts=args.exact_counts
+                )
                 print("New database structure extracted successfully.")
                 new_db.disconnect()
             else:
@@ -174,76 +395,133 @@ def main():
     elif args.mode == 'extract':
         # Just extract all data from old database and save to files
         old_db = get_old_db_connection(args)
-        old_db.extract_all_data(save_data=True)
-        print("All database data extracted successfully.")
+        old_db.metrics = open_metrics(args)
+        try:
+            failed = old_db.extract_all_data(
+                save_data=True, engine=args.engine, fetch_size=args.fetch_size, jobs=args.jobs,
+                output_formats=args.output_format, shards=args.shards or args.jobs,
+                shard_threshold=args.shard_threshold,
+                compression=None if args.compress == 'none' else args.compress,
+                exact_counts=args.exact_counts
+            )
+        finally:
+            old_db.metrics.close()
+        if failed:
+            print(f"Extraction failed for {len(failed)} tables: {', '.join(failed)}")
+        else:
+            print("All database data extracted successfully.")
         return
-    elif args.mode != 'migrate':
+    elif args.mode not in ('migrate', 'direct'):
         print(f"Unknown mode: {args.mode}")
         return
 
-    f = open('migration.log', 'w')
-    f.write("CKAN Database Migrator Log\n")
-    f.write("===========================\n\n")
+    # Each migration starts a new migration.log, written from a background thread
+    listener = setup_logging(mode='w')
+    try:
+        migrate(args)
+    finally:
+        # Write the records still in the queue
+        listener.stop()
+
+
+def migrate(args):
+    """
+    Import the old tables into the new database (migrate and direct modes).
+    """
+    log.info("CKAN Database Migrator Log")
 
     # The user wants to migrate to a new db
     # We'll use the CSV files extracted previously with extract mode
-    print(f"Connecting to NEW_DB: {args.new_user}@{args.new_host}:{args.new_port}/{args.new_dbname}")
-    f.write(f"Connecting to NEW_DB: {args.new_user}@{args.new_host}:{args.new_port}/{args.new_dbname}\n")
-    # Create new_db instance with provided arguments
-    new_db = PSQL(
-        host=args.new_host,
-        port=args.new_port,
-        dbname=args.new_dbname,
-        user=args.new_user,
-        password=args.new_password
-    )
-
-    if not new_db.connect():
-        print("Failed to connect to the new database.")
-        f.write("Failed to connect to the new database.\n")
-        f.close()
+    log.info("Connecting to NEW_DB: %s@%s:%s/%s", args.new_user, args.new_host, args.new_port, args.new_dbname)
+    new_db = connect_new_db(args)
+    if new_db is None:
+        log.error("Failed to connect to the new database.")
         return
 
-    # Configure cursor to return dictionaries
-    new_db.cursor = new_db.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    print("New database connection established.")
-    f.write("New database connection established.\n\n")
+    log.info("New database connection established.")
 
+    # Tables are read in chunks while they are imported
+    old_db = None
+    snapshot_conn = snapshot_id = None
+    if args.mode == 'direct':
+        # Stream the tables from the old database, no intermediate files
+        old_db = get_old_db_connection(args)
+        # Read all the tables from one snapshot of the old database
+        snapshot_conn, snapshot_id = old_db.export_snapshot()
+        if snapshot_id:
+            old_db.use_snapshot(snapshot_id)
+        log.info("Reading from OLD_DB: %s@%s:%s/%s", args.old_user, args.old_host, args.old_port, args.old_dbname)
+        load = partial(load_db_table, old_db, chunk_size=args.chunk_size)
+        # Row estimates of the old catalog
+        estimates = {table: info['row_count'] for table, info in old_db.load_catalog().items()}
+    else:
+        load = partial(load_table, chunk_size=args.chunk_size)
+        # Rows of the tables when they were extracted
+        estimates = row_estimates()
+
+    # Progress of each table (see --status-file), updated by the importers
+    metrics = open_metrics(args)
+    metrics.expect({table: estimates.get(table) for _, table, _, _ in IMPORT_STEPS})
+    new_db.metrics = metrics
+
+    # Import each table once the tables it depends on are imported, up to
+    # --jobs tables at the same time, each worker with its own connections
+    dependencies = import_dependencies(new_db)
+    if args.jobs > 1:
+        open_worker = partial(open_import_worker, args, snapshot_id, metrics)
+        close_worker = close_import_worker
+    else:
+        # A single worker with the main connections
+        def open_worker():
+            return new_db, old_db, load
+        close_worker = None
+    steps = {name: (table, importer, registries) for name, table, importer, registries in IMPORT_STEPS}
+    registries = {}
+
+    def run_import(name, worker):
+        worker_db, _, worker_load = worker
+        table, importer, uses = steps[name]
+        kwargs = {registry: registries[registry] for registry in uses}
+        metrics.start(table)
+        try:
+            if args.table_workers > 1 and name in PARTITION_KEYS:
+                # Extracted tables are read once here and split between the workers,
+                # in direct mode each worker reads its part from the old database
+                read = None if args.mode == 'direct' else partial(read_table_batches, chunk_size=args.chunk_size)
+                key_index = None
+                if name in SHARED_KEY_INDEXES:
+                    types = target_table(worker_db, table)['types']
+                    key_index = KeyIndex(worker_db, table, PARTITION_KEYS[name], types)
+                    key_index.load()
+                    worker_db.conn.commit()
+                ret = run_partitioned(
+                    table, importer, PARTITION_KEYS[name], args.table_workers,
+                    partial(open_import_worker, args, snapshot_id), kwargs, metrics, read, key_index
+                )
+            else:
+                ret = importer(worker_load(table), worker_db, **kwargs)
+        except Exception:
+            # The status shows the table as failed, not running
+            metrics.finish(table, failed=True)
+            raise
+        metrics.finish(table, ret)
+        for registry, step in ID_REGISTRIES.items():
+            if step == name:
+                registries[registry] = ret.pop(registry)
+        return ret
+
+    try:
+        results = run_steps(list(steps), dependencies, run_import, args.jobs, open_worker, close_worker)
+    finally:
+        metrics.close()
     # Capture all logs for all migrations
-    final_logs = {}
-    final_logs['users'] = import_users(load_from_csv("user.csv"), new_db)
-    valid_users_ids = final_logs['users']['valid_users_ids']
+    final_logs = {name: results[name] for name in steps}
 
-    final_logs['groups'] = import_groups(load_from_csv("group.csv"), new_db)
-    final_logs['vocabularies'] = import_vocabularies(load_from_csv("vocabulary.csv"), new_db)
-    final_logs['tags'] = import_tags(load_from_csv("tag.csv"), new_db)
-
-    # Do not migrate packages with creator_user_id that does not exist in the new DB
-    final_logs['packages'] = import_packages(load_from_csv("package.csv"), new_db, valid_users_ids=valid_users_ids)
-    valid_packages_ids = final_logs['packages']['valid_packages_ids']
-    final_logs['resources'] = import_resources(load_from_csv("resource.csv"), new_db, valid_packages_ids=valid_packages_ids)
-    final_logs['package_extras'] = import_package_extras(load_from_csv("package_extra.csv"), new_db)
-    final_logs['package_tags'] = import_package_tags(load_from_csv("package_tag.csv"), new_db)
-    # Do not migrate members from non valid users
-    final_logs['members'] = import_members(load_from_csv("member.csv"), new_db, valid_users_ids=valid_users_ids)
-    final_logs['group_extras'] = import_group_extras(load_from_csv("group_extra.csv"), new_db)
-    final_logs['resource_views'] = import_resource_views(load_from_csv("resource_view.csv"), new_db)
-    final_logs['activities'] = import_activities(load_from_csv("activity.csv"), new_db, valid_users_ids=valid_users_ids)
-    valid_activities_ids = final_logs['activities']['valid_activities_ids']
-    final_logs['activity_details'] = import_activity_details(load_from_csv("activity_detail.csv"), new_db, valid_activities_ids=valid_activities_ids)
-
-    final_logs['dashboards'] = import_dashboards(load_from_csv("dashboard.csv"), new_db, valid_users_ids=valid_users_ids)
-    final_logs['system_info'] = import_system_info(load_from_csv("system_info.csv"), new_db)
-    final_logs['task_status'] = import_task_status(load_from_csv("task_status.csv"), new_db)
-    final_logs['user_following_groups'] = import_user_following_groups(load_from_csv("user_following_group.csv"), new_db, valid_users_ids=valid_users_ids)
-    final_logs['user_following_datasets'] = import_user_following_datasets(load_from_csv("user_following_dataset.csv"), new_db, valid_users_ids=valid_users_ids)
-    final_logs['package_relationships'] = import_package_relationships(load_from_csv("package_relationship.csv"), new_db)
-    final_logs['ratings'] = import_ratings(load_from_csv("rating.csv"), new_db)
-    final_logs['term_translations'] = import_term_translations(load_from_csv("term_translation.csv"), new_db)
-    final_logs['tracking_raw'] = import_tracking_raw(load_from_csv("tracking_raw.csv"), new_db)
-
-    f.write('Migration finished\n')
-    f.close()
+    log.info('Migration finished')
+    if snapshot_conn:
+        snapshot_conn.close()
+    if old_db:
+        old_db.disconnect()
 
     f = open('migration.log.json', 'w')
     final_logs_nice = json.dumps(final_logs, indent=4)
@@ -0,0 +1,231 @@
+"""
+Run the import of the tables in parallel, following their dependencies.
+A table is imported once all the tables it depends on (foreign keys of the
+new database and the ID registries or tables read by its importer) are done.
+Large tables can also be split by the hash of their key and imported by
+several worker processes (see run_partitioned).
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from queue import Full
+from loaders import QueueRows, split_batch
+from ckan_migrate.id_registry import IdRegistry
+from ckan_migrate.key_index import KeyIndex
+from ckan_migrate.logs import setup_worker_logging, worker_log_queue
+from ckan_migrate.metrics import WorkerMetrics
+
+
+# Batches waiting in the queue of each worker of run_partitioned
+SPLIT_QUEUE_SIZE = 4
+
+
+def foreign_key_dependencies(conn, tables):
+    """ Return the tables referenced by the foreign keys of each table of
+        the new DB ({table: set of tables}), from pg_constraint.
+        Self references are ignored.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT c.conrelid::regclass::text, c.confrelid::regclass::text "
+        "FROM pg_constraint c "
+        "JOIN pg_namespace n ON n.oid = c.connamespace "
+        "WHERE c.contype = 'f' AND n.nspname = 'public'"
+    )
+    dependencies = {table: set() for table in tables}
+    for table, referenced in cursor.fetchall():
+        # regclass::text quotes reserved names ("user", "group")
+        table, referenced = table.strip('"'), referenced.strip('"')
+        if table in dependencies and table != referenced:
+            dependencies[table].add(referenced)
+    cursor.close()
+    return dependencies
+
+
+def run_steps(steps, dependencies, run_step, jobs=1, open_worker=None, close_worker=None):
+    """ Run `steps` (a list of names) with run_step(step, worker), in a pool
+        of `jobs` threads, each step once all its `dependencies`
+        ({step: set of steps}) are done.
+        Ready steps start in the order of `steps`, so with one job the
+        steps run in that order.
+        open_worker() returns the context (e.g. database connections)
+        of each thread, closed with close_worker(worker) at the end.
+        Return {step: result}. The first step that fails stops the run.
+    """
+    pending = list(steps)
+    done = set()
+    results = {}
+    workers = []
+    local = threading.local()
+    lock = threading.Lock()
+
+    def init_worker():
+        local.worker = open_worker() if open_worker else None
+        with lock:
+            workers.append(local.worker)
+
+    def run(step):
+        return run_step(step, local.worker)
+
+    executor = ThreadPoolExecutor(max_workers=jobs, initializer=init_worker)
+    running = {}
+    try:
+        while pending or running:
+            ready = [step for step in pending if dependencies.get(step, set()) <= done]
+            if not ready and not running:
+                # A dependency cycle, run the first pending step
+                print(f"Dependency cycle between {pending}, importing {pending[0]} first")
+                ready = pending[:1]
+            for step in ready[:max(jobs - len(running), 0)]:
+                pending.remove(step)
+                running[executor.submit(run, step)] = step
+                print(f"Importing {step} ({len(running)} running, {len(pending)} waiting)")
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                # Raises the errors of the step
+                results[step] = future.result()
+                done.add(step)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if close_worker:
+            for worker in workers:
+                close_worker(worker)
+    return results
+
+
+def run_partitioned(table, importer, key, workers, open_worker, registries=None, metrics=None, read=None,
+                    key_index=None):
+    """ Import a table with `workers` processes, each one importing the
+        rows of one part of the table (by the hash of its `key` columns)
+        with its own connections.
+        With `read`, a function that returns the Arrow record batches of
+        the table (see loaders.read_table_batches), the table is read once
+        in this process and each batch is split (see loaders.split_batch)
+        and sent to the workers through queues. Otherwise each worker reads
+        its own part with load(table, partition=...) (e.g. from the old
+        database, see loaders.partition_where).
+        open_worker() returns the (new_db, old_db, load) of each process and
+        `registries` ({argument: IdRegistry}) are shared with the workers
+        through shared memory, like the existing keys of the table
+        (`key_index`, a KeyIndex) so they are read once for all the workers.
+        The workers log through a queue to the handlers of this process and
+        update the progress of their part in `metrics` (see Metrics.share).
+        Return the results of the workers merged (see merge_results).
+    """
+    # Spawn the workers: the scheduler threads and the connections of
+    # this process must not be forked
+    context = multiprocessing.get_context('spawn')
+    records, listener = worker_log_queue(context)
+    counters = metrics.share([(table, part) for part in range(workers)], context) if metrics else None
+    # Queues can only be passed to the processes when they start
+    queues = [context.Queue(maxsize=SPLIT_QUEUE_SIZE) for _ in range(workers)] if read else None
+    shared_memory = []
+    handles = {}
+    for name, registry in (registries or {}).items():
+        block, handles[name] = registry.share()
+        shared_memory.append(block)
+    index_handle = None
+    if key_index is not None:
+        block, index_handle = key_index.share()
+        shared_memory.append(block)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(open_worker, records, counters, queues)) as executor:
+            futures = [
+                executor.submit(_import_partition, table, importer, key, (part, workers), handles, index_handle)
+                for part in range(workers)
+            ]
+            if read:
+                splitter = threading.Thread(target=_split_table, args=(read(table), key, queues, futures), daemon=True)
+                splitter.start()
+            results = [future.result() for future in futures]
+            if read:
+                splitter.join()
+    finally:
+        for block in shared_memory:
+            block.close()
+            block.unlink()
+        listener.stop()
+    return merge_results(results)
+
+
+def _split_table(batches, key, queues, futures):
+    """ Send each worker of run_partitioned its part of every batch, then
+        None (or the error reading the table). Workers that are done (e.g.
+        failed) get nothing else, so the others do not wait for them.
+    """
+    def send(part, item):
+        while not futures[part].done():
+            try:
+                queues[part].put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    end = None
+    try:
+        for batch in batches:
+            for part, part_batch in enumerate(split_batch(batch, key, len(queues))):
+                if part_batch.num_rows:
+                    send(part, part_batch)
+    except Exception as e:
+        end = e
+    for part in range(len(queues)):
+        send(part, end)
+
+
+def merge_results(results):
+    """ Merge the results of the import of each part of a table:
+        counters are added up and lists (warnings, errors) concatenated
+    """
+    merged = {}
+    for ret in results:
+        for name, value in ret.items():
+            if name not in merged:
+                merged[name] = list(value) if isinstance(value, list) else value
+            else:
+                merged[name] += value
+    return merged
+
+
+# Connections, metrics and queues of the worker process (see run_partitioned)
+_worker = None
+_metrics = None
+_queues = None
+
+
+def _init_worker(open_worker, records, counters=None, queues=None):
+    """
+    Set up the logging and metrics and open the connections of the worker process.
+    """
+    global _worker, _metrics, _queues
+    setup_worker_logging(records)
+    _worker = open_worker()
+    _metrics = WorkerMetrics(counters) if counters else None
+    _queues = queues
+
+
+def _import_partition(table, importer, key, partition, handles, index_handle=None):
+    new_db, _, load = _worker
+    part, parts = partition
+    print(f"Importing {table} part {part + 1}/{parts}")
+    registries = {name: IdRegistry.attach(handle) for name, handle in handles.items()}
+    # Used for the names of the quarantine files (see BatchTransaction)
+    new_db.partition = part
+    new_db.metrics = _metrics
+    # Used by the Upserter of the table instead of reading its keys again
+    new_db.key_index = KeyIndex.attach(new_db, index_handle) if index_handle else None
+    try:
+        if _queues:
+            rows = QueueRows(_queues[part])
+        else:
+            rows = load(table, partition=(key, part, parts))
+        return importer(rows, new_db, **registries)
+    finally:
+        if _metrics:
+            _metrics.flush()
+        new_db.partition = None
+        new_db.key_index = None
@@ -0,0 +1,76 @@
+import os
+import sys
+import psycopg2.extras
+import pytest
+from psycopg2.extensions import parse_dsn
+
+# The scripts are run from their folder, the tests import them the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import PSQL  # noqa: E402
+from ckan_migrate import upsert  # noqa: E402
+
+# libpq connection string of a scratch database for the tests that write
+# to PostgreSQL, e.g. "host=localhost port=5432 dbname=ckan_test user=postgres"
+TEST_DB_VARIABLE = 'CKAN_MIGRATOR_TEST_DB'
+
+
+@pytest.fixture
+def new_db(tmp_path, monkeypatch):
+    """ Connection to the test database, like the new DB of the migrate
+        mode. The quarantine files are written to a temporary folder.
+    """
+    dsn = os.environ.get(TEST_DB_VARIABLE)
+    if not dsn:
+        pytest.skip(f"{TEST_DB_VARIABLE} is not set")
+    new_db = PSQL()
+    # Only the parameters of the connection string (libpq defaults for the others)
+    new_db.connection_params = parse_dsn(dsn)
+    if not new_db.connect():
+        pytest.skip(f"Can not connect to {TEST_DB_VARIABLE}")
+    new_db.cursor = new_db.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    monkeypatch.chdir(tmp_path)
+    yield new_db
+    new_db.conn.rollback()
+    new_db.disconnect()
+
+
+@pytest.fixture
+def create_table(new_db):
+    """ Create a table for a test, dropped after it: create_table(name, columns SQL) """
+    tables = []
+
+    def create(name, columns):
+        # The types of a table are cached by name (see target_table)
+        upsert._targets.clear()
+        cursor = new_db.conn.cursor()
+        cursor.execute(f'DROP TABLE IF EXISTS "{name}"')
+        cursor.execute(f'CREATE TABLE "{name}" ({columns})')
+        new_db.conn.commit()
+        tables.append(name)
+
+    yield create
+    new_db.conn.rollback()
+    cursor = new_db.conn.cursor()
+    for name in tables:
+        cursor.execute(f'DROP TABLE IF EXISTS "{name}"')
+    new_db.conn.commit()
+
+
+@pytest.fixture
+def query(new_db):
+    """ query(sql): run and commit a statement, return its rows as tuples """
+    def query(sql):
+        cursor = new_db.conn.cursor()
+        cursor.execute(sql)
+        rows = cursor.fetchall() if cursor.description else []
+        new_db.conn.commit()
+        return rows
+
+    return query
+
+
+@pytest.fixture
+def ret():
+    """ An empty result of an import_* function """
+    return {'total_rows': 0, 'migrated_rows': 0, 'skipped_rows': 0, 'warnings': [], 'errors': []}
@@ -0,0 +1,83 @@
+import uuid
+import numpy as np
+import pyarrow as pa
+from ckan_migrate import id_registry
+from ckan_migrate.id_registry import Bytes16Set, IdRegistry, uuid_array
+
+
+def uuids(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [str(uuid.UUID(bytes=rng.bytes(16))) for _ in range(count)]
+
+
+def test_interleaved_adds(monkeypatch):
+    # Merge the pending IDs often
+    monkeypatch.setattr(id_registry, 'MERGE_MIN', 8)
+    ids = uuids(500) + ['not-a-uuid', '6F9619FF-8B86-D011-B42D-00C04FC964FF']
+    registry = IdRegistry()
+    for position, id_ in enumerate(ids):
+        registry.add(id_)
+        assert id_ in registry
+        assert ids[position // 2] in registry
+        if position + 1 < len(ids):
+            assert ids[position + 1] not in registry
+    assert len(registry) == len(ids)
+    assert sorted(registry) == sorted(ids)
+    # Other spellings of a UUID are other IDs
+    assert ids[0].upper() not in registry
+    assert ids[-1].lower() not in registry
+
+
+def test_contains_many():
+    ids = uuids(100)
+    registry = IdRegistry(ids[:50] + ['other'])
+    registry.add(ids[50])
+    column = pa.array(ids[40:60] + [None, 'other', 'missing', ids[0].upper()])
+    expected = [id_ in registry for id_ in column.to_pylist()]
+    assert expected[:11] == [True] * 11 and not any(expected[11:21])
+    assert registry.contains_many(column).tolist() == expected
+    # Sliced arrays, chunked arrays and lists
+    assert registry.contains_many(column.slice(5)).tolist() == expected[5:]
+    assert registry.contains_many(pa.chunked_array([column[:10], column[10:]])).tolist() == expected
+    assert registry.contains_many(column.to_pylist()).tolist() == expected
+
+
+def test_uuid_array():
+    ids = uuids(3)
+    values, mask = uuid_array(pa.array([ids[0], 'x', None, ids[1], ids[2]]).slice(1))
+    assert mask.tolist() == [False, False, True, True]
+    assert [value.ljust(16, b'\x00') for value in values] == [uuid.UUID(id_).bytes for id_ in ids[1:]]
+
+
+def test_share_and_attach():
+    ids = uuids(200)
+    registry = IdRegistry(ids[:100] + ['other'])
+    shared_memory, handle = registry.share()
+    try:
+        attached = IdRegistry.attach(handle)
+        assert len(attached) == 101
+        assert all(id_ in attached for id_ in ids[:100]) and 'other' in attached
+        assert attached.contains_many(ids).tolist() == [True] * 100 + [False] * 100
+        # Added IDs are only in the attached registry
+        attached.add(ids[150])
+        assert ids[150] in attached and ids[150] not in registry
+        attached.uuids.shared_memory.close()
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+
+
+def test_bytes16_set_merge(monkeypatch):
+    monkeypatch.setattr(id_registry, 'MERGE_MIN', 4)
+    # Values with trailing null bytes, that NumPy strips
+    expected = [(number * 256).to_bytes(16, 'big') for number in range(100)]
+    values = Bytes16Set(expected[:1])
+    for value in expected[1:]:
+        values.add(value)
+        assert value in values
+        assert len(values.pending) <= max(4, len(values.array) * id_registry.MERGE_RATIO)
+    assert len(values) == 100
+    assert all(value in values for value in expected)
+    assert (1).to_bytes(16, 'big') not in values
+    assert values.contains_many(np.array(expected + [b'\x01'], dtype=id_registry.UUID_DTYPE)).tolist() == [True] * 100 + [False]
+    assert list(values) == expected
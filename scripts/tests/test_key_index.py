@@ -0,0 +1,70 @@
+from datetime import datetime
+from ckan_migrate.key_index import NULL_KEY, KeyIndex, key_hash, key_label, key_text
+from ckan_migrate.upsert import Upserter
+
+
+def test_null_key_text():
+    assert key_text(None) == NULL_KEY
+    assert key_text('None') == 'None'
+    assert key_hash((key_text(None),)) != key_hash(('None',))
+    assert key_label(('a', NULL_KEY)) == 'a, NULL'
+
+
+def test_existing_keys(new_db, create_table, query):
+    create_table('test_keys', 'a text, b text')
+    query("INSERT INTO test_keys VALUES ('x', '1'), ('x', NULL), ('None', 'None')")
+
+    index = KeyIndex(new_db, 'test_keys', ('a', 'b'), {'a': 'text', 'b': 'text'})
+    keys = [('x', '1'), ('x', '2'), ('x', NULL_KEY), ('x', 'None'), ('None', 'None')]
+    # Keys with NULL values never exist, like in the unique indexes
+    assert index.existing(keys) == {('x', '1'), ('None', 'None')}
+    index.add([('x', '2')])
+    assert index.existing(keys) == {('x', '1'), ('x', '2'), ('None', 'None')}
+
+
+def test_keys_normalized_by_type(new_db, create_table, query):
+    create_table('test_keys', 'k double precision, ts timestamp')
+    query("INSERT INTO test_keys VALUES (10, '2020-01-01 00:00:00.5')")
+
+    index = KeyIndex(new_db, 'test_keys', ('k', 'ts'), {'k': 'double precision', 'ts': 'timestamp without time zone'})
+    normalized = index.normalize({('10.0', '2020-01-01T00:00:00.500'), ('bad', '2020-01-01')})
+    assert normalized[('10.0', '2020-01-01T00:00:00.500')] == ('10', '2020-01-01 00:00:00.5')
+    # Invalid values are kept, their rows fail when written
+    assert normalized[('bad', '2020-01-01')] == ('bad', '2020-01-01')
+    assert index.existing(normalized.values()) == {('10', '2020-01-01 00:00:00.5')}
+
+
+def test_upsert_null_keys(new_db, create_table, query, ret):
+    create_table('test_keys', 'a text, b text, v text, UNIQUE (a, b)')
+    query("INSERT INTO test_keys VALUES ('x', NULL, 'old'), ('x', 'None', 'old')")
+
+    fields = ('a', 'b', 'v')
+    upsert = Upserter(new_db, 'test_keys', ret, key=('a', 'b'))
+    upsert.add_values(fields, ('x', None, 'new'))
+    upsert.add_values(fields, ('x', None, 'new'))
+    upsert.add_values(fields, ('x', 'None', 'new'))
+    upsert.close()
+
+    # NULLs are never equal: both NULL rows are inserted, 'None' is updated
+    assert ret['migrated_rows'] == 3
+    assert ret['errors'] == []
+    assert query("SELECT b, v FROM test_keys ORDER BY b NULLS FIRST, v") == [
+        (None, 'new'), (None, 'new'), (None, 'old'), ('None', 'new'),
+    ]
+
+
+def test_upsert_float_and_timestamp_keys(new_db, create_table, query, ret):
+    create_table('test_keys', 'k double precision, ts timestamp, v text, UNIQUE (k, ts)')
+    query("INSERT INTO test_keys VALUES (10, '2020-01-01 00:00:00.123', 'old'), (2.5, '2021-01-01', 'old')")
+
+    fields = ('k', 'ts', 'v')
+    upsert = Upserter(new_db, 'test_keys', ret, key=('k', 'ts'))
+    upsert.add_values(fields, (10.0, datetime(2020, 1, 1, 0, 0, 0, 123000), 'new'))
+    upsert.add_values(fields, ('2.50', '2021-01-01 00:00:00', 'new'))
+    upsert.add_values(fields, ('bad', '2021-01-01', 'new'))
+    upsert.add_values(fields, (3, '2022-01-01', 'new'))
+    upsert.close()
+
+    assert ret['migrated_rows'] == 3
+    assert len(ret['errors']) == 1 and ret['errors'][0].startswith('Error importing test_keys bad, 2021-01-01:')
+    assert query("SELECT k, v FROM test_keys ORDER BY k") == [(2.5, 'new'), (3.0, 'new'), (10.0, 'new')]
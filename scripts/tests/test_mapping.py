@@ -0,0 +1,77 @@
+import pyarrow as pa
+import pytest
+from ckan_migrate.group import transform_group_batch
+from ckan_migrate.id_registry import IdRegistry
+from ckan_migrate.mapping import MAPPINGS
+from ckan_migrate.package import MAPPING as PACKAGE_MAPPING, transform_package_batch
+
+
+def old_rows(mapping, count=8, fallback=False, not_null=()):
+    """ Old rows with every column migrated or dropped by `mapping` (and the
+        new columns of its fallbacks with `fallback`), some of them NULL
+        (but the `not_null` ones)
+    """
+    columns = list(mapping.keep) + list(mapping.rename.values()) + list(mapping.drop) + list(mapping.fallback.values())
+    if fallback:
+        columns += list(mapping.fallback)
+    return [
+        {
+            column: None if (row + position) % 3 == 0 and column not in not_null else f"{column}-{row}"
+            for position, column in enumerate(columns)
+        }
+        for row in range(count)
+    ]
+
+
+@pytest.mark.parametrize('fallback', [False, True])
+@pytest.mark.parametrize('table', sorted(MAPPINGS))
+def test_transform_batch_matches_values(table, fallback):
+    mapping = MAPPINGS[table]
+    rows = old_rows(mapping, fallback=fallback)
+    batch = mapping.transform_batch(pa.RecordBatch.from_pylist(rows))
+    assert batch.schema.names == list(mapping.fields)
+    assert batch.to_pylist() == [mapping.transform(row) for row in rows]
+    assert [tuple(row.values()) for row in batch.to_pylist()] == [mapping.values(row) for row in rows]
+
+
+def test_transform_batch_valid_ids():
+    mapping = MAPPINGS['resource']
+    rows = old_rows(mapping)
+    valid_ids = {'package_id': IdRegistry([rows[1]['package_id'], rows[4]['package_id']])}
+    batch = mapping.transform_batch(pa.RecordBatch.from_pylist(rows), valid_ids=valid_ids)
+    assert batch.to_pylist() == [mapping.transform(rows[1]), mapping.transform(rows[4])]
+
+
+def test_transform_group_batch():
+    rows = old_rows(MAPPINGS['group'], not_null=('id', 'name'))
+    rows[0]['name'] = rows[1]['name'] = 'dup'
+    ret = {'errors': []}
+    names_in_use = {rows[5]['name']}
+    batch = transform_group_batch(pa.RecordBatch.from_pylist(rows), ret, names_in_use)
+    names = batch.column('name').to_pylist()
+    assert names[0] == 'dup'
+    assert names[1] == f"dup_{hash(rows[1]['id'])}"
+    assert names[5] == f"{rows[5]['name']}_{hash(rows[5]['id'])}"
+    assert names[2:5] + names[6:] == [row['name'] for row in rows[2:5] + rows[6:]]
+    assert len(ret['errors']) == 2
+    assert set(names) <= names_in_use
+
+
+def test_transform_package_batch():
+    rows = old_rows(PACKAGE_MAPPING, not_null=('id', 'name', 'creator_user_id', 'owner_org'))
+    rows[3]['name'] = rows[2]['name']
+    valid_users_ids = IdRegistry(row['creator_user_id'] for row in rows if row is not rows[6])
+    valid_groups_ids = IdRegistry(row['owner_org'] for row in rows if row is not rows[7])
+    ret = {'errors': [], 'warnings': []}
+    batch = transform_package_batch(
+        pa.RecordBatch.from_pylist(rows), ret, set(), valid_users_ids, valid_groups_ids
+    )
+
+    # The package whose creator was not migrated is left out, the unknown organization is removed
+    expected = [PACKAGE_MAPPING.transform(row) for row in rows]
+    expected[3]['name'] = f"{rows[2]['name']}_{hash(rows[3]['id'])}"
+    expected[7]['owner_org'] = None
+    del expected[6]
+    assert batch.to_pylist() == expected
+    assert len(ret['errors']) == 2
+    assert len(ret['warnings']) == 1
@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+import numpy as np
+import pyarrow as pa
+from ckan_migrate.id_registry import UUID_DTYPE, Bytes16Set, IdRegistry
+from ckan_migrate.key_index import KeyIndex, key_hash
+from loaders import partition_where, split_batch
+from scheduler import merge_results, run_partitioned
+
+
+IDS = [f"id-{number}" for number in range(1000)]
+
+
+def key_index(ids):
+    """ KeyIndex of a table with the `ids`, with no database """
+    index = KeyIndex(None, 'test_parts', ('id',), {'id': 'text'})
+    index.hashes = Bytes16Set(np.array([key_hash((id_,)) for id_ in ids], dtype=UUID_DTYPE))
+    return index
+
+
+def test_split_batch():
+    batches = [pa.RecordBatch.from_pydict({'id': IDS[:600]}), pa.RecordBatch.from_pydict({'id': IDS[300:]})]
+    parts = [split_batch(batch, ('id',), 4) for batch in batches]
+    for batch_parts in parts:
+        assert all(part.num_rows for part in batch_parts)
+    # Each key is in one part, whatever its batch
+    first, second = ([set(part.column('id').to_pylist()) for part in batch_parts] for batch_parts in parts)
+    assert set().union(*first) == set(IDS[:600]) and sum(map(len, first)) == 600
+    for part in range(4):
+        assert first[part] & set(IDS[300:600]) == second[part] & set(IDS[300:600])
+
+
+def test_partition_where(new_db, create_table, query):
+    create_table('test_parts', 'id text, name text')
+    query("INSERT INTO test_parts SELECT 'id-' || n, CASE WHEN n % 3 = 0 THEN NULL ELSE 'x' END "
+          "FROM generate_series(0, 999) n")
+    parts = [
+        {row[0] for row in query(f"SELECT id FROM test_parts WHERE {partition_where((('id', 'name'), part, 3))}")}
+        for part in range(3)
+    ]
+    assert set().union(*parts) == set(IDS) and sum(map(len, parts)) == len(IDS)
+
+
+def test_merge_results():
+    merged = merge_results([
+        {'total_rows': 2, 'migrated_rows': 1, 'errors': ['a']},
+        {'total_rows': 3, 'migrated_rows': 3, 'errors': ['b', 'c']},
+    ])
+    assert merged == {'total_rows': 5, 'migrated_rows': 4, 'errors': ['a', 'b', 'c']}
+
+
+def test_key_index_share_and_attach():
+    shared_memory, handle = key_index(IDS[:10]).share()
+    try:
+        attached = KeyIndex.attach(None, handle)
+        assert (attached.table, attached.key) == ('test_parts', ('id',))
+        assert attached.existing([(id_,) for id_ in IDS[5:15]]) == {(id_,) for id_ in IDS[5:10]}
+        attached.add([(IDS[20],)])
+        assert attached.existing([(IDS[20],)]) == {(IDS[20],)}
+        attached.hashes.shared_memory.close()
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+
+
+def open_worker():
+    return SimpleNamespace(), None, None
+
+
+def import_part(rows, new_db, valid_ids=None):
+    """ Importer of the test_parts rows of a worker of run_partitioned """
+    ids = [id_ for batch in rows.batches() for id_ in batch.column('id').to_pylist()]
+    return {
+        'total_rows': len(ids),
+        'ids': ids,
+        'valid_rows': int(valid_ids.contains_many(ids).sum()),
+        'existing_rows': len(new_db.key_index.existing([(id_,) for id_ in ids])),
+    }
+
+
+def test_run_partitioned():
+    def read(table):
+        for start in range(0, len(IDS), 300):
+            yield pa.RecordBatch.from_pydict({'id': IDS[start:start + 300]})
+
+    ret = run_partitioned(
+        'test_parts', import_part, ('id',), 3, open_worker,
+        registries={'valid_ids': IdRegistry(IDS[:100])}, read=read, key_index=key_index(IDS[50:150])
+    )
+    assert ret['total_rows'] == len(IDS)
+    assert sorted(ret['ids']) == sorted(IDS)
+    assert ret['valid_rows'] == 100
+    assert ret['existing_rows'] == 100
@@ -0,0 +1,42 @@
+import json
+from psycopg2.extras import execute_values
+from ckan_migrate.transaction import BatchTransaction
+
+
+def test_bisection_quarantines_only_the_bad_row(new_db, create_table, query, ret, tmp_path):
+    create_table('test_batches', 'id integer PRIMARY KEY, created timestamp')
+    rows = [(number, '2020-01-01') for number in range(10)]
+    rows[6] = (6, 'not a date')
+    written_batches = []
+
+    def write(batch):
+        written_batches.append(len(batch))
+        execute_values(transaction.cursor, 'INSERT INTO test_batches VALUES %s', batch)
+
+    transaction = BatchTransaction(new_db, 'test_batches', ret, commit_every=4)
+    written = transaction.write(rows, write, lambda row: row[0], fields=('id', 'created'))
+    transaction.close()
+
+    assert written == rows[:6] + rows[7:]
+    assert len(written_batches) > 1
+    assert ret['skipped_rows'] == 1
+    assert len(ret['errors']) == 1 and ret['errors'][0].startswith('Error importing test_batches 6:')
+    assert query("SELECT id FROM test_batches ORDER BY id") == [(number,) for number in range(10) if number != 6]
+    with open(tmp_path / 'quarantine' / 'test_batches.ndjson') as f:
+        quarantined = [json.loads(line) for line in f]
+    assert [item['row'] for item in quarantined] == [{'id': 6, 'created': 'not a date'}]
+    assert 'not a date' in quarantined[0]['error']
+
+
+def test_partition_quarantine_file(new_db, create_table, ret, tmp_path):
+    create_table('test_batches', 'id integer PRIMARY KEY')
+    new_db.partition = 3
+
+    def write(batch):
+        execute_values(transaction.cursor, 'INSERT INTO test_batches VALUES %s', batch)
+
+    transaction = BatchTransaction(new_db, 'test_batches', ret)
+    assert transaction.write([(1,), (1,)], write, lambda row: row[0]) == [(1,)]
+    transaction.close()
+
+    assert (tmp_path / 'quarantine' / 'test_batches.part-0003.ndjson').exists()
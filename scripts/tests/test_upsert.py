@@ -0,0 +1,83 @@
+import logging
+from ckan_migrate.upsert import StagedUpserter, Upserter
+
+
+FIELDS = ('id', 'name')
+
+
+def test_insert_then_update(new_db, create_table, query, ret, caplog):
+    create_table('test_upsert', 'id text PRIMARY KEY, name text')
+    query("INSERT INTO test_upsert VALUES ('a', 'old a')")
+
+    caplog.set_level(logging.INFO, logger='ckan_migrate.upsert')
+    upsert = Upserter(new_db, 'test_upsert', ret, batch_size=2)
+    for values in (('a', 'new a'), ('b', 'new b'), ('c', 'new c')):
+        upsert.add_values(FIELDS, values)
+    upsert.close()
+
+    # One batch updates a and inserts b, the next one inserts c
+    assert [r.getMessage() for r in caplog.records if 'inserted' in r.getMessage()] == [
+        " - test_upsert: 1 rows inserted, 1 updated", " - test_upsert: 1 rows inserted, 0 updated",
+    ]
+    assert ret['migrated_rows'] == 3
+    assert ret['errors'] == []
+    assert query("SELECT id, name FROM test_upsert ORDER BY id") == [('a', 'new a'), ('b', 'new b'), ('c', 'new c')]
+
+
+def test_existing_rows_left_untouched(new_db, create_table, query, ret):
+    create_table('test_upsert', 'id text PRIMARY KEY, name text')
+    query("INSERT INTO test_upsert VALUES ('a', 'old a')")
+
+    upsert = Upserter(new_db, 'test_upsert', ret, update=False)
+    upsert.add({'id': 'a', 'name': 'new a'})
+    upsert.add({'id': 'b', 'name': 'new b'})
+    upsert.close()
+
+    assert ret['migrated_rows'] == 1
+    assert ret['skipped_rows'] == 1
+    assert query("SELECT id, name FROM test_upsert ORDER BY id") == [('a', 'old a'), ('b', 'new b')]
+
+
+def test_duplicated_keys_in_a_batch(new_db, create_table, query, ret):
+    create_table('test_upsert', 'id text PRIMARY KEY, name text')
+
+    upsert = Upserter(new_db, 'test_upsert', ret)
+    upsert.add_values(FIELDS, ('a', 'first'))
+    upsert.add_values(FIELDS, ('a', 'last'))
+    upsert.close()
+
+    # Like row by row writes, the last row wins
+    assert ret['migrated_rows'] == 2
+    assert query("SELECT id, name FROM test_upsert") == [('a', 'last')]
+
+
+def test_composite_key(new_db, create_table, query, ret):
+    create_table('test_upsert', 'term text, lang_code text, term_translation text, UNIQUE (term, lang_code)')
+    query("INSERT INTO test_upsert VALUES ('hello', 'es', 'hola?')")
+
+    fields = ('term', 'lang_code', 'term_translation')
+    upsert = Upserter(new_db, 'test_upsert', ret, key=('term', 'lang_code'))
+    upsert.add_values(fields, ('hello', 'es', 'hola'))
+    upsert.add_values(fields, ('hello', 'fr', 'bonjour'))
+    upsert.add_values(fields, ('bye', 'es', 'chau'))
+    upsert.close()
+
+    assert ret['migrated_rows'] == 3
+    assert query("SELECT * FROM test_upsert ORDER BY term, lang_code") == [
+        ('bye', 'es', 'chau'), ('hello', 'es', 'hola'), ('hello', 'fr', 'bonjour'),
+    ]
+
+
+def test_staged_upsert(new_db, create_table, query, ret):
+    create_table('test_upsert', 'id text PRIMARY KEY, name text')
+    query("INSERT INTO test_upsert VALUES ('a', 'old a')")
+
+    upsert = StagedUpserter(new_db, 'test_upsert', ret)
+    for values in (('a', 'new a'), ('b', 'new b'), ('b', 'last b')):
+        upsert.add_values(FIELDS, values)
+    upsert.close()
+
+    assert ret['migrated_rows'] == 3
+    assert query("SELECT id, name FROM test_upsert ORDER BY id") == [('a', 'new a'), ('b', 'last b')]
+    # The staging tables are dropped
+    assert query("SELECT count(*) FROM pg_class WHERE relname IN ('stage_test_upsert', 'reject_test_upsert')") == [(0,)]
@@ -0,0 +1,218 @@
+"""
+Streaming writers for the extracted tables.
+A TableWriter receives the rows of a table chunk by chunk and writes each
+chunk, once, to all the requested sinks (CSV, NDJSON, Parquet and Arrow files).
+Nothing but the current chunk is kept in memory.
+"""
+
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from compression import COMPRESSION_EXTENSIONS, compressed_path, open_output
+
+
+# File extension of each output format
+OUTPUT_FORMATS = {
+    'csv': 'csv',
+    'ndjson': 'ndjson',
+    'parquet': 'parquet',
+    'arrow': 'arrow',
+}
+
+# Formats that keep the column types, written from the Arrow record batches
+TYPED_FORMATS = {'parquet', 'arrow'}
+
+
+def output_file_name(file_name, output_format, compression=None):
+    """ Return the name of the file of `output_format` for `file_name`.
+        Typed files are never compressed as a whole (Parquet compresses
+        each column and Arrow files are memory-mapped).
+    """
+    name = f"{file_name}.{OUTPUT_FORMATS[output_format]}"
+    if output_format in TYPED_FORMATS:
+        return name
+    return compressed_path(name, compression)
+
+
+def remove_table_files(file_name, output_dir="extracted_data"):
+    """ Remove the files of a previous extraction of `file_name`, in all the
+        output formats and compressions, and its manifest: the migrate mode
+        picks the first format it finds, a stale file would hide the new ones.
+    """
+    names = {f"{file_name}.manifest.json"}
+    for output_format in OUTPUT_FORMATS:
+        for compression in (None, *COMPRESSION_EXTENSIONS):
+            names.add(output_file_name(file_name, output_format, compression))
+    for name in names:
+        path = os.path.join(output_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class Chunk:
+    """ A chunk of rows of a table, as tuples (from a cursor) or as a DataFrame.
+        The DataFrame and the Arrow record batch are built once, when
+        the first sink needs them.
+    """
+
+    def __init__(self, columns, rows=None, frame=None):
+        self.columns = columns
+        self.rows = rows
+        self._frame = frame
+        self._batch = None
+
+    def __len__(self):
+        return len(self.rows) if self.rows is not None else len(self._frame)
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            self._frame = pd.DataFrame.from_records(self.rows, columns=self.columns)
+        return self._frame
+
+    def batch(self, schema):
+        if self._batch is None:
+            if self.rows is None:
+                raise ValueError("Typed output needs the rows read from the database")
+            values = list(zip(*self.rows))
+            arrays = [pa.array(values[i], type=field.type) for i, field in enumerate(schema)]
+            self._batch = pa.record_batch(arrays, schema=schema)
+        return self._batch
+
+
+class CSVSink:
+    """ CSV file with a header, as written by pandas """
+
+    def __init__(self, path, compression=None, schema=None):
+        self.f = open_output(path, compression, text=True)
+        self.header = True
+
+    def write(self, chunk):
+        chunk.frame.to_csv(self.f, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        self.f.close()
+
+
+class NDJSONSink:
+    """ One JSON document per line, so the file can be split and read in parallel """
+
+    def __init__(self, path, compression=None, schema=None):
+        self.f = open_output(path, compression, text=True)
+        # Dates, timestamps and numerics are written as strings
+        self.encoder = json.JSONEncoder(default=str, ensure_ascii=False, separators=(',', ':'))
+
+    def write(self, chunk):
+        if chunk.rows is None:
+            chunk.frame.to_json(
+                self.f, orient='records', lines=True, date_format='iso', date_unit='us',
+                force_ascii=False, default_handler=str
+            )
+            return
+        columns = chunk.columns
+        encode = self.encoder.encode
+        self.f.writelines(encode(dict(zip(columns, row))) + "\n" for row in chunk.rows)
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetSink:
+    """ Typed Parquet file, compressed column by column with zstd """
+
+    def __init__(self, path, compression=None, schema=None):
+        self.schema = schema
+        self.writer = pq.ParquetWriter(path, schema, compression='zstd')
+
+    def write(self, chunk):
+        self.writer.write_batch(chunk.batch(self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class ArrowSink:
+    """ Arrow IPC file (Feather v2), uncompressed so it can be memory-mapped
+        and read without parsing or copying the column buffers
+    """
+
+    def __init__(self, path, compression=None, schema=None):
+        self.schema = schema
+        self.writer = pa.ipc.new_file(path, schema)
+
+    def write(self, chunk):
+        self.writer.write_batch(chunk.batch(self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+SINKS = {
+    'csv': CSVSink,
+    'ndjson': NDJSONSink,
+    'parquet': ParquetSink,
+    'arrow': ArrowSink,
+}
+
+
+class TableWriter:
+    """ Write the chunks of a table to one file per output format.
+        Files are created with the first non empty chunk, empty tables
+        have no files.
+        `schema` (Arrow) is required for the Parquet output.
+    """
+
+    def __init__(self, file_name, output_formats, output_dir="extracted_data",
+                 compression=None, schema=None):
+        self.paths = {
+            output_format: os.path.join(output_dir, output_file_name(file_name, output_format, compression))
+            for output_format in output_formats
+        }
+        self.output_dir = output_dir
+        self.compression = compression
+        self.schema = schema
+        self.sinks = None
+        self.total_rows = 0
+
+    def write(self, chunk):
+        if not len(chunk):
+            return
+        if self.sinks is None:
+            if not os.path.exists(self.output_dir):
+                os.makedirs(self.output_dir)
+            self.sinks = []
+            for output_format, path in self.paths.items():
+                self.sinks.append(SINKS[output_format](path, self.compression, self.schema))
+        for sink in self.sinks:
+            sink.write(chunk)
+        self.total_rows += len(chunk)
+
+    def size(self):
+        """ Bytes written to the files so far """
+        return sum(os.path.getsize(path) for path in self.paths.values() if os.path.exists(path))
+
+    def close(self):
+        for sink in self.sinks or []:
+            sink.close()
+
+    def discard(self):
+        """ Close and remove the files, e.g. when the extraction failed """
+        for sink in self.sinks or []:
+            try:
+                sink.close()
+            except Exception:
+                pass
+        self.sinks = None
+        for path in self.paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False